@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""pt2_benchmark.py:  Measures the throughput of a sharded Process 2 (see
+   src/pt2_shards.py) for a range of worker counts.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from envelope import Envelope
+from pt2_shards import Shard_Router, Ticker_Sink
+
+
+#  Version info
+version_num = '0.1.0'
+version_date = '2024-10-18a'
+
+version = 'version %s (%s)' % (version_num, version_date)
+
+
+#  State of a worker
+worker = {}
+
+
+#  Response of a query of 'symbols':  a day of 1 minute bars per symbol, about 'bars' bars each
+def make_payload(symbols, bars, rnd):
+
+    result = []
+
+    for symbol in symbols:
+        close = rnd.uniform(10.0, 500.0)
+
+        timestamps, closes, volumes = [], [], []
+
+        for idx in range(bars):
+            close *= rnd.uniform(0.999, 1.001)
+
+            timestamps.append(1700000000 + 60 * idx)
+            closes.append(round(close, 4))
+            volumes.append(rnd.randint(100, 100000))
+
+        result.append({'meta': {'symbol': symbol}, 'timestamp': timestamps, 'indicators': {'quote': [{'close': closes, 'volume': volumes}]}})
+
+    return json.dumps({'chart': {'result': result, 'error': None}}, separators=(',', ':')).encode('utf-8')
+
+
+def make_messages(num_messages, num_symbols, bars, seed):
+
+    rnd = random.Random(seed)
+
+    symbols = ['S%04d' % (idx) for idx in range(num_symbols)]
+
+    messages = []
+
+    for idx in range(num_messages):
+        batch = rnd.sample(symbols, rnd.choice([1, 1, 1, 2, 3]))
+
+        envelope = Envelope(3, 'BENCH', batch, time.time_ns(), 'bench', 'https://example.com/' + '|'.join(batch), make_payload(batch, bars, rnd), entry_idx=idx)
+
+        messages.append((envelope.to_bytes(), batch))
+
+    return messages
+
+
+def worker_init(idx, outbox):
+
+    worker['sink'] = Ticker_Sink(outbox)
+    worker['seen'] = {}
+
+
+#  Stands in for Source_Generic::process_query():  parse the response and summarize each symbol
+def handler(message):
+
+    envelope = Envelope.from_bytes(message)
+
+    query_json = json.loads(envelope.payload_text())
+
+    for result in query_json['chart']['result']:
+        symbol = result['meta']['symbol']
+
+        quote = result['indicators']['quote'][0]
+
+        vwap = sum(c * v for (c, v) in zip(quote['close'], quote['volume'])) / max(1, sum(quote['volume']))
+
+        json.dumps({'symbol': symbol, 'vwap': vwap, 'high': max(quote['close']), 'low': min(quote['close'])})
+
+        #  Entry number, to check the messages of each symbol are handled in order
+        worker['sink'].write('%s %d' % (symbol, envelope.entry_idx))
+
+
+class Order_Check(object):
+
+    def __init__(self):
+
+        self.last   = {}
+        self.errors = 0
+        self.count  = 0
+
+
+    def __call__(self, message):
+
+        (symbol, entry_idx) = message.split()
+
+        entry_idx = int(entry_idx)
+
+        if self.last.get(symbol, -1) >= entry_idx:
+            self.errors += 1
+
+        self.last[symbol] = entry_idx
+        self.count += 1
+
+
+def run(num_workers, messages, batch, pin_cpus):
+
+    check = Order_Check()
+
+    released = []
+
+    router = Shard_Router(num_workers, worker_init, handler, pin_cpus=pin_cpus, max_pending=4 * batch * num_workers, on_ticker=check)
+
+    start = time.perf_counter()
+
+    for first in range(0, len(messages), batch):
+        for (idx, (message, symbols)) in enumerate(messages[first:first + batch]):
+            router.route(message, symbols, lambda idx=first + idx: released.append(idx))
+
+        router.flush()
+
+    router.join()
+
+    elapsed = time.perf_counter() - start
+
+    router.stop()
+
+    #  Ticker messages may still be on their way to the merger
+    deadline = time.monotonic() + 5.0
+
+    expected = sum(len(symbols) for (message, symbols) in messages)
+
+    while (check.count < expected) and (time.monotonic() < deadline):
+        time.sleep(0.01)
+
+    in_order = (0 == check.errors) and (check.count == expected) and (released == sorted(released)) and (len(released) == len(messages))
+
+    return elapsed, in_order
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure the throughput of a sharded Process 2.  ' + version)
+
+    parser.add_argument('--messages', type=int, default=2000, help='number of messages')
+    parser.add_argument('--symbols',  type=int, default=200,  help='number of symbols')
+    parser.add_argument('--bars',     type=int, default=390,  help='bars per symbol in a message')
+    parser.add_argument('--batch',    type=int, default=64,   help='messages routed per batch')
+    parser.add_argument('--workers',  type=str, default=None, help='comma separated worker counts (default 1 to the number of CPUs)')
+    parser.add_argument('--pin',      action='store_true',    help='pin each worker to a CPU')
+    parser.add_argument('--seed',     type=int, default=1,    help='seed of the synthetic messages')
+
+    args = parser.parse_args()
+
+    if args.workers is not None:
+        counts = [int(count) for count in args.workers.split(',')]
+    else:
+        counts = list(range(1, (os.cpu_count() or 1) + 1))
+
+    messages = make_messages(args.messages, args.symbols, args.bars, args.seed)
+
+    size = sum(len(message) for (message, symbols) in messages)
+
+    print(f"{len(messages)} messages, {size / len(messages) / 1024:.1f} KB each on average, {os.cpu_count()} CPUs")
+    print(f"")
+    print(f"workers    seconds    messages/s    MB/s    speedup    in order")
+
+    base = None
+
+    for count in counts:
+        elapsed, in_order = run(count, messages, args.batch, args.pin)
+
+        rate = len(messages) / elapsed
+
+        if base is None:
+            base = rate
+
+        print(f"{count:7d}    {elapsed:7.2f}    {rate:10.1f}    {size / elapsed / 1e6:4.1f}    {rate / base:7.2f}    {'yes' if in_order else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
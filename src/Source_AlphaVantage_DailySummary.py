@@ -93,6 +93,8 @@ class Source_AlphaVantage_DailySummary(Source_Generic):
 
         self.max_queries_per_day = 23
 
+        self.persist_query_times = True
+
 
         #  Debug attributes
         if config.runtime_params['debug_options']['src_attr_lvl2']:
@@ -123,9 +125,11 @@ class Source_AlphaVantage_DailySummary(Source_Generic):
         #  Sort list based on time
         times.sort(key=self.review_query_helper)
 
-        #  Impose max length on times list
-        if len(times) > self.max_queries_per_day:
-           times = times[:self.max_queries_per_day]
+        #  Impose max length on times list, counting queries already made today (e.g. before a restart)
+        num_queries = self.quota_remaining()
+
+        if len(times) > num_queries:
+           times = times[:num_queries]
 
         #  Create output list
         list_out = [ elem['stock'] for elem in times]
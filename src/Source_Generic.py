@@ -19,19 +19,31 @@ import re
 # BEG Source_Generic.py SPECIFIC
 from utils  import mkt_open_on_date
 
+from rate_limiter import Token_Bucket, get_host_bucket, get_quota_ledger
+
+from state_store  import Query_Time_Store, save_interval
+
+from bar_store import Bar_Store
+
+from circuit_breaker import get_breaker, decorrelated_jitter
+
+from scheduler import get_scheduler
+
+from batch_controller import Batch_Controller
+
+from envelope import Envelope, Log_Timestamp, source_ids
+
 from datetime import datetime
 from datetime import timedelta
 from datetime import date
 
 from dateutil import tz
 
-import urllib.request, urllib.error
+import urllib.request, urllib.error, urllib.parse
 import http
 
 import logging
 
-import threading
-
 import random
 
 import inspect
@@ -42,6 +54,8 @@ import time
 
 import os
 
+import threading
+
 try:
     import requests
     use_requests = True
@@ -53,9 +67,41 @@ try:
     from twisted.internet import reactor
 except ImportError as error:
     print("IMPORT ERROR:  (twisted.internet) reactor")
+
+try:
+    from twisted.internet import defer
+except ImportError as error:
+    print("IMPORT ERROR:  (twisted.internet) defer")
+
+try:
+    from twisted.internet import threads
+except ImportError as error:
+    print("IMPORT ERROR:  (twisted.internet) threads")
+
+try:
+    from twisted.internet import task
+except ImportError as error:
+    print("IMPORT ERROR:  (twisted.internet) task")
+
+try:
+    from twisted.internet import ssl
+except ImportError as error:
+    print("IMPORT ERROR:  (twisted.internet) ssl")
+
+try:
+    from twisted.web.client import Agent, HTTPConnectionPool, BrowserLikePolicyForHTTPS, readBody, PartialDownloadError
+    from twisted.web.http_headers import Headers
+    use_twisted_web = True
+except ImportError as error:
+    print("IMPORT ERROR:  (twisted.web.client) Agent")
+    use_twisted_web = False
 # END Source_Generic.py SPECIFIC
 
 
+#  Short responses and exception messages indicating the source refuses queries because they come too fast
+rate_limit_re = re.compile(r'Too Many Requests|rate limit|call frequency', re.IGNORECASE)
+
+
 class Source_Generic(object):
 
 
@@ -68,8 +114,6 @@ class Source_Generic(object):
 #       self.configure_lvl2()   #  Default specific class configs
 #       self.configure_lvl3()   #  Override specific class override
 
-        self.internal_lock = threading.Lock()
-
 
     def dump_src_attributes(self, level):
 
@@ -126,100 +170,322 @@ class Source_Generic(object):
                         self.time_of_last_query[stock][query_type] = yesterday
 
 
-    def make_query_requests(self, batch_list, query, query_sanitized, ):
+        #  Pick up the rotation through the symbols where it left off before the last restart
+        if self.persist_query_times:
+            self.query_time_store = Query_Time_Store(self.src_name)
+
+            #  Write times left unsaved by a lull in queries, and the last ones at shutdown
+            task.LoopingCall(lambda: threads.deferToThreadPool(reactor, self.get_worker_pool(), self.query_time_store.flush)).start(save_interval, now=False)
+
+            reactor.addSystemEventTrigger('before', 'shutdown', self.query_time_store.flush)
+
+            for stock in self.stock_list:
+                if 0 == len(query_types):
+                    timestamp = self.query_time_store.get(stock)
+
+                    if timestamp is not None:
+                        self.time_of_last_query[stock] = datetime.fromtimestamp(timestamp)
+                else:
+                    for query_type in query_types:
+                        timestamp = self.query_time_store.get(stock, query_type)
+
+                        if timestamp is not None:
+                            self.time_of_last_query[stock][query_type] = datetime.fromtimestamp(timestamp)
+
+
+    #  Record the time symbols were successfully queried so it survives restarts
+    def record_query_time(self, batch_list):
+
+        if not self.persist_query_times:
+            return
+
+        timestamp = datetime.now().timestamp()
+
+        for entry in batch_list:
+            if isinstance(self.time_of_last_query.get(entry['loc_symbol']), dict):
+                self.query_time_store.update(entry['loc_symbol'], entry['query_type'], timestamp)
+            else:
+                self.query_time_store.update(entry['loc_symbol'], None, timestamp)
+
+
+    #  Store of the bars of 'series' received so far, created on first use.  'overlap' defaults to 'bar_overlap'.
+    def get_bar_store(self, series, columns, overlap=None):
+
+        with self.bar_stores_lock:
+            if series not in self.bar_stores:
+                self.bar_stores[series] = Bar_Store(self.src_name, series, columns, self.bar_overlap if overlap is None else overlap)
+
+            return self.bar_stores[series]
+
+
+    #  SUBCLASS OVERRIDE
+
+    #  Merge the bars of a response into the bar stores.  Overridden by sources which query bars incrementally.
+    def store_bars(self, batch_list, query_raw):
+
+        pass
+
+
+    #  Timeout for an attempt of a query, each attempt longer than the last by a factor of 'to_backoff'
+    def query_timeout(self, attempt):
 
-        #  Make three attempts to fetch the contents pointed to by the URL
         if self.to_backoff is None:
             to_backoff = 3.0 / 2.0
         else:
             to_backoff = self.to_backoff
 
         if self.timeout is None:
-            timeout = 3.5 / to_backoff
+            timeout = 3.5
         else:
-            timeout = self.timeout / to_backoff
+            timeout = self.timeout
 
-        for attempt in [1, 2, 3, 4]:
-            timeout = timeout * to_backoff
-            try:
-                if 0 == len(config.runtime_params['ca_cert']):
-                    response = requests.get(query, headers=self.hdr, timeout=timeout)
-                else:
-                    response = requests.get(query, headers=self.hdr, timeout=timeout, proxies=config.runtime_params['proxies'], verify=config.runtime_params['ca_cert'])
-                query_raw = response.text
+        return timeout * (to_backoff ** (attempt - 1))
 
-                if response.text:
 
-                    #  Remove whitespace from beginning and end of line
-                    resp_text = response.text.strip()
+    #  Returns the response text stripped of surrounding whitespace if it is usable, otherwise None
+    def vet_response_text(self, text):
 
-                    #   01234567890123456789
-                    if '<!DOCTYPE html>' == resp_text[:15]:
-                        time.sleep(2*(attempt-1))
+        #  Remove whitespace from beginning and end of line
+        resp_text = text.strip()
 
-                    #     01234567890123456789
-                    elif '<html>' == resp_text[:6]:
-                        time.sleep(2*(attempt-1))
+        #   01234567890123456789
+        if '<!DOCTYPE html>' == resp_text[:15]:
+            return None
 
-                    #  Handle the no content case
-                    elif (0 == len(resp_text)) or ('{}' == resp_text):
-                        time.sleep(2*(attempt-1))
+        #     01234567890123456789
+        elif '<html>' == resp_text[:6]:
+            return None
 
-                    else:
+        #  Handle the no content case
+        elif (0 == len(resp_text)) or ('{}' == resp_text):
+            return None
 
-                        #  Turn off throttling of queries due to error conditions
-                        self.reset_backoff([entry['loc_symbol'] for entry in batch_list])
+        #  Handle a rate limit message in place of the data
+        elif (1024 > len(resp_text)) and rate_limit_re.search(resp_text):
+            self.note_rate_limit()
 
-                        #  Make successful return
-                        return resp_text, False
+            return None
 
-                    print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
-                    print(f"    INVALID RESPONSE:  response begins with '{response.text[:80]} ...'  (up to first 80 characters)")
+        return resp_text
 
-                else:
 
-                    print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
-                    print(f"    RESPONSE IS NOT / HAS NO TEXT")
+    #  Count responses indicating the source is rate limiting queries.  May be called from worker threads.
+    def note_rate_limit(self):
+
+        with self.rate_limit_lock:
+            self.rate_limit_hits += 1
+
 
+    #  Make one attempt to fetch the contents pointed to by the URL.  Runs on a worker thread.
+    def make_query_requests(self, batch_list, query, query_sanitized, attempt, timeout, ):
+
+        try:
+            response = self.get_requests_session().get(query, timeout=timeout)
+
+            if 429 == response.status_code:
+                self.note_rate_limit()
 
-            except Exception as e:
                 print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
-                print(f"    EXCEPTION MESSAGE:  {str(e)}")
-                # e.read().decode("utf8", 'ignore')
+                print(f"    RATE LIMITED:  HTTP 429")
 
-                time.sleep(2*(attempt-1))
+            elif response.text:
 
+                resp_text = self.vet_response_text(response.text)
 
-        #  All attempts to fetch the URL failed, handle error
-        print("ERROR FAILED TO FETCH URL '" + query_sanitized + "'")
+                if resp_text is not None:
+                    return resp_text, False
 
-        for item in batch_list:    #  TODO:  PROVIDE ABILITY TO SUPPRESS BACK-OFF
-            stock = item['loc_symbol']
+                print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
+                print(f"    INVALID RESPONSE:  response begins with '{response.text[:80]} ...'  (up to first 80 characters)")
 
-            self.backoff [stock]['major_cnt'] -= 1
+            else:
 
-            if 0 >= self.backoff [stock]['major_cnt']:
-                self.backoff [stock]['minor_reset'] *= 2   #  TODO:  PROVIDE ABILITY TO IMPOSE MAX BACK-OFF
+                print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
+                print(f"    RESPONSE IS NOT / HAS NO TEXT")
 
-                self.backoff [stock]['major_cnt'] = self.backoff [stock]['major_reset']
 
-                print(self.src_name + ":  ADJUSTING BACK-OFF '" + stock + "' new back-off:  %d" %
-                    (self.backoff [stock]['minor_reset']))
+        except Exception as e:
+            print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
+            print(f"    EXCEPTION MESSAGE:  {str(e)}")
+            # e.read().decode("utf8", 'ignore')
 
-            self.backoff [stock]['minor_cnt'] = self.backoff [stock]['minor_reset']
+
+        return None, True
+
+
+    #  Create the long-lived session used by make_query_requests().  Reusing connections avoids a TCP and TLS handshake per query.
+    #  Called from worker threads, the lock keeps two threads from each creating a session.
+    def get_requests_session(self):
+
+        with self.session_lock:
+            if self.requests_session is None:
+                self.requests_session = self.new_requests_session()
+
+            return self.requests_session
+
+
+    def new_requests_session(self):
+
+        session = requests.Session()
+
+        #  Size the connection pool to the number of concurrent queries of this source
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_concurrency())
+        session.mount('https://', adapter)
+        session.mount('http://',  adapter)
+
+        session.headers.update(self.hdr)
+
+        if 0 != len(config.runtime_params['ca_cert']):
+            proxies = config.runtime_params['proxies']
+
+            #  A proxy given on the command line is a single URL
+            if isinstance(proxies, str):
+                proxies = {'http': proxies, 'https': proxies}
+
+            session.proxies.update(proxies)
+            session.verify = config.runtime_params['ca_cert']
+
+        return session
+
+
+    #  Drop connections held by this source.  New ones are created on the next query.  Runs on the reactor thread:  the
+    #  session is swapped for a new one and the old one is closed once the queries of worker threads using it are over.
+    def reset_session(self):
+
+        with self.session_lock:
+            session = self.requests_session
+
+            self.requests_session = None
+
+        if session is not None:
+            reactor.callLater(max(60.0, 2 * self.query_timeout(self.num_attempts)), session.close)
+
+        if getattr(self, 'twisted_pool', None) is not None:
+            self.twisted_pool.closeCachedConnections()
+            self.twisted_pool  = None
+            self.twisted_agent = None
+
+
+    #  Determine whether queries for this source can be made with the non-blocking (Twisted) fetch engine
+    def use_twisted_fetch(self):
+
+        if 'reactor' != self.fetch_engine:
+            return False
+
+        #  Custom queries (e.g. Yahoo) and dry runs are handled by worker threads
+        if (self.make_query_custom is not None) or config.runtime_params['dry_run']:
+            return False
+
+        if not use_twisted_web:
+            return False
+
+        #  The Twisted agent does not tunnel through proxies, fall back to worker threads
+        if config.runtime_params['proxies']:
+            if not hasattr(self, 'warned_twisted_proxies'):
+                print(f"WARNING({self.src_name}):  'reactor' fetch engine does not support proxies.  Using 'threads' fetch engine.")
+                self.warned_twisted_proxies = True
+
+            return False
+
+        return True
+
+
+    #  Create the agent used by the non-blocking fetch engine
+    def get_twisted_agent(self):
+
+        if getattr(self, 'twisted_agent', None) is None:
+
+            if 0 == len(config.runtime_params['ca_cert']):
+                policy = BrowserLikePolicyForHTTPS()
+            else:
+                with open(config.runtime_params['ca_cert'], 'r') as fp:
+                    policy = BrowserLikePolicyForHTTPS(trustRoot=ssl.Certificate.loadPEM(fp.read()))
+
+            #  Keep connections alive between queries, one per concurrent query
+            self.twisted_pool = HTTPConnectionPool(reactor, persistent=True)
+            self.twisted_pool.maxPersistentPerHost = self.max_concurrency()
+
+            self.twisted_agent = Agent(reactor, contextFactory=policy, pool=self.twisted_pool)
+
+            self.twisted_hdr = Headers({key.encode('utf-8'): [value.encode('utf-8')] for (key, value) in self.hdr.items()})
+
+        return self.twisted_agent
+
+
+    #  Non-blocking counterpart to make_query_requests().  Returns a Deferred which fires with (query_raw, url_fetch_failed).
+    def make_query_twisted(self, batch_list, query, query_sanitized, attempt, timeout, ):
+
+        agent = self.get_twisted_agent()
+
+        d_attempt = agent.request(b'GET', query.encode('utf-8'), self.twisted_hdr)
+        d_attempt.addCallback(self.make_query_twisted_response, query_sanitized, attempt)
+        d_attempt.addTimeout(timeout, reactor)
+
+        d_attempt.addCallbacks(self.make_query_twisted_body, self.make_query_twisted_error,
+            callbackArgs=(query_sanitized, attempt), errbackArgs=(query_sanitized, attempt))
+
+        return d_attempt
+
+
+    def make_query_twisted_response(self, response, query_sanitized, attempt, ):
+
+        d_body = readBody(response)
+
+        #  Discard the body of a rate limit response, it is reported as a response without text
+        if 429 == response.code:
+            self.note_rate_limit()
+
+            print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
+            print(f"    RATE LIMITED:  HTTP 429")
+
+            d_body.addBoth(lambda _: b'')
+
+        return d_body
+
+
+    def make_query_twisted_body(self, body, query_sanitized, attempt, ):
+
+        text = body.decode('utf-8', 'replace')
+
+        if text:
+
+            resp_text = self.vet_response_text(text)
+
+            if resp_text is not None:
+                return resp_text, False
+
+            print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
+            print(f"    INVALID RESPONSE:  response begins with '{text[:80]} ...'  (up to first 80 characters)")
+
+        else:
+
+            print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
+            print(f"    RESPONSE IS NOT / HAS NO TEXT")
+
+        return None, True
+
+
+    def make_query_twisted_error(self, failure, query_sanitized, attempt, ):
+
+        #  Servers which close the connection without a content length leave a partial download, use what was read
+        if failure.check(PartialDownloadError) and failure.value.response:
+            return self.make_query_twisted_body(failure.value.response, query_sanitized, attempt)
+
+        print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
+        print(f"    EXCEPTION MESSAGE:  {failure.getErrorMessage()}")
 
         return None, True
 
 
     #  The following uses urllib.  The requests package may be better:  https://docs.python-requests.org/en/master/
-    def make_query_urllib(self, batch_list, query, query_sanitized, ):
+    def make_query_urllib(self, batch_list, query, query_sanitized, attempt, timeout, ):
 
         url_fetch_failed = False
 
         query_raw = ""
 
         try:
-            with urllib.request.urlopen(urllib.request.Request(query, data=None, headers=self.hdr)) as response:
+            with urllib.request.urlopen(urllib.request.Request(query, data=None, headers=self.hdr), timeout=timeout) as response:
 
                 #  Read response, allow up to 'num_ic_retry' partial reads
                 num_ic_retry = 10
@@ -249,31 +515,16 @@ class Source_Generic(object):
                     else:
                         query_raw = query_raw + query_raw_part.decode ('utf-8')
 
-                        #  Turn off throttling of queries due to error conditions
-                        self.reset_backoff([entry['loc_symbol'] for entry in batch_list])
-
                     break
 
         except urllib.error.URLError as e:
-            print("ERROR FETCHING URL '" + query_sanitized + "'")
+            if 429 == getattr(e, 'code', None):
+                self.note_rate_limit()
+
+            print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
             print(f"    EXCEPTION MESSAGE:  {str(e)}")
             # e.read().decode("utf8", 'ignore')
 
-            for item in batch_list:    #  TODO:  PROVIDE ABILITY TO SUPPRESS BACK-OFF
-                stock = item['loc_symbol']
-
-                self.backoff [stock]['major_cnt'] -= 1
-
-                if 0 >= self.backoff [stock]['major_cnt']:
-                    self.backoff [stock]['minor_reset'] *= 2   #  TODO:  PROVIDE ABILITY TO IMPOSE MAX BACK-OFF
-
-                    self.backoff [stock]['major_cnt'] = self.backoff [stock]['major_reset']
-
-                    print(self.src_name + ":  ADJUSTING BACK-OFF '" + stock + "' new back-off:  %d" %
-                        (self.backoff [stock]['minor_reset']))
-
-                self.backoff [stock]['minor_cnt'] = self.backoff [stock]['minor_reset']
-
             url_fetch_failed = True
 
 
@@ -286,6 +537,13 @@ class Source_Generic(object):
         return query_raw, url_fetch_failed
 
 
+    #  Dry runs respond with the contents of a file
+    def make_query_dry_run(self, batch_list, query, query_sanitized, attempt, timeout, ):
+
+        with open(self.dry_run_file, 'r') as file:
+            return file.read().replace('\n', ''), False
+
+
     #  SUBCLASS OVERRIDE
 
     def is_work_day(self, day):
@@ -303,6 +561,36 @@ class Source_Generic(object):
         return list_in
 
 
+    #  SUBCLASS OVERRIDE
+
+    #  Group today's query types into those which can be answered together by the same requests.  Each group
+    #  of more than one query type is queried as the single query type 'TYPE1+TYPE2+...' and the source splits
+    #  the response back into one log entry per query type.
+    def plan_queries(self, query_types):
+
+        return [[query_type] for query_type in query_types]
+
+
+    #  Throttle queries of the stocks in the batch after a failed fetch.  Each symbol skips 'minor_reset' cycles
+    #  between attempts, doubling (up to 'max_backoff') after every 'major_reset' failures.
+    def adjust_backoff(self, batch_list):
+
+        for item in batch_list:
+            stock = item['loc_symbol']
+
+            self.backoff [stock]['major_cnt'] -= 1
+
+            if 0 >= self.backoff [stock]['major_cnt']:
+                self.backoff [stock]['minor_reset'] = min(2 * self.backoff [stock]['minor_reset'], self.max_backoff)
+
+                self.backoff [stock]['major_cnt'] = self.backoff [stock]['major_reset']
+
+                print(self.src_name + ":  ADJUSTING BACK-OFF '" + stock + "' new back-off:  %d" %
+                    (self.backoff [stock]['minor_reset']))
+
+            self.backoff [stock]['minor_cnt'] = self.backoff [stock]['minor_reset']
+
+
     def reset_backoff(self, backoff_list):
 
         for stock in backoff_list:
@@ -313,126 +601,137 @@ class Source_Generic(object):
             self.backoff [stock]['major_cnt'] = self.backoff [stock]['major_reset']
 
 
-    def init_threads_done(self, thread_timestamp, num_threads):
+    #  Circuit breaker of the host a query goes to
+    def get_query_breaker(self, query):
 
-        with self.internal_lock:
+        host = urllib.parse.urlparse(query).netloc
 
-            #  Ensure that thread_done is present
-            if not hasattr(self, 'thread_done'):
-                self.thread_done = {}
+        return get_breaker(host, self.breaker_threshold, self.breaker_cooldown, self.breaker_cooldown_cap)
 
-            #  Check if thread_done already has an entry to record running state
-            if thread_timestamp in self.thread_done:
-                print(f"WARNING (init_threads_done()) RE-INITIALIZING TIMESTAMP '{thread_timestamp}'")
 
-            #  Remove stale entries
-            try:
-                while 2 < len(self.thread_done):
-                    stale_timestamp = sorted(self.thread_done.keys())[0]
+    #  Pick the method which makes one attempt of a query.  All return (query_raw, url_fetch_failed), either
+    #  directly (run on a worker thread) or through a Deferred (non-blocking fetch engine).
+    def get_query_fetcher(self):
 
-                    #  Remove timestamp
-                    self.thread_done.pop(stale_timestamp, None)
+        if config.runtime_params['dry_run']:
+            return self.make_query_dry_run, True
+        elif self.use_twisted_fetch():
+            return self.make_query_twisted, False
+        elif self.make_query_custom is not None:
+            return self.make_query_custom, True
+        elif use_requests:
+            return self.make_query_requests, True
+        else:
+            return self.make_query_urllib, True
 
-                    print(f"WARNING (init_threads_done()) FORCING EXPIRATION OF STALE TIMESTAMP '{stale_timestamp}'")
-            except TypeError as e:
-                print(f"ERROR(TypeError exception in 'init_threads_done()'):  {str(e)}")
 
+    #  Make a query, retrying failed attempts.  Runs on the reactor thread; attempts which block run on the shared
+    #  worker pool and the waits between attempts are scheduled on the reactor, so no thread sleeps.  Returns a
+    #  Deferred which fires with (query_raw, url_fetch_failed).
+    def fetch_with_retries(self, batch_list, query, query_sanitized, ):
 
-            #  Initialize new array for this batch of threads
-            self.thread_done[thread_timestamp] = [None] * num_threads
+        d_query = defer.Deferred()
 
-        return False
+        self.fetch_attempt(d_query, 1, 0.0, batch_list, query, query_sanitized)
 
+        return d_query
 
-    def expire_threads_done(self, thread_timestamp):
 
-        with self.internal_lock:
+    def fetch_attempt(self, d_query, attempt, delay, batch_list, query, query_sanitized, ):
 
-            #  Ensure the thread_done has an entry to record running state
-            if thread_timestamp not in self.thread_done:
-                print(f"WARNING (expire_threads_done()) ATTEMPT TO EXPIRE MISSING TIMESTAMP '{thread_timestamp}'")
-                return True
+        breaker = self.get_query_breaker(query)
 
-            #  Remove timestamp
-            self.thread_done.pop(thread_timestamp, None)
+        #  Don't send queries to a host whose breaker is open
+        if not config.runtime_params['dry_run'] and not breaker.allow():
+            print(f"CIRCUIT BREAKER({breaker.host}):  {breaker.status()}.  NOT SENDING '{query_sanitized}'")
 
-        return False
+            self.fetch_failed(d_query, attempt, batch_list, query_sanitized, skipped=(1 == attempt))
 
+            return
 
-    def mark_thread_running(self, thread_timestamp, thread_num):
+        #  Each attempt sent counts against the daily quota
+        if (self.max_queries_per_day is not None) and not config.runtime_params['dry_run']:
+            get_quota_ledger().consume(self.src_name)
 
-        with self.internal_lock:
+        fetcher, blocking = self.get_query_fetcher()
 
-            #  Ensure the thread_done has an entry to record running state
-            if thread_timestamp not in self.thread_done:
-                print(f"WARNING (mark_thread_running()) ATTEMPT TO UPDATE MISSING TIMESTAMP '{thread_timestamp}'")
-                return True
+        timeout = self.query_timeout(attempt)
 
-            if thread_num < 0 or thread_num >= len(self.thread_done[thread_timestamp]):
-                print(f"WARNING (mark_thread_running()) INVALID TRHEAD NUMBER '{thread_num}'.  SHOULD BE IN RANGE [0,{len(self.thread_done[thread_timestamp])}]")
-                return True
+        if blocking:
+            d_attempt = threads.deferToThreadPool(reactor, self.get_worker_pool(), fetcher, batch_list, query, query_sanitized, attempt, timeout)
+        else:
+            d_attempt = fetcher(batch_list, query, query_sanitized, attempt, timeout)
 
-            #  Mark this thread as running
-            self.thread_done[thread_timestamp][thread_num] = False
+        d_attempt.addErrback(self.fetch_attempt_error, query_sanitized, attempt)
+        d_attempt.addCallback(self.fetch_attempt_done, d_query, attempt, delay, batch_list, query, query_sanitized,
+            time.monotonic(), self.rate_limit_hits)
 
-        return False
 
+    def fetch_attempt_error(self, failure, query_sanitized, attempt, ):
 
-    def mark_thread_done(self, thread_timestamp, thread_num):
+        print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
+        print(f"    EXCEPTION MESSAGE:  {failure.getErrorMessage()}")
 
-        with self.internal_lock:
+        return None, True
 
-            #  Ensure the thread_done has an entry to record running state
-            if thread_timestamp not in self.thread_done:
-                print(f"WARNING (mark_thread_done()) ATTEMPT TO UPDATE MISSING TIMESTAMP '{thread_timestamp}'")
-                return True
 
-            if thread_num < 0 or thread_num >= len(self.thread_done[thread_timestamp]):
-                print(f"WARNING (mark_thread_done()) INVALID TRHEAD NUMBER '{thread_num}'.  SHOULD BE IN RANGE [0,{len(self.thread_done[thread_timestamp])}]")
-                return True
+    def fetch_attempt_done(self, result, d_query, attempt, delay, batch_list, query, query_sanitized, start, rate_limit_hits):
 
-            #  Mark this thread as done
-            self.thread_done[thread_timestamp][thread_num] = True
+        query_raw, url_fetch_failed = result
 
-        return False
+        breaker = self.get_query_breaker(query)
 
 
-    def all_threads_done(self, thread_timestamp):
+        #  Feed the outcome back to the batch controller.  Rate limit responses seen while the query was in flight count against it.
+        if self.adaptive_batch:
+            self.get_batch_controller().observe(start, len(batch_list), time.monotonic() - start, len(query_raw or ''),
+                url_fetch_failed, rate_limit_hits < self.rate_limit_hits)
 
-        with self.internal_lock:
 
-            #  Ensure the thread_done has an entry to record state
-            if thread_timestamp not in self.thread_done:
-                print(f"WARNING (all_threads_done()) ATTEMPT ACCESS MISSING TIMESTAMP '{thread_timestamp}'")
-                return True
+        if not url_fetch_failed:
+            breaker.record_success()
 
-            #  Return whether all threads are done
-            return all(self.thread_done[thread_timestamp])
+            #  Turn off throttling of queries due to error conditions
+            self.reset_backoff([entry['loc_symbol'] for entry in batch_list])
 
+            #  Make successful return
+            d_query.callback((query_raw, False))
 
-    def threads_done_status(self, thread_timestamp):
+            return
 
-        with self.internal_lock:
+        breaker.record_failure()
 
-            #  Ensure the thread_done has an entry to record state
-            if thread_timestamp not in self.thread_done:
-                print(f"WARNING (threads_done_status()) ATTEMPT ACCESS MISSING TIMESTAMP '{thread_timestamp}'")
 
-                return f"ERROR:  Bad thread timestamp '{thread_timestamp}'"
+        #  Schedule the next attempt on the reactor rather than sleeping in a thread
+        if attempt < self.num_attempts:
+            delay = decorrelated_jitter(delay, self.retry_base, self.retry_cap)
 
+            reactor.callLater(delay, self.fetch_attempt, d_query, attempt+1, delay, batch_list, query, query_sanitized)
 
-            #  Return string with state of threads
-            return str(self.thread_done[thread_timestamp])
+            return
 
+        self.fetch_failed(d_query, attempt, batch_list, query_sanitized)
 
-    def make_query(self, thread_timestamp, thread_num, query_type_src, batch_list, ):
 
-        #  Create timestamps
-        now_utc = datetime.now(tz.tzlocal())
-        now_local = now_utc.astimezone(tz.tzlocal())
+    #  All attempts to fetch the URL failed (or were refused by the circuit breaker), handle error
+    def fetch_failed(self, d_query, attempt, batch_list, query_sanitized, skipped=False):
+
+        if not skipped:
+            print("ERROR FAILED TO FETCH URL '" + query_sanitized + "'")
+
+            self.adjust_backoff(batch_list)
+
+        d_query.callback((None, True))
 
-        log_timestamp = now_utc.strftime('%Y-%m-%d %H:%M:%S.%f %Z')
-        dbg_timestamp = now_local.strftime('%Y-%m-%d %H:%M:%S.%f %Z')
+
+    #  This method makes a query:  creates the URL, fetches it and sends the response to Process 2.  Runs on the
+    #  reactor thread, which only keeps the retries and circuit breakers, and returns a Deferred which fires once
+    #  the query is done.
+    def make_query(self, query_type_src, batch_list, ):
+
+        #  Create timestamps
+        log_timestamp = Log_Timestamp(time.time_ns())
+        dbg_timestamp = log_timestamp
 
 
         #  Create query URL
@@ -443,24 +742,27 @@ class Source_Generic(object):
         if config.runtime_params['debug_options']['query']:
             print("DBG(" + self.src_name + ", " + dbg_timestamp + "):  query='" + query_sanitized + "'", flush=True)
 
-        if not config.runtime_params['dry_run']:
-            if self.make_query_custom is not None:
-                query_raw, url_fetch_failed = self.make_query_custom(batch_list,  query, query_sanitized, )
-            elif use_requests:
-                query_raw, url_fetch_failed = self.make_query_requests(batch_list,  query, query_sanitized, )
-            else:
-                query_raw, url_fetch_failed = self.make_query_urllib(batch_list,  query, query_sanitized, )
+        d_query = self.fetch_with_retries(batch_list, query, query_sanitized, )
 
-            #  If the fetch failed, indicate thread is done and return
-            if url_fetch_failed:
-                self.mark_thread_done(thread_timestamp, thread_num)
+        d_query.addCallback(self.make_query_done, batch_list, query_sanitized, query_type_loc, log_timestamp)
 
-                return
-        else:
-            with open(self.dry_run_file, 'r') as file:
-                query_raw = file.read().replace('\n', '')
+        return d_query
 
 
+    def make_query_done(self, result, batch_list, query_sanitized, query_type_loc, log_timestamp):
+
+        query_raw, url_fetch_failed = result
+
+        #  Send response to Process 2 and log it on the worker pool:  normalizing, logging and storing a response
+        #  (several MB for some sources) would otherwise hold up the queries of every source on the reactor
+        if not url_fetch_failed:
+            return threads.deferToThreadPool(reactor, self.get_worker_pool(), self.forward_query,
+                batch_list, query_sanitized, query_type_loc, query_raw, log_timestamp)
+
+
+    #  Normalize response, send it through the pipe to Process 2 and log it.  Runs on a worker thread.
+    def forward_query(self, batch_list, query_sanitized, query_type_loc, query_raw, log_timestamp):
+
         #  Normalize response (e.g. removing line breaks)
         query_raw = self.normalize_query(query_raw)
 
@@ -470,37 +772,38 @@ class Source_Generic(object):
             print("DBG:  query_raw='" + query_raw + "'")
 
 
-        #  Log response
-#       batch_str = '|'.join([batch_list[item]['qry_symbol'] for item in batch_list.keys()])
-        batch_str = '|'.join(item['qry_symbol'] for item in batch_list)
+        #  Send the response to Process 2 in an envelope, the text of the quotes log is only made when it is written
+        envelope = Envelope(self.src_id, query_type_loc, [item['qry_symbol'] for item in batch_list],
+                            getattr(log_timestamp, 'time_ns', time.time_ns()), self.version, query_sanitized, query_raw.encode('utf-8'))
 
+        with config.log_q_lock:
 
-        query_msg_head = "\n" + \
-                         "\n" + \
-                         "ENTRY[%s]:  TYPE=QUOTE  TIME=%s  QUERY_TYPE=%s  VERSION=%s\n" % ('%06d', log_timestamp, query_type_loc, self.version)
-        query_msg_body = batch_str       + "\n" + \
-                         query_sanitized + "\n" + \
-                         query_raw       + "\n"
+            #  Write sequence number into the envelope
+            envelope.entry_idx = config.qu_entry_idx
+            config.qu_entry_idx += config.qu_entry_step
 
-        with config.log_q_lock:
+            # Send response through pipe to the processing side, large responses through the shared memory ring
+            message = None
 
-            #  Write sequence number into the message string
-            query_msg_head = query_msg_head % (config.qu_entry_idx)
-            config.qu_entry_idx += 1
+            if (config.shm_ring is not None) and (config.runtime_params['ipc_shm_threshold'] <= len(envelope.payload)):
+                message = config.shm_ring.put(envelope)
 
-            #  Combine the three parts of query message together
-            query_msg = query_msg_head + query_msg_body
+            if message is None:
+                message = envelope.to_bytes()
 
-            # Send response through pipe to the processing side
-            config.sp_queue.put(query_msg)
+            config.sp_queue.put(message)
 
             # Log quote
             if config.log_quotes is not None:
-                config.log_quotes.write(query_msg)
+                config.log_quotes.write(envelope.render(query_raw))
+
 
+        #  Merge bars of the response into the bar stores
+        if self.incremental_bars:
+            self.store_bars(batch_list, query_raw)
 
-        #  Indicate thread is done
-        self.mark_thread_done(thread_timestamp, thread_num)
+        #  Record time of successful query
+        self.record_query_time(batch_list)
 
 
     def process_query(self, batch_str, query_raw, query, log_timestamp, query_type, version):
@@ -555,109 +858,272 @@ class Source_Generic(object):
             print ("    ... error continued:  query_ugly='" + query_ugly + "'")
 
 
-    #  This method (a) creates list of stocks in query, (b) executes query, and (c) schedules next batch if not all stocks have been processed
+    #  This method (a) creates the batches of stocks to be queried this cycle, (b) hands them to the scheduler shared by all sources
     def query_driver_pt1(self):
 
-        #  Init variables for query
-        thread_timestamp = time.time_ns()
+        #  Batch up symbols in list
+        batches = []
 
-        thread_num = 0
-        num_threads = min(-(len(self.stock_list_cur) // -self.max_batch), self.max_threads)
+        while 0 < len(self.stock_list_cur):
 
-        self.init_threads_done(thread_timestamp, num_threads)
+            size_query = min(self.batch_size(), len(self.stock_list_cur))
 
+            #  End the batch where the query type changes, a batch holds a single query type
+            query_type = self.stock_list_cur[0].split('::', 1)[1]
 
-        #  Batch up symbols in list and create a query for each batch
-        while (0 < len(self.stock_list_cur)) and (thread_num < self.max_threads):
+            for idx in range(1, size_query):
+                if query_type != self.stock_list_cur[idx].split('::', 1)[1]:
+                    size_query = idx
+                    break
 
+            batches.append(self.make_batch_list_pt1(self.stock_list_cur[0:size_query]))
 
-            #  Create list of stocks in this query
-            batch_list = []
+            self.stock_list_cur = self.stock_list_cur[size_query:]
 
-            size_query = min(self.max_batch, len(self.stock_list_cur))
 
+        #  The batches must be queried before the next cycle starts (or the time window closes, whichever is first)
+        horizon = self.delta_quote
 
-            #  Process batch size number of symbols
-            batch_list = self.make_batch_list_pt1(self.stock_list_cur[0:size_query])
+        if self.mkt_end_today is not None:
+            time_left = (self.mkt_end_today - datetime.now(self.mkt_time_zone)).total_seconds()
 
-            self.stock_list_cur = self.stock_list_cur[size_query:]
+            if 0 < time_left:
+                horizon = min(horizon, time_left)
 
 
-            #  Debug spawning threads
-            if config.runtime_params['debug_options']['threads']:
-                logging.info(self.src_name + "::query_driver_pt1():  create and start thread %d.", thread_num)
+        #  Debug batches
+        if config.runtime_params['debug_options']['threads']:
+            logging.info(self.src_name + "::query_driver_pt1():  submitting %d batches.", len(batches))
 
 
-            #  Spawn thread to make query (one per batch)
-            self.mark_thread_running(thread_timestamp, thread_num)
+        #  Schedule batch cleanup routine to run as soon as the last query of the cycle completes
+        d_cycle = get_scheduler().submit_cycle(self, batches, horizon)
+        d_cycle.addCallback(self.query_driver_pt2)
 
-            thrd = threading.Thread(target=self.make_query, args=(thread_timestamp, thread_num, self.query_type_src, batch_list))
-            thrd.start()
-            thread_num += 1
 
+    #  Issue query, or schedule it for when the rate limits allow
+    def launch_query(self, batch_list):
 
-        #  Schedule thread cleanup routine
-        if (0 < thread_num):
-            reactor.callLater(self.poll_sleep_time, self.query_driver_pt2, thread_timestamp)
+        delay = self.reserve_rate_slot(batch_list)
 
+        if 0.0 < delay:
+            return task.deferLater(reactor, delay, self.make_query, self.query_type_src, batch_list)
 
-    #  This method (a) checks on whether threads are still running, (b) schedule next poll if one or more threads are still running.
-    def query_driver_pt2(self, thread_timestamp):
+        return self.make_query(self.query_type_src, batch_list)
 
-        #  Report on state of threads if debugging
-        if config.runtime_params['debug_options']['threads']:
-            logging.info(self.src_name + "::query_driver_pt2():  is done=%s" % (self.threads_done_status(thread_timestamp)))
 
+    #  Take a token from the source's and the host's buckets.  Returns the number of seconds until the query may be sent.
+    def reserve_rate_slot(self, batch_list):
 
-        #  Schedule another poll if not all threads are done
-        if (not self.all_threads_done(thread_timestamp)):
-            reactor.callLater(self.poll_sleep_time, self.query_driver_pt2, thread_timestamp)
-            return
+        delay = 0.0
+
+        if self.rate_per_sec is not None:
+            if getattr(self, 'rate_bucket', None) is None:
+                self.rate_bucket = Token_Bucket(self.rate_per_sec, self.rate_burst)
+
+            delay = max(delay, self.rate_bucket.reserve())
+
+        if self.host_rate_per_sec is not None:
+            delay = max(delay, get_host_bucket(self.query_host(batch_list), self.host_rate_per_sec, self.host_rate_burst).reserve())
+
+        return delay
+
+
+    #  Host the queries of a batch's query type go to, found from the URL of the first batch of that type
+    def query_host(self, batch_list):
+
+        query_type = batch_list[0]['query_type'] if (0 < len(batch_list)) else None
+
+        if query_type not in self.query_hosts:
+            self.query_hosts[query_type] = urllib.parse.urlparse(self.make_query_url(batch_list)[0]).netloc
+
+        return self.query_hosts[query_type]
+
+
+    #  Number of queries this source can still make today
+    def quota_remaining(self):
+
+        if self.max_queries_per_day is None:
+            return None
+
+        return get_quota_ledger().remaining(self.src_name, self.max_queries_per_day)
+
+
+    #  Controller which tunes the batch size and concurrency of this source, created on first use
+    def get_batch_controller(self):
+
+        if getattr(self, 'batch_controller', None) is None:
+            self.batch_controller = Batch_Controller(self.src_name, self.max_batch, self.max_threads,
+                self.batch_min, self.batch_max or self.max_batch, self.threads_min, self.threads_max or self.max_threads,
+                self.target_latency, self.max_payload)
 
+        return self.batch_controller
 
-        #  Remove thread_timestamp list from self.thread_done
-        self.expire_threads_done(thread_timestamp)
 
+    #  Number of symbols to put in a query
+    def batch_size(self):
 
-        #  Busy wait while pause_file is present
-        while os.path.isfile(self.pause_file):
-            print(f"QUERY DRIVER PT2({self.src_name}):  Found file '{str(self.pause_file)}'.  Pausing activity while file is present.", flush=True)
+        if self.adaptive_batch:
+            return self.get_batch_controller().current_batch()
 
-            time.sleep (self.pause_sleep)
+        return self.max_batch
 
 
-        #  Schedule next iteration if there are still stocks to process
-        if 0 < len (self.stock_list_cur):
-            reactor.callLater(self.batch_sleep_time, self.query_driver_pt1)
+    #  Number of concurrent queries allowed
+    def concurrency_limit(self):
 
+        if self.adaptive_batch:
+            return self.get_batch_controller().current_threads()
 
-        #  Since this batch is done, flush the quotes file handle
+        return self.max_threads
+
+
+    #  Upper bound of concurrency_limit(), used to size connection pools
+    def max_concurrency(self):
+
+        if self.adaptive_batch:
+            return max(self.max_threads, self.threads_max or self.max_threads)
+
+        return self.max_threads
+
+
+    #  Worker pool shared by all sources.  Falls back to the reactor's pool when none was created (e.g. a source run standalone).
+    def get_worker_pool(self):
+
+        if config.worker_pool is not None:
+            return config.worker_pool
+
+        return reactor.getThreadPool()
+
+
+    #  This method reports queries which raised exceptions.  Called once all queries of a cycle are done.
+    def query_driver_pt2(self, results):
+
+        #  Report on queries if debugging
+        if config.runtime_params['debug_options']['threads']:
+            logging.info(self.src_name + "::query_driver_pt2():  is done=%s" % (str([success for (success, _) in results])))
+
+
+        #  Report any query which raised an exception
+        for (success, result) in results:
+            if not success:
+                print(f"ERROR(query_driver_pt2({self.src_name})):  QUERY RAISED EXCEPTION:  {result.getErrorMessage()}")
+
+
+        #  Since this cycle is done, flush the quotes file handle
         if config.log_quotes is not None:
             with config.log_q_lock:
                 config.log_quotes.flush()
 
 
-    #  This method (a) schedules next query, (b) determines if market is open, and (c) initiates query if market is open
-    def run_recurring_query(self):
+    #  Run run_recurring_query() now rather than at its scheduled time
+    def restart_recurring_query(self):
 
+        if (self.recurring_call is not None) and self.recurring_call.active():
+            self.recurring_call.cancel()
+
+        self.run_recurring_query()
 
-        print(self.src_name + "::run_recurring_query():  " + datetime.now(tz.tzlocal()).strftime('%Y-%m-%d %H:%M:%S.%f %Z'))
 
+    #  Pause or resume this source.  The scheduler holds the queries of a paused source.  Runs on the reactor thread.
+    def set_pause(self, pause, reason):
 
-        #  Is pause file present
-        if not hasattr(self, 'pause_file'):
-            self.pause_file = os.path.join(str(config.runtime_params['cur_dir']), 'pause.txt')
+        if pause == self.pause:
+            return
+
+        self.pause = pause
+
+        print(f"CONTROL({self.src_name}):  {'Pausing' if pause else 'Resuming'} activity ({reason}).", flush=True)
 
-        if not self.pause:
-            if os.path.isfile(self.pause_file):
-                print(f"RUN RECURRING QUERY({self.src_name}):  Found file '{str(self.pause_file)}'.  Pausing activity while file is present.", flush=True)
+        if pause:
+            #  Turn off throttling of queries due to error conditions
+            self.reset_backoff(self.backoff.keys())
 
-                self.pause = True
         else:
-            if not os.path.isfile(self.pause_file):
-                print(f"RUN RECURRING QUERY({self.src_name}):  File '{str(self.pause_file)}' not found.  Resuming activity.", flush=True)
+            get_scheduler().release(self)
+
+            #  Make up a round of queries skipped while paused unless one is still under way
+            if self.missed_cycle and self.enabled and (not self.draining) and (not get_scheduler().cycle_pending(self)):
+                self.restart_recurring_query()
+
+
+    #  Enable this source, or disable it dropping the queries already scheduled.  Runs on the reactor thread.
+    def set_enabled(self, enabled):
+
+        self.draining = False
+
+        if enabled == self.enabled:
+            return
+
+        self.enabled = enabled
+
+        print(f"CONTROL({self.src_name}):  {'Enabled' if enabled else 'Disabled'}.", flush=True)
+
+        if enabled:
+            self.restart_recurring_query()
+        else:
+            get_scheduler().cancel_cycle(self)
+
+
+    #  Let the queries already scheduled complete, then disable this source.  Runs on the reactor thread.
+    def start_drain(self):
+
+        if (not self.enabled) or self.draining:
+            return
+
+        print(f"CONTROL({self.src_name}):  Draining.", flush=True)
+
+        self.draining = True
 
-                self.pause = False
+        if not get_scheduler().cycle_pending(self):
+            self.drain_done()
+
+
+    #  Called by the scheduler when the last query of a draining source completes
+    def drain_done(self):
+
+        if self.draining:
+            print(f"CONTROL({self.src_name}):  Drained.", flush=True)
+
+            self.set_enabled(False)
+
+
+    #  Hold (release) the queries of this source while Process 2 is behind on the spool.  Runs on the reactor thread.
+    def set_spool_held(self, held, lag):
+
+        if held == self.spool_held:
+            return
+
+        self.spool_held = held
+
+        print(f"CONTROL({self.src_name}):  {'Holding' if held else 'Releasing'} queries (spool backlog {lag} bytes).", flush=True)
+
+        if not held:
+            get_scheduler().release(self)
+
+
+    #  One line summary of the state of this source for the control channel
+    def control_status(self):
+
+        if not self.enabled:
+            state = 'disabled'
+        elif self.draining:
+            state = 'draining'
+        elif self.pause:
+            state = 'paused'
+        elif self.spool_held:
+            state = 'held'
+        else:
+            state = 'running'
+
+        return f"{self.src_name}:  {state}  {get_scheduler().source_status(self)}"
+
+
+    #  This method (a) schedules next query, (b) determines if market is open, and (c) initiates query if market is open
+    def run_recurring_query(self):
+
+
+        print(self.src_name + "::run_recurring_query():  " + datetime.now(tz.tzlocal()).strftime('%Y-%m-%d %H:%M:%S.%f %Z'))
 
 
         #  Determine status with respect to time window
@@ -727,15 +1193,14 @@ class Source_Generic(object):
         #  NOTE:  If the user has requested to skip today, at this point next_query is the next WALL CLOCK time the market opens.
 
 
-        #  Override time of next query if in paused state
-        if self.pause:
-            mkt_open = False
-
-            next_query = datetime.now(self.mkt_time_zone) + timedelta(seconds = self.pause_sleep)
+        #  Skip this round of queries if paused, draining or disabled.  Resuming or enabling the source starts the missed round.
+        if self.pause or self.draining or (not self.enabled):
+            if mkt_open:
+                self.missed_cycle = True
 
-            print (f"PAUSED({self.src_name}).  Checking back in {self.pause_sleep} seconds.")
+            mkt_open = False
 
-        #  NOTE:  If the user has put the program in a pause state, at this point next_query is the time of the next poll for exiting the pause state.
+            print (f"{'PAUSED' if self.pause else 'DISABLED'}({self.src_name}).  Skipping this round of queries.")
 
 
         #  Reset back-off if market is closed or we are in paused state
@@ -748,7 +1213,7 @@ class Source_Generic(object):
         #  Schedule next query
         wait_time = (next_query - datetime.now(self.mkt_time_zone)).total_seconds()
 
-        reactor.callLater(wait_time, self.run_recurring_query)
+        self.recurring_call = reactor.callLater(wait_time, self.run_recurring_query)
 
 
         print(self.src_name + ":  Next query at %s  (%d seconds)" % (next_query.strftime('%Y-%m-%d %H:%M:%S.%f %Z'), round (wait_time)))
@@ -764,6 +1229,8 @@ class Source_Generic(object):
         #  Make query if we are within the active time window
         if mkt_open:
 
+            self.missed_cycle = False
+
             #  Record list of stocks (in reverse order so we can pop off the end)
             active_stock_list = []
 
@@ -803,15 +1270,28 @@ class Source_Generic(object):
             else:
                 query_types = ['DEFAULT']
 
-            for query_type in query_types:
+            for query_group in self.plan_queries(query_types):
+
+                #  Review the active stock list for each query type of the group
+                reviewed = [self.review_query_list(active_stock_list, query_type, len(query_types), time_hack) for query_type in query_group]
+
+                #  Stocks due for all query types of the group are queried for them together ('TYPE1+TYPE2+...')
+                together = set()
+
+                if 1 < len(query_group):
+                    together = set.intersection(*[set(active_stock_list0) for active_stock_list0 in reviewed])
 
-                #  Review the active stock list for this query type
-                active_stock_list0 = self.review_query_list(active_stock_list, query_type, len(query_types), time_hack)
+                    for stock in reviewed[0]:
+                        if stock in together:
+                            self.stock_list_cur.append(stock + '::' + '+'.join(query_group))
 
-                for stock in active_stock_list0:
+                for (query_type, active_stock_list0) in zip(query_group, reviewed):
 
-                    #  Record (stock, query_type) in list of queries to be made shortly
-                    self.stock_list_cur.append(stock + '::' + query_type)
+                    for stock in active_stock_list0:
+
+                        #  Record (stock, query_type) in list of queries to be made shortly
+                        if stock not in together:
+                            self.stock_list_cur.append(stock + '::' + query_type)
 
 
             #  Shuffle the list if requested
@@ -905,6 +1385,9 @@ class Source_Generic(object):
 
         self.version = "<<>>"
 
+        #  Identifies the source in the envelopes sent to Process 2
+        self.src_id = source_ids.get(self.src_name, 0)
+
         if not hasattr(self, 'make_query_custom'):
             self.make_query_custom = None
         self.shuffle_queries = False
@@ -914,19 +1397,84 @@ class Source_Generic(object):
         self.mkt_end_today = None
         self.delta_quote = 24 * 60 * 60
 
-        self.poll_sleep_time = 0.25
-
         self.batch_sleep_time = 13
         self.max_threads = 10
 
         self.max_batch = 20
 
+        #  Rate limits:  queries per second and burst for this source and for all sources querying the same host (None is unlimited)
+        self.rate_per_sec      = None
+        self.rate_burst        = 1
+        self.host_rate_per_sec = None
+        self.host_rate_burst   = 1
+
+        #  Daily quota, tracked across restarts (None is unlimited)
+        self.max_queries_per_day = None
+
+        #  Keep the time each symbol was last queried across restarts
+        self.persist_query_times = False
+
+        #  Query only the bars after those already received (less an overlap of 'bar_overlap' seconds for corrections)
+        self.incremental_bars = False
+        self.bar_overlap      = 30 * 60
+
+        self.bar_stores      = {}
+        self.bar_stores_lock = threading.Lock()
+
+        #  Session of make_query_requests(), created on first use
+        self.requests_session = None
+        self.session_lock     = threading.Lock()
+
         self.pause       = False
         self.pause_sleep = 10
 
+        #  Control channel state:  a disabled (or draining) source starts no new rounds of queries
+        self.enabled      = True
+        self.draining     = False
+        self.missed_cycle = False
+
+        self.recurring_call = None
+
         self.timeout    = 3.5
         self.to_backoff = 3.0 / 2.0
 
+        #  Retries:  number of attempts per query and bounds on the (jittered) wait between attempts
+        self.num_attempts = 4
+        self.retry_base   = 1.0
+        self.retry_cap    = 30.0
+
+        #  Maximum number of cycles a failing symbol is skipped
+        self.max_backoff = 64
+
+        #  Circuit breaker of each host:  consecutive failures which open it, and the initial and maximum wait before probing
+        self.breaker_threshold    = 5
+        self.breaker_cooldown     = 30.0
+        self.breaker_cooldown_cap = 900.0
+
+        #  Fetch engine:  'threads' (one blocking thread per query) or 'reactor' (non-blocking queries on the Twisted reactor)
+        self.fetch_engine = 'threads'
+
+        #  Adaptive batching:  tune batch size and concurrency within bounds (None is 'max_batch' / 'max_threads')
+        self.adaptive_batch = False
+        self.batch_min      = 1
+        self.batch_max      = None
+        self.threads_min    = 1
+        self.threads_max    = None
+        self.target_latency = None
+        self.max_payload    = None
+
+        #  Backlog of the spool (bytes Process 2 has not acknowledged) at which the queries of this source are
+        #  held until Process 2 catches up.  0 holds them only at the global 'spool_max_bytes'.
+        self.spool_high_water = 0
+        self.spool_held       = False
+
+        #  Host of the queries of each query type (see query_host())
+        self.query_hosts = {}
+
+        #  Count of rate limit responses from this source
+        self.rate_limit_hits = 0
+        self.rate_limit_lock = threading.Lock()
+
 
         #  List missing symbols
         self.map_symbols = {
@@ -1011,19 +1559,50 @@ class Source_Generic(object):
 #       self.mkt_end_today = None
         self.delta_quote = self.global_to_source('delta_quote', self.delta_quote)
 
-        self.poll_sleep_time = self.global_to_source('poll_sleep_time', self.poll_sleep_time)
-
         self.batch_sleep_time = self.global_to_source('batch_sleep_time', self.batch_sleep_time)
         self.max_threads = self.global_to_source('max_threads', self.max_threads)
 
         self.max_batch = self.global_to_source('max_batch', self.max_batch)
 
+        self.rate_per_sec        = self.global_to_source('rate_per_sec',        self.rate_per_sec)
+        self.rate_burst          = self.global_to_source('rate_burst',          self.rate_burst)
+        self.host_rate_per_sec   = self.global_to_source('host_rate_per_sec',   self.host_rate_per_sec)
+        self.host_rate_burst     = self.global_to_source('host_rate_burst',     self.host_rate_burst)
+        self.max_queries_per_day = self.global_to_source('max_queries_per_day', self.max_queries_per_day)
+
+        self.persist_query_times = self.global_to_source('persist_query_times', self.persist_query_times)
+
+        self.incremental_bars = self.global_to_source('incremental_bars', self.incremental_bars)
+        self.bar_overlap      = self.global_to_source('bar_overlap',      self.bar_overlap)
+
 #       self.pause       = False
         self.pause_sleep = self.global_to_source('pause_sleep', self.pause_sleep)
 
         self.timeout = self.global_to_source('timeout', self.timeout)
         self.to_backoff = self.global_to_source('to_backoff', self.to_backoff)
 
+        self.fetch_engine = self.global_to_source('fetch_engine', self.fetch_engine)
+
+        self.adaptive_batch = self.global_to_source('adaptive_batch', self.adaptive_batch)
+        self.batch_min      = self.global_to_source('batch_min',      self.batch_min)
+        self.batch_max      = self.global_to_source('batch_max',      self.batch_max)
+        self.threads_min    = self.global_to_source('threads_min',    self.threads_min)
+        self.threads_max    = self.global_to_source('threads_max',    self.threads_max)
+        self.target_latency = self.global_to_source('target_latency', self.target_latency)
+        self.max_payload    = self.global_to_source('max_payload',    self.max_payload)
+
+        self.spool_high_water = self.global_to_source('spool_high_water', self.spool_high_water)
+
+        self.num_attempts = self.global_to_source('num_attempts', self.num_attempts)
+        self.retry_base   = self.global_to_source('retry_base',   self.retry_base)
+        self.retry_cap    = self.global_to_source('retry_cap',    self.retry_cap)
+
+        self.max_backoff = self.global_to_source('max_backoff', self.max_backoff)
+
+        self.breaker_threshold    = self.global_to_source('breaker_threshold',    self.breaker_threshold)
+        self.breaker_cooldown     = self.global_to_source('breaker_cooldown',     self.breaker_cooldown)
+        self.breaker_cooldown_cap = self.global_to_source('breaker_cooldown_cap', self.breaker_cooldown_cap)
+
 
         #  List missing symbols
         self.map_symbols = self.global_to_source('map_symbols', self.map_symbols)
@@ -1085,8 +1664,6 @@ class Source_Generic(object):
 #       self.mkt_end_today = None
 #       self.delta_quote = 24 * 60 * 60
 
-#       self.poll_sleep_time = 0.25
-
 #       self.batch_sleep_time = 13
 #       self.max_threads = 10
 
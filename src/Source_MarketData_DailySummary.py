@@ -24,6 +24,11 @@ from datetime import timedelta
 # END Source_MarketData_DailySummary.py SPECIFIC
 
 
+#  Values of the bars kept in the bar stores and the keys of the candles response holding them
+bar_columns = ['open', 'high', 'low', 'close', 'volume']
+bar_keys    = ['o',    'h',    'l',    'c',     'v'     ]
+
+
 class Source_MarketData_DailySummary(Source_Generic):
 
 
@@ -99,6 +104,11 @@ class Source_MarketData_DailySummary(Source_Generic):
 
         self.max_queries_per_day = 90
 
+        self.persist_query_times = True
+
+        #  Only query the 1 minute bars (MD_TS0) not received yet
+        self.incremental_bars = True
+
 
         #  Add additional headers as needed for MarketData source
         self.hdr['Host']          = 'api.marketdata.app'
@@ -154,8 +164,8 @@ class Source_MarketData_DailySummary(Source_Generic):
         #  Sort list based on time
         times.sort(key=self.review_query_helper)
 
-        #  Impose max length on times list
-        num_queries = self.max_queries_per_day // num_query_types
+        #  Impose max length on times list, counting queries already made today (e.g. before a restart)
+        num_queries = self.quota_remaining() // num_query_types
 
         if len(times) > num_queries:
            times = times[:num_queries]
@@ -185,6 +195,29 @@ class Source_MarketData_DailySummary(Source_Generic):
         return self.query_type_list[day]
 
 
+    #  SUBCLASS OVERRIDE
+
+    def store_bars(self, batch_list, query_raw):
+
+        if 'MD_TS0' != batch_list[0]['query_type']:
+            return
+
+        try:
+            query_json = json.loads(query_raw)
+        except ValueError:
+            return
+
+        if (not isinstance(query_json, dict)) or ('ok' != query_json.get('s')) or (not query_json.get('t')):
+            return
+
+        nones = [None] * len(query_json['t'])
+
+        rows = [list(row) for row in zip(query_json['t'], *[query_json.get(key, nones) for key in bar_keys])]
+
+        #  Candles are queried one symbol at a time
+        self.get_bar_store('MD_TS0', bar_columns).merge(batch_list[0]['loc_symbol'], rows)
+
+
     #  SUBCLASS OVERRIDE
 
     def id_quote(self, quote):
@@ -228,6 +261,12 @@ class Source_MarketData_DailySummary(Source_Generic):
                 from_date = datetime.now() - timedelta(days = 7)
                 to_date   = datetime.now() + timedelta(days = 1)
 
+                #  From the day of the earliest bar missing among the symbols
+                if self.incremental_bars:
+                    store = self.get_bar_store('MD_TS0', bar_columns)
+
+                    from_date = datetime.fromtimestamp(min(store.fetch_start(item['loc_symbol'], 7 * 24 * 60 * 60) for item in batch_list))
+
                 from_str = from_date.strftime('%Y-%m-%d')
                 to_str   = to_date.strftime('%Y-%m-%d')
 
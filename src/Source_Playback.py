@@ -22,6 +22,9 @@ import re
 from datetime import datetime
 
 from dateutil import tz
+
+from twisted.internet import reactor
+from twisted.internet import threads
 # END Source_Playback.py SPECIFIC
 
 
@@ -125,14 +128,20 @@ class Source_Playback(Source_Generic):
         self.fp.close()
         self.fp = None
 
-        self.pause = True
+        reactor.callFromThread(self.set_pause, True, 'playback input exhausted')
 
         print("PLAYBACK EXHAUSTED INPUT FILE.  HALTING...")
 
         return None, True
 
 
-    def make_query(self, thread_timestamp, thread_num, query_type_src, batch_list, ):
+    #  Replay the response on a worker thread.  Returns a Deferred which fires once the response has been sent.
+    def make_query(self, query_type_src, batch_list, ):
+
+        return threads.deferToThreadPool(reactor, self.get_worker_pool(), self.make_query_playback, query_type_src, batch_list)
+
+
+    def make_query_playback(self, query_type_src, batch_list, ):
 
         #  Create timestamps  (TODO:  Find a way to use one time hack for both time stamps)
         log_timestamp = datetime.now(tz.gettz('UTC')).strftime('%Y-%m-%d %H:%M:%S.%f %Z')
@@ -151,8 +160,6 @@ class Source_Playback(Source_Generic):
         quote, fetch_failed = self.fetch_query_playback(batch_list,  query, query_sanitized, )
 
         if fetch_failed:
-            self.mark_thread_done(thread_timestamp, thread_num)
-
             return
 
 
@@ -186,10 +193,6 @@ class Source_Playback(Source_Generic):
                 config.log_quotes.write(query_msg)
 
 
-        #  Indicate thread is done
-        self.mark_thread_done(thread_timestamp, thread_num)
-
-
     #  Playback specific configuration
     def configure_lvl2(self):
 
@@ -204,8 +207,6 @@ class Source_Playback(Source_Generic):
         #  Query frequency and batch parameters
         self.delta_quote = 0.10
 
-        self.poll_sleep_time = 0.05
-
         self.batch_sleep_time = 0.10
         self.max_threads = 1
 
@@ -11,24 +11,141 @@ See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>
 
 import config
 
-from Source_Generic import Source_Generic
+from Source_Generic import Source_Generic, rate_limit_re
 
 import json
 import re
 #mport pprint
 
-from curl_cffi import Session
-
 
 # BEG Source_Yahoo_DailySummary.py SPECIFIC
 from datetime import datetime
+from datetime import timezone
 
 import math
 
-from yahooquery import Ticker
+import time
+
+from yahoo_session import Yahoo_Session, response_json
+
+from option_store import Option_Store
 # END Source_Yahoo_DailySummary.py SPECIFIC
 
 
+#  The quoteSummary modules queried by YD_MODx, in 'num_module_segs' segments
+yahoo_modules = [
+    "assetProfile",
+    "balanceSheetHistory",
+    "balanceSheetHistoryQuarterly",
+    "calendarEvents",
+    "cashflowStatementHistory",
+    "cashflowStatementHistoryQuarterly",
+    "defaultKeyStatistics",
+    "earnings",
+    "earningsHistory",
+    "earningsTrend",
+    "esgScores",
+    "financialData",
+    "fundOwnership",
+    "fundPerformance",
+    "fundProfile",
+    "indexTrend",
+    "incomeStatementHistory",
+    "incomeStatementHistoryQuarterly",
+    "industryTrend",
+    "insiderHolders",
+    "insiderTransactions",
+    "institutionOwnership",
+    "majorHoldersBreakdown",
+    "pageViews",
+    "price",
+    "quoteType",
+    "recommendationTrend",
+    "secFilings",
+    "netSharePurchaseActivity",
+    "sectorTrend",
+    "summaryDetail",
+    "summaryProfile",
+    "topHoldings",
+    "upgradeDowngradeHistory",
+]
+
+num_module_segs = 3
+
+
+#  The modules of segment 'idx_mod' of yahoo_modules
+def module_segment(idx_mod):
+
+    len_seg_c = math.ceil(len(yahoo_modules) / num_module_segs)
+    len_seg_f = math.floor(len(yahoo_modules) / num_module_segs)
+
+    len_seg = len_seg_c
+
+    idx0 = len(yahoo_modules) % num_module_segs
+
+    idx = 0
+
+    idx_beg = -len_seg
+    idx_end = 0
+
+    while idx <= idx_mod:
+       idx_beg = idx_end
+       idx_end = idx_end + len_seg
+
+       idx += 1
+
+       if idx == idx0:
+           len_seg = len_seg_f
+
+    return yahoo_modules[idx_beg:idx_end]
+
+
+#  (financials_type, frequency, trailing) of the fundamentals queried by YD_FINx
+financials_args = {
+    'YD_FIN0':  ('balance_sheet',    'a', True),
+    'YD_FIN1':  ('cash_flow',        'a', True),
+    'YD_FIN2':  ('income_statement', 'a', True),
+    'YD_FIN3':  ('valuation',        'q', True),
+}
+
+
+#  Families of query types which can be answered by the same request per symbol
+coalesce_families = [
+    re.compile(r'YD_MOD\d+$'),
+    re.compile(r'YD_FIN\d+$'),
+]
+
+
+#  Values of the bars kept in the bar stores
+bar_columns = ['open', 'high', 'low', 'close', 'volume']
+
+
+#  Rows [timestamp, open, high, low, close, volume] of the bars in a chart result
+def chart_rows(result):
+
+    if (not isinstance(result, dict)) or (not result.get('timestamp')):
+        return []
+
+    quote = result['indicators']['quote'][0]
+
+    nones = [None] * len(result['timestamp'])
+
+    return [list(row) for row in zip(result['timestamp'], *[quote.get(column, nones) for column in bar_columns])]
+
+
+#  Corporate actions (see Bar_Store::merge_events()) in a chart result
+def chart_events(result):
+
+    if not isinstance(result, dict):
+        return []
+
+    events = result.get('events', {})
+
+    return ([{'type': 'div',   'date': int(div['date']), 'amount': div['amount']} for div in events.get('dividends', {}).values()] +
+            [{'type': 'split', 'date': int(split['date']), 'numerator': split['numerator'], 'denominator': split['denominator']}
+             for split in events.get('splits', {}).values()])
+
+
 class Source_Yahoo_DailySummary(Source_Generic):
 
 
@@ -42,6 +159,23 @@ class Source_Yahoo_DailySummary(Source_Generic):
         self.configure_lvl2()   #  Default specific class configs
         self.configure_lvl3()   #  Override specific class override
 
+        #  Cookies and crumb shared by all queries of this source
+        self.yahoo_session = Yahoo_Session(self.src_name)
+
+        #  History of the option chains as keyframes and deltas
+        self.option_store = Option_Store(self.src_name, self.opt_keyframe_every) if self.opt_store else None
+
+        #  Have Yahoo Query return its results in columnar form
+        self.yahoo_session.columnar = self.yq_columnar
+
+        #  Answer repeated requests from the response cache
+        if 0 < self.yq_cache_entries:
+            self.yahoo_session.configure_cache(self.yq_cache_entries, self.yq_cache_disk)
+
+        #  Fetch the symbols of a batch concurrently, paced by the session's own rate limiter
+        if 0 < self.yq_max_workers:
+            self.yahoo_session.configure_concurrency(self.yq_max_workers, self.yq_rate_per_sec, self.yq_rate_burst)
+
 
     #  SUBCLASS OVERRIDE
 
@@ -58,7 +192,55 @@ class Source_Yahoo_DailySummary(Source_Generic):
         self.batch_sleep_time = 19
         self.max_threads = 1
 
-        self.max_batch = 1
+        #  The symbols of a batch are fetched by up to 'yq_max_workers' concurrent requests, started no faster
+        #  than 'yq_rate_per_sec' (about the rate the back-to-back requests of a single symbol already reach,
+        #  so the peak request rate does not go up).  Set yq_max_workers to 0 to fetch the symbols of a batch
+        #  one after the other.
+        self.max_batch = 10
+
+        self.yq_max_workers  = 4
+        self.yq_rate_per_sec = 2.0
+        self.yq_rate_burst   = 1
+
+        #  Have Yahoo Query return NumPy columns (yahooquery/columnar.py) rather than nested lists
+        self.yq_columnar = False
+
+        #  Keep up to 'yq_cache_entries' Yahoo responses for the time to live of their endpoint (e.g. 15 minutes
+        #  for quoteSummary modules, 6 hours for fundamentals) so requests repeated meanwhile, by this or another
+        #  query type, are not sent.  With 'yq_cache_disk', responses are also kept in the state directory so
+        #  they survive a restart.  0 entries disables the cache.
+        self.yq_cache_entries = 1024
+        self.yq_cache_disk    = False
+
+        #  The nightly queries of this source can wait:  hold them once Process 2 is 256 MB behind on the spool
+        self.spool_high_water = 256 * 1024 * 1024
+
+        #  Keep to a single attempt per query to limit the load on Yahoo
+        self.num_attempts = 1
+
+        #  Only query the 1 minute bars (YD_TS1) and quarterly history (YD_S+D) not received yet
+        self.incremental_bars = True
+
+        #  Query the types of the same family due the same day (e.g. YD_MOD0 and YD_MOD1) with one request per symbol
+        self.coalesce_queries = True
+
+        #  Option chains (YD_OPT):  query the 'opt_near' nearest expirations, the monthly ones within
+        #  'opt_monthly_months' months and the quarterly ones, with strikes within 'opt_moneyness' of the price
+        #  of the underlying.  The full chain is queried on the days of the week in 'opt_full_weekdays'
+        #  (0 is Monday).  Off by default:  the YD_OPT entries logged on the other days hold only the window.
+        self.opt_window         = False
+        self.opt_near           = 4
+        self.opt_monthly_months = 6
+        self.opt_quarterly      = True
+        self.opt_moneyness      = 0.2
+        self.opt_full_weekdays  = [5]
+
+        #  Keep the option chains in an option store, as a keyframe every 'opt_keyframe_every' snapshots and deltas
+        #  in between.  With 'opt_log_deltas', the records of the store (keyframes and deltas, as QUERY_TYPE=YD_OPT_DELTA)
+        #  are logged instead of the chains received, so the quotes log alone rebuilds a chain from its last keyframe.
+        self.opt_store          = True
+        self.opt_keyframe_every = 7
+        self.opt_log_deltas     = False
 
         #  List missing symbols
         self.map_symbols['BF.B'] = 'BF-B'
@@ -141,6 +323,24 @@ class Source_Yahoo_DailySummary(Source_Generic):
             self.dump_src_attributes (2)
 
 
+    #  SUBCLASS OVERRIDE
+
+    #  Add the hits and misses of the response cache
+    def control_status(self):
+
+        status = super().control_status()
+
+        if self.yahoo_session.cache is None:
+            return status
+
+        stats = self.yahoo_session.cache.stats()
+
+        hits   = sum(counts['hits'] + counts['disk_hits'] for (endpoint, counts) in stats.items() if 'entries' != endpoint)
+        misses = sum(counts['misses'] for (endpoint, counts) in stats.items() if 'entries' != endpoint)
+
+        return f"{status}, response cache {hits} hits, {misses} misses, {stats['entries']} entries"
+
+
     #  SUBCLASS OVERRIDE
 
     def is_work_day(self, day):
@@ -163,297 +363,386 @@ class Source_Yahoo_DailySummary(Source_Generic):
         return self.query_type_list[day]
 
 
-#   query_raw, url_fetch_failed = self.make_query_custom(batch_list, query, query_sanitized, )
+    #  SUBCLASS OVERRIDE
 
-    def make_query_custom(self, batch_list, query, query_sanitized, ):
+    #  Group the query types of the same family (see coalesce_families)
+    def plan_queries(self, query_types):
 
-        #  FIXME:  Enforce len batch_list == 1
+        if not self.coalesce_queries:
+            return super().plan_queries(query_types)
 
-        response = ''
+        query_groups = []
 
-        attempt = 1
+        by_family = {}
 
-        try:
+        for query_type in query_types:
+            family = next((idx for (idx, family_re) in enumerate(coalesce_families) if family_re.match(query_type)), None)
 
-            symbols = " ".join([batch_list[idx]['qry_symbol'] for idx in range(len(batch_list)) ])
+            if family is None:
+                query_groups.append([query_type])
+            elif family in by_family:
+                by_family[family].append(query_type)
+            else:
+                by_family[family] = [query_type]
 
-            session = Session(impersonate="chrome")
+                query_groups.append(by_family[family])
 
-            if 0 == len(config.runtime_params['ca_cert']):
-                yq_tickers = Ticker(symbols, session=session)
-            else:
-                yq_tickers = Ticker(symbols, proxies=config.runtime_params['proxies'], verify=config.runtime_params['ca_cert'], session=session)
+        return query_groups
 
-            loc_symbol = batch_list[0]['loc_symbol']
-            print(batch_list[0], flush=True)
 
-            if batch_list[0]['query_type'] == 'YD_S+D':
+    #  Make the query for the query types 'query_types' of one family together.  Returns the responses keyed by query type.
+    def fetch_query_group(self, yq_tickers, query_types):
+
+        if coalesce_families[0].match(query_types[0]):
+            return yq_tickers.get_modules_LOC({query_type: module_segment(int(query_type[len('YD_MOD'):])) for query_type in query_types})
+
+        return yq_tickers.financials_LOC({query_type: financials_args[query_type] for query_type in query_types})
+
+
+    #  Make the query for the type of 'batch_list' with the yahooquery tickers object and return the response as a string
+    def fetch_query_type(self, yq_tickers, batch_list):
+
+        response = ''
+
+        if '+' in batch_list[0]['query_type']:
+            response = self.fetch_query_group(yq_tickers, batch_list[0]['query_type'].split('+'))
+
+            response = response_json(response)
+
+        elif batch_list[0]['query_type'] == 'YD_S+D':
+            start = None
+
+            if self.incremental_bars:
+                #  From the last quarter stored (it was likely still in progress), the full history if any symbol has none
+                starts = [self.get_bar_store('YD_S+D', bar_columns, 0).fetch_start(entry['loc_symbol']) for entry in batch_list]
+
+                if None not in starts:
+                    start = min(starts)
+
+            if start is None:
                 response = yq_tickers.history_LOC(period='max', interval = '3mo', adj_ohlc=True)
+            else:
+                response = yq_tickers.history_LOC(start=datetime.fromtimestamp(start, timezone.utc), interval = '3mo', adj_ohlc=True)
 
-                '''
-                print('BEF(YD_S+D)')
+            '''
+            print('BEF(YD_S+D)')
 #               print(json.dumps(json.loads(response), indent=4, sort_keys=False))
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_S+D)')
-                '''
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_S+D)')
+            '''
 
-                response = json.dumps(response, separators=(',', ':'))
+            response = response_json(response)
 
-            elif batch_list[0]['query_type'] =='YD_OPT':
+        elif batch_list[0]['query_type'] =='YD_OPT':
+            if self.opt_window and (datetime.today().weekday() not in self.opt_full_weekdays):
+                response = yq_tickers.option_chain_window_LOC(near=self.opt_near, monthly_months=self.opt_monthly_months,
+                                                              quarterly=self.opt_quarterly, moneyness=self.opt_moneyness)
+            else:
                 response = yq_tickers.option_chain_LOC()
 
-                '''
-                print('BEF(YD_OPT)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_OPT)')
-                '''
+            '''
+            print('BEF(YD_OPT)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_OPT)')
+            '''
+
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_MISC0':
+            response = yq_tickers.corporate_events_LOC()
 
-            elif batch_list[0]['query_type'] =='YD_MISC0':
-                response = yq_tickers.corporate_events_LOC()
+            '''
+            print('BEF(YD_MISC0)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_MISC0)')
+            '''
 
-                '''
-                print('BEF(YD_MISC0)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_MISC0)')
-                '''
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_MISC1':
+            response = yq_tickers.recommendations_LOC()
 
-            elif batch_list[0]['query_type'] =='YD_MISC1':
-                response = yq_tickers.recommendations_LOC()
+            '''
+            print('BEF(YD_MISC1)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_MISC1)')
+            '''
 
-                '''
-                print('BEF(YD_MISC1)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_MISC1)')
-                '''
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_MISC2':
+            response = yq_tickers.technical_insights_LOC()
 
-            elif batch_list[0]['query_type'] =='YD_MISC2':
-                response = yq_tickers.technical_insights_LOC()
+            '''
+            print('BEF(YD_MISC2)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_MISC2)')
+            '''
 
-                '''
-                print('BEF(YD_MISC2)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_MISC2)')
-                '''
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_FIN':
+            response = yq_tickers.all_financial_data_LOC()
 
-            elif batch_list[0]['query_type'] =='YD_FIN':
-                response = yq_tickers.all_financial_data_LOC()
+            '''
+            print('BEF(YD_FIN)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_FIN)')
+            '''
 
-                '''
-                print('BEF(YD_FIN)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_FIN)')
-                '''
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_FIN0':
+            response = yq_tickers.balance_sheet_LOC()
 
-            elif batch_list[0]['query_type'] =='YD_FIN0':
-                response = yq_tickers.balance_sheet_LOC()
+            '''
+            print('BEF(YD_FIN0)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_FIN0)')
+            '''
 
-                '''
-                print('BEF(YD_FIN0)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_FIN0)')
-                '''
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_FIN1':
+            response = yq_tickers.cash_flow_LOC()
 
-            elif batch_list[0]['query_type'] =='YD_FIN1':
-                response = yq_tickers.cash_flow_LOC()
+            '''
+            print('BEF(YD_FIN1)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_FIN1)')
+            '''
 
-                '''
-                print('BEF(YD_FIN1)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_FIN1)')
-                '''
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_FIN2':
+            response = yq_tickers.income_statement_LOC()
 
-            elif batch_list[0]['query_type'] =='YD_FIN2':
-                response = yq_tickers.income_statement_LOC()
+            '''
+            print('BEF(YD_FIN2)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_FIN2)')
+            '''
 
-                '''
-                print('BEF(YD_FIN2)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_FIN2)')
-                '''
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_FIN3':
+            response = yq_tickers.valuation_measures_LOC()
 
-            elif batch_list[0]['query_type'] =='YD_FIN3':
-                response = yq_tickers.valuation_measures_LOC()
+            '''
+            print('BEF(YD_FIN3)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_FIN3)')
+            '''
 
-                '''
-                print('BEF(YD_FIN3)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_FIN3)')
-                '''
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_TS0':
+            response = yq_tickers.history_LOC(period='1d', interval = '1m', adj_ohlc=False)
 
-            elif batch_list[0]['query_type'] =='YD_TS0':
-                response = yq_tickers.history_LOC(period='1d', interval = '1m', adj_ohlc=False)
+            '''
+            print('BEF(YD_TS0)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_TS0)')
+            '''
 
-                '''
-                print('BEF(YD_TS0)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_TS0)')
-                '''
+            response = response_json(response)
 
-                response = json.dumps(response, separators=(',', ':'))
+        elif batch_list[0]['query_type'] =='YD_TS1':
+            if self.incremental_bars:
+                #  From the earliest bar missing among the symbols, Yahoo serves at most 7 days of 1 minute bars in one query
+                store = self.get_bar_store('YD_TS1', bar_columns)
 
-            elif batch_list[0]['query_type'] =='YD_TS1':
+                start = min(store.fetch_start(entry['loc_symbol'], 7 * 24 * 60 * 60 - 60) for entry in batch_list)
+
+                response = yq_tickers.history_LOC(start=datetime.fromtimestamp(start, timezone.utc), interval = '1m', adj_ohlc=False)
+            else:
                 response = yq_tickers.history_LOC(period='7d', interval = '1m', adj_ohlc=False)
 
-                '''
-                print('BEF(YD_TS1)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_TS1)')
-                '''
-
-                response = json.dumps(response, separators=(',', ':'))
-
-
-            elif batch_list[0]['query_type'] =='YD_TS2':
-                response = yq_tickers.history_LOC(period='1mo', interval = '1m', adj_ohlc=False)
-
-                '''
-                print('BEF(YD_TS2)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_TS2)')
-                '''
-
-                response = json.dumps(response, separators=(',', ':'))
-
-            elif batch_list[0]['query_type'] =='YD_MOD':
-                response = yq_tickers.all_modules
-
-                '''
-                print('BEF(YD_MOD)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_MOD)')
-                '''
-
-                response = json.dumps(response, separators=(',', ':'))
-
-            elif (m := re.match('YD_MOD(\d+)', batch_list[0]['query_type'])):
-                idx_mod = int(m.group(1))
-
-                yahoo_modules = [
-                    "assetProfile",
-                    "balanceSheetHistory",
-                    "balanceSheetHistoryQuarterly",
-                    "calendarEvents",
-                    "cashflowStatementHistory",
-                    "cashflowStatementHistoryQuarterly",
-                    "defaultKeyStatistics",
-                    "earnings",
-                    "earningsHistory",
-                    "earningsTrend",
-                    "esgScores",
-                    "financialData",
-                    "fundOwnership",
-                    "fundPerformance",
-                    "fundProfile",
-                    "indexTrend",
-                    "incomeStatementHistory",
-                    "incomeStatementHistoryQuarterly",
-                    "industryTrend",
-                    "insiderHolders",
-                    "insiderTransactions",
-                    "institutionOwnership",
-                    "majorHoldersBreakdown",
-                    "pageViews",
-                    "price",
-                    "quoteType",
-                    "recommendationTrend",
-                    "secFilings",
-                    "netSharePurchaseActivity",
-                    "sectorTrend",
-                    "summaryDetail",
-                    "summaryProfile",
-                    "topHoldings",
-                    "upgradeDowngradeHistory",
-                ]
-
-                num_module_segs = 3
-
-                len_seg_c = math.ceil(len(yahoo_modules) / num_module_segs)
-                len_seg_f = math.floor(len(yahoo_modules) / num_module_segs)
-
-                len_seg = len_seg_c
-
-                idx0 = len(yahoo_modules) % num_module_segs
-
-                idx = 0
-
-                idx_beg = -len_seg
-                idx_end = 0
-
-                while idx <= idx_mod:
-                   idx_beg = idx_end
-                   idx_end = idx_end + len_seg
-
-                   idx += 1
-
-                   if idx == idx0:
-                       len_seg = len_seg_f
-
-#                  print(f"QQQ:  idx={idx}  idx_mod={idx_mod}  idx0={idx0}  len_seg={len_seg}  idx_beg:idx_end={idx_beg}:{idx_end}")
-
-
-#               print(f"idx_beg:idx_end={idx_beg}:{idx_end}")
-                response = yq_tickers.get_modules(yahoo_modules[idx_beg:idx_end])
-
-                '''
-                print('BEF(YD_MODx)')
-                print(json.dumps(response, indent=4, sort_keys=False))
-                print('AFT(YD_MODx)')
-                '''
+            '''
+            print('BEF(YD_TS1)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_TS1)')
+            '''
 
-                response = json.dumps(response, separators=(',', ':'))
+            response = response_json(response)
 
-            if '' != response:
 
-                #  Turn off throttling of queries due to error conditions
-                self.reset_backoff([entry['loc_symbol'] for entry in batch_list])
+        elif batch_list[0]['query_type'] =='YD_TS2':
+            response = yq_tickers.history_LOC(period='1mo', interval = '1m', adj_ohlc=False)
+
+            '''
+            print('BEF(YD_TS2)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_TS2)')
+            '''
+
+            response = response_json(response)
+
+        elif batch_list[0]['query_type'] =='YD_MOD':
+            response = yq_tickers.all_modules
+
+            '''
+            print('BEF(YD_MOD)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_MOD)')
+            '''
+
+            response = response_json(response)
+
+        elif (m := re.match('YD_MOD(\d+)', batch_list[0]['query_type'])):
+            response = yq_tickers.get_modules(module_segment(int(m.group(1))))
+
+            '''
+            print('BEF(YD_MODx)')
+            print(json.dumps(response, indent=4, sort_keys=False))
+            print('AFT(YD_MODx)')
+            '''
+
+            response = response_json(response)
+
+
+        return response
+
+
+#   query_raw, url_fetch_failed = self.make_query_custom(batch_list, query, query_sanitized, attempt, timeout, )
+
+    def make_query_custom(self, batch_list, query, query_sanitized, attempt, timeout, ):
+
+        response = ''
+
+        try:
+
+            symbols = " ".join([batch_list[idx]['qry_symbol'] for idx in range(len(batch_list)) ])
+
+            print(batch_list[0], flush=True)
+
+            #  Reuse the cookies and crumb held for this source, refreshing them if Yahoo rejects them
+            response = self.yahoo_session.fetch(symbols, lambda yq_tickers: self.fetch_query_type(yq_tickers, batch_list))
+
+            if '' != response:
 
                 #  Make successful return
                 return response, False
 
 
         except Exception as e:
+            if rate_limit_re.search(str(e)):
+                self.note_rate_limit()
+
             print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
             print(f"    EXCEPTION MESSAGE:  {str(e)}")
             # e.read().decode("utf8", 'ignore')
 
 
-        #  All attempts to fetch the URL failed, handle error
-        print("ERROR FAILED TO FETCH URL '" + query_sanitized + "'")
+        return None, True
 
-        for item in batch_list:    #  TODO:  PROVIDE ABILITY TO SUPPRESS BACK-OFF
-            stock = item['loc_symbol']
 
-            self.backoff [stock]['major_cnt'] -= 1
+    #  SUBCLASS OVERRIDE
 
-            if 0 >= self.backoff [stock]['major_cnt']:
-                self.backoff [stock]['minor_reset'] *= 2   #  TODO:  PROVIDE ABILITY TO IMPOSE MAX BACK-OFF
+    #  Log one entry per symbol so a batch of several symbols is logged as it was when each symbol was queried alone
+    def forward_query(self, batch_list, query_sanitized, query_type_loc, query_raw, log_timestamp):
 
-                self.backoff [stock]['major_cnt'] = self.backoff [stock]['major_reset']
+        #  Split the response to query types queried together into the response to each query type
+        if '+' in query_type_loc:
+            return self.forward_query_group(batch_list, query_sanitized, query_type_loc, query_raw, log_timestamp)
 
-                print(self.src_name + ":  ADJUSTING BACK-OFF '" + stock + "' new back-off:  %d" %
-                    (self.backoff [stock]['minor_reset']))
+        if 1 == len(batch_list):
+            if ('YD_OPT' == query_type_loc) and (self.option_store is not None):
+                query_type_loc, query_raw = self.store_option_chain(batch_list[0], query_type_loc, query_raw)
 
-            self.backoff [stock]['minor_cnt'] = self.backoff [stock]['minor_reset']
+            return super().forward_query(batch_list, query_sanitized, query_type_loc, query_raw, log_timestamp)
 
-        return None, True
+        try:
+            query_json = json.loads(query_raw)
+        except ValueError:
+            query_json = None
+
+        #  Responses not keyed by symbol are logged whole
+        if (not isinstance(query_json, dict)) or any(entry['qry_symbol'] not in query_json for entry in batch_list):
+            return super().forward_query(batch_list, query_sanitized, query_type_loc, query_raw, log_timestamp)
+
+        for entry in batch_list:
+            query_one, query_one_sanitized, query_type_one = self.make_query_url([entry])
+
+            query_one_raw = json.dumps({entry['qry_symbol']: query_json[entry['qry_symbol']]}, separators=(',', ':'))
+
+            self.forward_query([entry], query_one_sanitized, query_type_loc, query_one_raw, log_timestamp)
+
+
+    #  Add the option chain of a response to the option store.  Returns the query type and response to log:  the
+    #  record of the store (the merged chain of a keyframe, or a delta against it) when 'opt_log_deltas' is set.
+    def store_option_chain(self, entry, query_type_loc, query_raw):
+
+        try:
+            query_json = json.loads(query_raw)
+        except ValueError:
+            return query_type_loc, query_raw
+
+        if (not isinstance(query_json, dict)) or (not isinstance(query_json.get(entry['qry_symbol']), dict)):
+            return query_type_loc, query_raw
+
+        record, text = self.option_store.add_snapshot(entry['loc_symbol'], time.time(), query_json[entry['qry_symbol']])
+
+        if not self.opt_log_deltas:
+            return query_type_loc, query_raw
+
+        return 'YD_OPT_DELTA', '{' + json.dumps(entry['qry_symbol']) + ':' + text + '}'
+
+
+    def forward_query_group(self, batch_list, query_sanitized, query_type_loc, query_raw, log_timestamp):
+
+        try:
+            query_json = json.loads(query_raw)
+        except ValueError:
+            query_json = None
+
+        query_types = query_type_loc.split('+')
+
+        if (not isinstance(query_json, dict)) or any(query_type not in query_json for query_type in query_types):
+            print(f"ERROR:  Response to '{query_sanitized}' is not split by query type.  Logging it whole.")
+
+            return super().forward_query(batch_list, query_sanitized, query_type_loc, query_raw, log_timestamp)
+
+        for query_type in query_types:
+            batch_one = [dict(entry, query_type=query_type) for entry in batch_list]
+
+            query_one, query_one_sanitized, query_type_one = self.make_query_url(batch_one)
+
+            self.forward_query(batch_one, query_one_sanitized, query_type, json.dumps(query_json[query_type], separators=(',', ':')), log_timestamp)
+
+
+    #  SUBCLASS OVERRIDE
+
+    def store_bars(self, batch_list, query_raw):
+
+        if batch_list[0]['query_type'] not in ['YD_TS1', 'YD_S+D']:
+            return
+
+        try:
+            query_json = json.loads(query_raw)
+        except ValueError:
+            return
+
+        if not isinstance(query_json, dict):
+            return
+
+        if 'YD_TS1' == batch_list[0]['query_type']:
+            store = self.get_bar_store('YD_TS1', bar_columns)
+
+            for entry in batch_list:
+                store.merge(entry['loc_symbol'], chart_rows(query_json.get(entry['qry_symbol'])))
+
+            return
+
+
+        #  YD_S+D:  bars as sent plus the splits and dividends from which the adjusted history is computed
+        store = self.get_bar_store('YD_S+D', bar_columns, 0)
+
+        for entry in batch_list:
+            result = query_json.get(entry['qry_symbol'])
+
+            store.merge_events(entry['loc_symbol'], chart_events(result))
+            store.merge(entry['loc_symbol'], chart_rows(result))
 
 
     #  SUBCLASS OVERRIDE
@@ -489,6 +778,10 @@ class Source_Yahoo_DailySummary(Source_Generic):
 
         type = batch_list[0]['query_type']
 
+        #  Query types queried together go to the endpoint of the first
+        if '+' in type:
+            type = type.split('+')[0]
+
         if type in self.pseudo_URL:
             query = self.pseudo_URL[type] + symbols_str
         else:
@@ -11,17 +11,15 @@ See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>
 
 import config
 
-from Source_Generic import Source_Generic
+from Source_Generic import Source_Generic, rate_limit_re
 
 import json
 import re
 #mport pprint
 
-from curl_cffi import Session
-
 
 # BEG Source_Yahoo_IntradayQuote.py SPECIFIC
-from yahooquery import Ticker
+from yahoo_session import Yahoo_Session
 # END Source_Yahoo_IntradayQuote.py SPECIFIC
 
 
@@ -38,6 +36,9 @@ class Source_Yahoo_IntradayQuote(Source_Generic):
         self.configure_lvl2()   #  Default specific class configs
         self.configure_lvl3()   #  Override specific class override
 
+        #  Cookies and crumb shared by all queries of this source
+        self.yahoo_session = Yahoo_Session(self.src_name)
+
 
     #  SUBCLASS OVERRIDE
 
@@ -55,12 +56,13 @@ class Source_Yahoo_IntradayQuote(Source_Generic):
         #  Query frequency and batch parameters
         self.delta_quote = 15 * 60
 
-        self.poll_sleep_time = 0.25
-
         self.batch_sleep_time = 10
 
         self.max_batch = 10
 
+        #  Keep to a single attempt per query to limit the load on Yahoo
+        self.num_attempts = 1
+
         #  List missing symbols
         self.map_symbols['BF.B'] = 'BF-B'
         self.map_symbols['BRKB'] = 'BRK-B'
@@ -103,70 +105,34 @@ class Source_Yahoo_IntradayQuote(Source_Generic):
         return [ 'YI_QUOTE' ]
 
 
-    def make_query_custom(self, batch_list, query, query_sanitized, ):
+    def make_query_custom(self, batch_list, query, query_sanitized, attempt, timeout, ):
 
         response = ''
 
-        attempt = 1
-
         try:
 
             symbols = " ".join([batch_list[idx]['qry_symbol'] for idx in range(len(batch_list)) ])
 
-            session = Session(impersonate="chrome")
-
-            if 0 == len(config.runtime_params['ca_cert']):
-                yq_tickers = Ticker(symbols, session=session)
-            else:
-                yq_tickers = Ticker(symbols, proxies=config.runtime_params['proxies'], verify=config.runtime_params['ca_cert'], session=session)
-
-            loc_symbol = batch_list[0]['loc_symbol']
             print(batch_list[0], flush=True)
 
-            response = yq_tickers.quotes
-
-            '''
-            print('BEF(QUOTE)')
-#           print(json.dumps(json.loads(response), indent=4, sort_keys=False))
-            print(json.dumps(response, indent=4, sort_keys=False))
-            print('AFT(QUOTE)')
-            '''
-
-            response = json.dumps(response, separators=(',', ':'))
+            #  Reuse the cookies and crumb held for this source, refreshing them if Yahoo rejects them
+            response = self.yahoo_session.fetch(symbols, lambda yq_tickers: json.dumps(yq_tickers.quotes, separators=(',', ':')))
 
             if '' != response:
 
-                #  Turn off throttling of queries due to error conditions
-                self.reset_backoff([entry['loc_symbol'] for entry in batch_list])
-
                 #  Make successful return
                 return response, False
 
 
         except Exception as e:
+            if rate_limit_re.search(str(e)):
+                self.note_rate_limit()
+
             print("ERROR (#" + str(attempt) + ") FETCHING URL '" + query_sanitized + "'")
             print(f"    EXCEPTION MESSAGE:  {str(e)}")
             # e.read().decode("utf8", 'ignore')
 
 
-        #  All attempts to fetch the URL failed, handle error
-        print("ERROR FAILED TO FETCH URL '" + query_sanitized + "'")
-
-        for item in batch_list:    #  TODO:  PROVIDE ABILITY TO SUPPRESS BACK-OFF
-            stock = item['loc_symbol']
-
-            self.backoff [stock]['major_cnt'] -= 1
-
-            if 0 >= self.backoff [stock]['major_cnt']:
-                self.backoff [stock]['minor_reset'] *= 2   #  TODO:  PROVIDE ABILITY TO IMPOSE MAX BACK-OFF
-
-                self.backoff [stock]['major_cnt'] = self.backoff [stock]['major_reset']
-
-                print(self.src_name + ":  ADJUSTING BACK-OFF '" + stock + "' new back-off:  %d" %
-                    (self.backoff [stock]['minor_reset']))
-
-            self.backoff [stock]['minor_cnt'] = self.backoff [stock]['minor_reset']
-
         return None, True
 
 
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+"""bar_store.py:  Implements the class which keeps the bars (e.g. 1 minute
+   candles) already received for each symbol so only the missing range is
+   queried the next time.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import json
+
+import os
+
+import threading
+
+import time
+
+from utils import state_dir_path, read_json_state, write_json_state
+
+
+class Bar_Store(object):
+
+    #  Bars are rows [timestamp, value, ...] (the values named by 'columns').  For every symbol the store
+    #  keeps, in the state directory under bars/<source>/<series>/:
+    #
+    #    <symbol>.jsonl:  the bars received, one per line in the order they were stored
+    #    <symbol>.json:   the high-water mark (timestamp of the last bar stored), the bars of the last
+    #                     'overlap' seconds up to it and the corporate actions (splits and dividends)
+    #
+    #  Queries ask for the bars from the high-water mark less 'overlap' seconds.  Bars after the mark are
+    #  appended, bars in the overlap only if they are new or changed (a late correction).  When reading,
+    #  the last line stored for a timestamp wins.
+    #
+    #  Bars are stored as the source sent them, the corporate actions make up the table of adjustment
+    #  factors applied when adjusted bars are asked for.  A split or dividend therefore changes one small
+    #  table instead of requiring the whole history to be queried again.
+
+    def __init__(self, src_name, series, columns, overlap):
+
+        self.dir_name = state_dir_path('bars', src_name, series)
+
+        self.columns = columns
+        self.overlap = overlap
+
+        self.lock = threading.Lock()
+
+        #  Marks and overlap bars by symbol, read from disk when a symbol is first used
+        self.marks = {}
+
+
+    def file_name(self, symbol, ext):
+
+        return os.path.join(self.dir_name, symbol + ext)
+
+
+    #  Called with self.lock held
+    def get_mark(self, symbol):
+
+        if symbol not in self.marks:
+            state = read_json_state(self.file_name(symbol, '.json'), {})
+
+            self.marks[symbol] = {
+                'mark':   state.get('mark'),
+                'tail':   {row[0]: row for row in state.get('tail', [])},
+                'events': state.get('events', []),
+            }
+
+        return self.marks[symbol]
+
+
+    def watermark(self, symbol):
+
+        with self.lock:
+            return self.get_mark(symbol)['mark']
+
+
+    #  POSIX timestamp from which to query the bars of 'symbol', going back no more than 'lookback' seconds.
+    #  Without a 'lookback', None when no bars are stored yet (i.e. query the full history).
+    def fetch_start(self, symbol, lookback=None):
+
+        mark = self.watermark(symbol)
+
+        if lookback is None:
+            return None if mark is None else mark - self.overlap
+
+        earliest = time.time() - lookback
+
+        if mark is None:
+            return earliest
+
+        return max(earliest, mark - self.overlap)
+
+
+    #  Called with self.lock held
+    def save(self, symbol, state):
+
+        try:
+            write_json_state(self.file_name(symbol, '.json'), {'mark': state['mark'], 'tail': sorted(state['tail'].values()), 'events': state['events']})
+        except OSError as e:
+            print(f"WARNING(Bar_Store::save()):  Unable to write '{self.file_name(symbol, '.json')}':  {str(e)}")
+
+
+    #  Merge the bars of a response (rows in time order), returning the number of rows stored
+    def merge(self, symbol, rows):
+
+        with self.lock:
+            state = self.get_mark(symbol)
+
+            mark = state['mark']
+            tail = state['tail']
+
+            new_rows = [row for row in rows if (mark is None) or ((row[0] >= mark - self.overlap) and (tail.get(row[0]) != row))]
+
+            if 0 == len(new_rows):
+                return 0
+
+            with open(self.file_name(symbol, '.jsonl'), 'a') as fp:
+                for row in new_rows:
+                    fp.write(json.dumps(row, separators=(',', ':')) + '\n')
+
+
+            #  Advance the mark and keep the bars of the last 'overlap' seconds to detect corrections
+            for row in new_rows:
+                tail[row[0]] = row
+
+            state['mark'] = max(tail.keys())
+
+            for ts in [ts for ts in tail.keys() if ts < state['mark'] - self.overlap]:
+                del tail[ts]
+
+            self.save(symbol, state)
+
+            return len(new_rows)
+
+
+    #  Merge corporate actions, each {'type': 'split' or 'div', 'date': ex-date timestamp, and 'numerator' and
+    #  'denominator' (split) or 'amount' (dividend)}, returning the number of new ones.
+    #
+    #  Bars the source sends are already adjusted for the splits it knows of, so a split only applies to the
+    #  bars stored before it became known and not sent again with it:  each action records the start of the
+    #  range queried when it was first seen ('seen_from', None when no bars were stored yet).  Call before
+    #  merge() with the same response.
+    def merge_events(self, symbol, events):
+
+        with self.lock:
+            state = self.get_mark(symbol)
+
+            known = set((event['type'], event['date']) for event in state['events'])
+
+            seen_from = None if state['mark'] is None else state['mark'] - self.overlap
+
+            new_events = [dict(event, seen_from=seen_from) for event in events if (event['type'], event['date']) not in known]
+
+            if 0 == len(new_events):
+                return 0
+
+            state['events'] = sorted(state['events'] + new_events, key=lambda event: event['date'])
+
+            self.save(symbol, state)
+
+            return len(new_events)
+
+
+    #  All bars stored for 'symbol' in time order
+    def read(self, symbol):
+
+        bars = {}
+
+        with self.lock:
+            try:
+                with open(self.file_name(symbol, '.jsonl'), 'r') as fp:
+                    for line in fp:
+                        if line.strip():
+                            row = json.loads(line)
+                            bars[row[0]] = row
+            except FileNotFoundError:
+                pass
+
+        return [bars[ts] for ts in sorted(bars.keys())]
+
+
+    #  The table of adjustment factors, (ex-date, price factor, volume factor, bars before) per corporate action.
+    #  An action applies to the bars before its ex-date and, unless 'bars before' is None, before that time.  'bars' (in time order)
+    #  provide the close before each dividend's ex-date.
+    def factor_table(self, symbol, bars):
+
+        with self.lock:
+            events = list(self.get_mark(symbol)['events'])
+
+        close_idx = 1 + self.columns.index('close')
+
+        closes = [(bar[0], bar[close_idx]) for bar in bars if bar[close_idx]]
+
+        table = []
+
+        for event in events:
+            if 'split' == event['type']:
+                #  Splits known when no bars were stored are already in all the bars
+                if event['seen_from'] is None:
+                    continue
+
+                ratio = float(event['numerator']) / float(event['denominator'])
+
+                table.append((event['date'], 1.0 / ratio, ratio, event['seen_from']))
+            else:
+                before = [close for (ts, close) in closes if ts < event['date']]
+
+                if (0 < len(before)) and (event['amount'] < before[-1]):
+                    table.append((event['date'], 1.0 - event['amount'] / before[-1], 1.0, None))
+
+        return table
+
+
+    #  All bars stored for 'symbol' adjusted for splits and dividends:  prices and volume are multiplied by the
+    #  products of the price and volume factors of the actions after each bar
+    def adjusted(self, symbol, prices=('open', 'high', 'low', 'close'), volume='volume'):
+
+        bars = self.read(symbol)
+
+        table = self.factor_table(symbol, bars)
+
+        price_idx  = [1 + self.columns.index(column) for column in prices]
+        volume_idx = (1 + self.columns.index(volume)) if volume in self.columns else None
+
+        adjusted = []
+
+        for bar in bars:
+            price_factor  = 1.0
+            volume_factor = 1.0
+
+            for (date, price_mult, volume_mult, bars_before) in table:
+                if (bar[0] < date) and ((bars_before is None) or (bar[0] < bars_before)):
+                    price_factor  *= price_mult
+                    volume_factor *= volume_mult
+
+            row = list(bar)
+
+            for idx in price_idx:
+                if row[idx] is not None:
+                    row[idx] *= price_factor
+
+            if (volume_idx is not None) and (row[volume_idx] is not None):
+                row[volume_idx] *= volume_factor
+
+            adjusted.append(row)
+
+        return adjusted
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""batch_controller.py:  Implements the controller which tunes the number
+   of symbols per query and the number of concurrent queries of a source
+   from how the source responds.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import time
+
+
+class Batch_Controller(object):
+
+    #  Additive increase, multiplicative decrease (AIMD), as TCP does with its congestion window.
+    #
+    #  A query which comes back fast enough (under 'target_latency') and small enough (under 'max_payload')
+    #  grows the batch size by about one symbol per round of concurrent queries, and once the batch size is
+    #  at its maximum, grows the concurrency the same way.  A slow or oversized response halves the batch
+    #  size, a rate limit response halves the concurrency and a failed query halves both.  Only one decrease
+    #  is made per round trip:  queries sent before the last decrease do not decrease again.
+    #
+    #  The controller is only called from the reactor thread so needs no lock.
+
+    def __init__(self, src_name, batch, threads, batch_min, batch_max, threads_min, threads_max, target_latency, max_payload):
+
+        self.src_name = src_name
+
+        self.batch_min   = max(1, batch_min)
+        self.batch_max   = max(self.batch_min, batch_max)
+        self.threads_min = max(1, threads_min)
+        self.threads_max = max(self.threads_min, threads_max)
+
+        self.target_latency = target_latency
+        self.max_payload    = max_payload
+
+        self.batch   = float(min(max(batch,   self.batch_min),   self.batch_max))
+        self.threads = float(min(max(threads, self.threads_min), self.threads_max))
+
+        self.last_decrease = 0.0
+
+
+    def current_batch(self):
+
+        return int(self.batch)
+
+
+    def current_threads(self):
+
+        return int(self.threads)
+
+
+    def report(self, old_batch, old_threads, reason):
+
+        if (old_batch != self.current_batch()) or (old_threads != self.current_threads()):
+            print(f"BATCH CONTROLLER({self.src_name}):  batch size {old_batch} -> {self.current_batch()}, "
+                  f"concurrency {old_threads} -> {self.current_threads()}  ({reason})", flush=True)
+
+
+    #  Feed back the outcome of a query sent at 'start' (time.monotonic()) for 'num_symbols' symbols
+    def observe(self, start, num_symbols, latency, payload, failed, rate_limited):
+
+        old_batch   = self.current_batch()
+        old_threads = self.current_threads()
+
+        slow  = (self.target_latency is not None) and (latency > self.target_latency)
+        large = (self.max_payload    is not None) and (payload > self.max_payload)
+
+
+        #  Multiplicative decrease
+        if failed or rate_limited or slow or large:
+            if start < self.last_decrease:
+                return
+
+            self.last_decrease = time.monotonic()
+
+            if rate_limited:
+                self.threads = max(self.threads_min, self.threads / 2.0)
+
+                reason = 'rate limited'
+            elif failed:
+                self.batch   = max(self.batch_min,   self.batch   / 2.0)
+                self.threads = max(self.threads_min, self.threads / 2.0)
+
+                reason = 'query failed'
+            elif slow:
+                self.batch = max(self.batch_min, self.batch / 2.0)
+
+                reason = 'response took %.2f seconds' % (latency)
+            else:
+                self.batch = max(self.batch_min, self.batch / 2.0)
+
+                reason = 'response of %d bytes' % (payload)
+
+            self.report(old_batch, old_threads, reason)
+
+            return
+
+
+        #  Additive increase, only when the query was a full batch (a short batch tells nothing about a larger one)
+        if num_symbols < old_batch:
+            return
+
+        step = 1.0 / max(1, old_threads)
+
+        if self.batch < self.batch_max:
+            self.batch = min(self.batch_max, self.batch + step)
+        else:
+            self.threads = min(self.threads_max, self.threads + step)
+
+        self.report(old_batch, old_threads, 'responses fast and small')
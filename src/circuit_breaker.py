@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""circuit_breaker.py:  Implements the per-host circuit breakers and the
+   jittered delays used when retrying failed queries.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import random
+
+import threading
+
+import time
+
+from utils import Shared_Slots
+
+
+#  "Decorrelated jitter":  each delay is drawn between 'base' and three times the previous delay, capped at 'cap'.
+#  Spreads out retries from many queries failing at once while still growing the delay on repeated failures.
+def decorrelated_jitter(prev, base, cap):
+
+    return min(cap, random.uniform(base, max(base, prev) * 3.0))
+
+
+class Circuit_Breaker(object):
+
+    #  CLOSED:     queries flow normally.  'threshold' consecutive failures open the breaker.
+    #  OPEN:       queries to the host are refused without being sent until the cooldown expires.
+    #  HALF_OPEN:  one probe query is let through.  Success closes the breaker, failure reopens it with a
+    #              longer (jittered, capped) cooldown.
+    #
+    #  With 'shared' (a Shared_Slots table) the state is kept in record 'index' of the table, so a breaker
+    #  opened by one of the processes running groups of sources holds the queries of the others.
+
+    states = ['CLOSED', 'OPEN', 'HALF_OPEN']
+
+    def __init__(self, host, threshold, cooldown, cooldown_cap, shared=None, index=None):
+
+        self.host = host
+
+        self.threshold    = threshold
+        self.cooldown     = cooldown
+        self.cooldown_cap = cooldown_cap
+
+        self.state      = 'CLOSED'
+        self.failures   = 0
+        self.open_until = 0.0
+        self.cur_cooldown = cooldown
+
+        self.probe_in_flight = False
+
+        self.shared = shared
+        self.index  = index
+
+        self.lock = threading.Lock() if shared is None else shared.lock
+
+
+    #  Called with self.lock held:  read (write) the state from (to) the shared table
+    def load(self):
+
+        if self.shared is not None:
+            self.state           = self.states[int(self.shared.get(self.index, 0))]
+            self.failures        = int(self.shared.get(self.index, 1))
+            self.open_until      = self.shared.get(self.index, 2)
+            self.cur_cooldown    = self.shared.get(self.index, 3)
+            self.probe_in_flight = bool(self.shared.get(self.index, 4))
+
+
+    def store(self):
+
+        if self.shared is not None:
+            for (field, value) in enumerate([self.states.index(self.state), self.failures, self.open_until, self.cur_cooldown, self.probe_in_flight]):
+                self.shared.set(self.index, field, float(value))
+
+
+    def transition(self, state, reason):
+
+        print(f"CIRCUIT BREAKER({self.host}):  {self.state} -> {state}  ({reason})", flush=True)
+
+        self.state = state
+
+
+    #  Returns True if a query may be sent to the host now
+    def allow(self):
+
+        with self.lock:
+            self.load()
+
+            if 'CLOSED' == self.state:
+                return True
+
+            if 'OPEN' == self.state:
+                if time.monotonic() < self.open_until:
+                    return False
+
+                self.transition('HALF_OPEN', 'cooldown of %.1f seconds expired, probing' % (self.cur_cooldown))
+
+            #  HALF_OPEN:  only one probe at a time
+            if self.probe_in_flight:
+                self.store()
+
+                return False
+
+            self.probe_in_flight = True
+
+            self.store()
+
+            return True
+
+
+    def record_success(self):
+
+        with self.lock:
+            self.load()
+
+            self.failures = 0
+
+            self.probe_in_flight = False
+
+            if 'CLOSED' != self.state:
+                self.cur_cooldown = self.cooldown
+
+                self.transition('CLOSED', 'probe succeeded')
+
+            self.store()
+
+
+    def record_failure(self):
+
+        with self.lock:
+            self.load()
+
+            self.failures += 1
+
+            if 'HALF_OPEN' == self.state:
+                self.probe_in_flight = False
+
+                self.cur_cooldown = decorrelated_jitter(self.cur_cooldown, self.cooldown, self.cooldown_cap)
+                self.open_until   = time.monotonic() + self.cur_cooldown
+
+                self.transition('OPEN', 'probe failed, next probe in %.1f seconds' % (self.cur_cooldown))
+
+            elif ('CLOSED' == self.state) and (self.failures >= self.threshold):
+                self.open_until = time.monotonic() + self.cur_cooldown
+
+                self.transition('OPEN', '%d consecutive failures, next probe in %.1f seconds' % (self.failures, self.cur_cooldown))
+
+            self.store()
+
+
+    def status(self):
+
+        with self.lock:
+            self.load()
+
+            if 'OPEN' == self.state:
+                return '%s (%d failures, probe in %.0f seconds)' % (self.state, self.failures, max(0.0, self.open_until - time.monotonic()))
+
+            return '%s (%d failures)' % (self.state, self.failures)
+
+
+#  Breakers shared by all sources querying the same host.  With 'source_groups', share_breakers() keeps them in
+#  shared memory, so all processes of Process 1 see the same breaker of a host.
+breakers = {}
+breakers_lock = threading.Lock()
+
+shared_breakers = None
+
+max_shared_hosts = 64
+
+
+#  Called by Process 1 before it forks the processes of the groups of sources
+def share_breakers():
+
+    global shared_breakers
+
+    with breakers_lock:
+        shared_breakers = Shared_Slots(max_shared_hosts, 5)
+
+        breakers.clear()
+
+
+def get_breaker(host, threshold, cooldown, cooldown_cap):
+
+    with breakers_lock:
+        if host not in breakers:
+            index = None
+
+            if shared_breakers is not None:
+                def init(index):
+                    shared_breakers.set(index, 3, cooldown)
+
+                index = shared_breakers.slot(host, init)
+
+                if index is None:
+                    print(f"WARNING(get_breaker()):  No room to share the circuit breaker of host '{host}', keeping it in this process only")
+
+            if index is None:
+                breakers[host] = Circuit_Breaker(host, threshold, cooldown, cooldown_cap)
+            else:
+                breakers[host] = Circuit_Breaker(host, threshold, cooldown, cooldown_cap, shared_breakers, index)
+
+        return breakers[host]
@@ -20,6 +20,7 @@ import sys
 runtime_params = {
     'cur_dir':  '',
     'log_dir':  '',
+    'state_dir':  '',
 
     'config_file':  'config.txt',
     'creds_file':   'credentials.txt',
@@ -49,6 +50,28 @@ runtime_params = {
     'proxies': {},
     'ca_cert': '',
 
+    'max_worker_threads':  16,
+    'max_reactor_queries':  256,
+
+    'control_socket':  'control.sock',
+
+    'ipc_shm_threshold':  256 * 1024,
+    'ipc_shm_size':  64 * 1024 * 1024,
+
+    'ipc_transport':  'queue',
+    'spool_segment_bytes':  64 * 1024 * 1024,
+    'spool_max_bytes':  2 * 1024 * 1024 * 1024,
+
+    'pt2_restart_delay':  5.0,
+    'pt2_stall_timeout':  600,
+
+    'pt2_workers':  1,
+    'pt2_batch':  64,
+    'pt2_pin_cpus':  False,
+
+    'source_groups':  [],
+    'source_restart_delay':  5.0,
+
     #  BEG:  FUTURE - DISTRIBUTE INFO TO CLIENTS
     'use_SSL':  True,
 
@@ -125,9 +148,17 @@ else:
 
 sp_queue     = JoinableQueue()    # None
 qu_entry_idx = 0                  # None
+qu_entry_step = 1                 #  Number of processes of Process 1 numbering entries (see 'source_groups')
 tk_entry_idx = 0                  # None
 log_quotes   = None
 log_ticker   = None
 log_q_lock   = threading.Lock()   # None
 log_t_lock   = threading.Lock()   # None
+worker_pool  = None               #  Thread pool shared by all sources for blocking queries
+shm_ring     = None               #  Shared memory ring for large responses sent to Process 2
+shm_rings    = []                 #  Process 2:  the rings of all processes of Process 1, by index
+pt2_super    = None               #  Process which starts Process 2 and restarts it when it dies
+group_super  = None               #  Process which runs the groups of sources in processes of their own
+log_suffix   = ''                 #  Appended to the names of the logs of a group of sources
+pt2_router   = None               #  Router of Process 2 to its workers when 'pt2_workers' is more than 1
 
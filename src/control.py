@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""control.py:  Implements the control channel used to pause, resume, drain,
+   enable and disable sources while the program runs.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import config
+
+import os
+
+from utils import state_file_path
+
+from twisted.internet import reactor, task
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import LineReceiver
+
+
+#  Commands accepted on the control socket, one per line.  Commands taking source names apply to all sources when none are given.
+help_text = [
+    "status                     list the state of each source",
+    "pause   [source ...]       hold queries until resumed",
+    "resume  [source ...]       resume paused sources",
+    "drain   [source ...]       finish the queries already scheduled, then disable",
+    "disable [source ...]       drop the queries already scheduled and stop querying",
+    "enable  [source ...]       start querying again",
+    "help                       this list",
+]
+
+
+def select_sources(names):
+
+    sources = config.runtime_params['sources']
+
+    if 0 == len(names):
+        return sources, []
+
+    by_name = {source.src_name: source for source in sources}
+
+    return [by_name[name] for name in names if name in by_name], [name for name in names if name not in by_name]
+
+
+#  Carry out one command, returning the lines of the reply
+def handle_command(line):
+
+    words = line.split()
+
+    if 0 == len(words):
+        return []
+
+    command = words[0].lower()
+
+    if 'help' == command:
+        return help_text
+
+    if 'status' == command:
+        return [source.control_status() for source in config.runtime_params['sources']]
+
+    if command not in ['pause', 'resume', 'drain', 'disable', 'enable']:
+        return [f"ERROR:  unknown command '{words[0]}' (try 'help')"]
+
+    sources, unknown = select_sources(words[1:])
+
+    if 0 < len(unknown):
+        return [f"ERROR:  unknown source(s) {', '.join(unknown)}"]
+
+    for source in sources:
+        if 'pause' == command:
+            source.set_pause(True, 'control channel')
+        elif 'resume' == command:
+            source.set_pause(False, 'control channel')
+        elif 'drain' == command:
+            source.start_drain()
+        elif 'disable' == command:
+            source.set_enabled(False)
+        else:
+            source.set_enabled(True)
+
+    return [f"OK:  {command} {', '.join(source.src_name for source in sources)}"]
+
+
+class Control_Protocol(LineReceiver):
+
+    delimiter = b'\n'
+
+    def lineReceived(self, line):
+
+        for reply in handle_command(line.decode('utf-8', 'replace')):
+            self.sendLine(reply.encode('utf-8'))
+
+
+class Control_Factory(Factory):
+
+    protocol = Control_Protocol
+
+
+#  Pause (resume) all sources when the pause file appears (disappears).  Polled once for all sources.
+class Pause_File_Watcher(object):
+
+    def __init__(self, file_name):
+
+        self.file_name = file_name
+
+        self.present = False
+
+
+    def check(self):
+
+        present = os.path.isfile(self.file_name)
+
+        if present != self.present:
+            self.present = present
+
+            for source in config.runtime_params['sources']:
+                source.set_pause(present, f"file '{self.file_name}' {'found' if present else 'removed'}")
+
+
+def start_control():
+
+    #  Watch the pause file, polling at the shortest 'pause_sleep' of the sources
+    poll = min([source.pause_sleep for source in config.runtime_params['sources']] or [10])
+
+    watcher = Pause_File_Watcher(os.path.join(str(config.runtime_params['cur_dir']), 'pause.txt'))
+
+    task.LoopingCall(watcher.check).start(poll, now=True)
+
+
+    #  Listen on the control socket
+    if config.runtime_params['control_socket']:
+        sock_name = state_file_path(config.runtime_params['control_socket'])
+
+        #  Remove a socket left behind by an earlier run
+        if os.path.exists(sock_name):
+            os.remove(sock_name)
+
+        try:
+            reactor.listenUNIX(sock_name, Control_Factory(), mode=0o600)
+        except Exception as e:
+            print(f"WARNING(start_control()):  Unable to listen on control socket '{sock_name}':  {str(e)}")
+        else:
+            print(f"CONTROL:  Listening on '{sock_name}'")
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""envelope.py:  Implements the binary envelope in which Process 1 sends
+   query responses to Process 2.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import struct
+
+from datetime import datetime
+
+from dateutil import tz
+
+
+#  An envelope is one fixed size header followed by the variable length fields it gives the lengths of:
+#
+#    magic, envelope format version, source id, payload kind, entry number, time (ns since the epoch),
+#    lengths of the query type, source version, symbols ('|' separated), URL and payload
+#
+#  so Process 2 finds the source and every field with one unpack and without scanning the payload.
+header = struct.Struct('<4sBHBIqHHIII')
+
+magic = b'TLE1'
+
+envelope_version = 1
+
+
+#  Payload kinds
+payload_json     = 0
+payload_columnar = 1   #  ColumnarResult frame (yahooquery/columnar.py)
+
+
+#  Source ids, fixed so that envelopes written by one version can be read by another.  0 is an unknown source.
+source_ids = {
+    'CNBC_Intraday':      1,
+    'CNBC_Daily':         2,
+    'Yahoo_Intraday':     3,
+    'Yahoo_Daily':        4,
+    'Reuters_Daily':      5,
+    'IEX_Intraday':       6,
+    'AlphaVantage_Daily': 7,
+    'MarketData_Daily':   8,
+}
+
+
+#  Format of the time of an entry in the quotes log
+log_time_format = '%Y-%m-%d %H:%M:%S.%f %Z'
+
+
+#  The time of a query as the quotes log shows it, carrying the time in ns since the epoch it was made from
+class Log_Timestamp(str):
+
+    def __new__(cls, time_ns):
+
+        seconds, ns = divmod(time_ns, 1000000000)
+
+        text = datetime.fromtimestamp(seconds, tz.tzlocal()).replace(microsecond=ns // 1000).strftime(log_time_format)
+
+        log_timestamp = super().__new__(cls, text)
+
+        log_timestamp.time_ns = time_ns
+
+        return log_timestamp
+
+
+def is_envelope(message):
+
+    return isinstance(message, (bytes, bytearray, memoryview)) and (bytes(message[:len(magic)]) == magic)
+
+
+class Envelope(object):
+
+    __slots__ = ['src_id', 'query_type', 'symbols', 'time_ns', 'version', 'url', 'payload', 'kind', 'entry_idx']
+
+    def __init__(self, src_id, query_type, symbols, time_ns, version, url, payload, kind=payload_json, entry_idx=0):
+
+        self.src_id     = src_id
+        self.query_type = query_type
+        self.symbols    = symbols
+        self.time_ns    = time_ns
+        self.version    = version
+        self.url        = url
+        self.payload    = payload    #  bytes (or a memoryview of them)
+        self.kind       = kind
+        self.entry_idx  = entry_idx
+
+
+    #  The variable length fields, encoded
+    def fields(self):
+
+        return [self.query_type.encode('utf-8'), self.version.encode('utf-8'), '|'.join(self.symbols).encode('utf-8'), self.url.encode('utf-8')]
+
+
+    def pack_header(self, fields):
+
+        (query_type, version, symbols, url) = fields
+
+        return header.pack(magic, envelope_version, self.src_id, self.kind, self.entry_idx, self.time_ns,
+                           len(query_type), len(version), len(symbols), len(url), len(self.payload))
+
+
+    def to_bytes(self):
+
+        fields = self.fields()
+
+        return b''.join([self.pack_header(fields)] + fields + [self.payload])
+
+
+    #  Number of bytes of the envelope
+    def size(self):
+
+        return header.size + sum(len(field) for field in self.fields()) + len(self.payload)
+
+
+    #  Write the envelope into 'buf' at 'offset' (e.g. into the shared memory ring) with one copy of the payload
+    def pack_into(self, buf, offset):
+
+        fields = self.fields()
+
+        for part in [self.pack_header(fields)] + fields + [self.payload]:
+            buf[offset:offset + len(part)] = part
+            offset += len(part)
+
+
+    #  The payload is a view of 'message', not a copy
+    @classmethod
+    def from_bytes(cls, message):
+
+        view = memoryview(message)
+
+        (msg_magic, msg_version, src_id, kind, entry_idx, time_ns,
+         len_query_type, len_version, len_symbols, len_url, len_payload) = header.unpack_from(view, 0)
+
+        if (magic != msg_magic) or (envelope_version != msg_version):
+            raise ValueError(f"Not an envelope of version {envelope_version}")
+
+        fields = []
+        offset = header.size
+
+        for length in [len_query_type, len_version, len_symbols, len_url]:
+            fields.append(str(view[offset:offset + length], 'utf-8'))
+            offset += length
+
+        (query_type, version, symbols, url) = fields
+
+        return cls(src_id, query_type, symbols.split('|'), time_ns, version, url, view[offset:offset + len_payload], kind, entry_idx)
+
+
+    def batch_str(self):
+
+        return '|'.join(self.symbols)
+
+
+    def log_timestamp(self):
+
+        return Log_Timestamp(self.time_ns)
+
+
+    #  The payload as the text of the response
+    def payload_text(self):
+
+        if payload_columnar == self.kind:
+            from yahooquery.columnar import ColumnarResult
+
+            return ColumnarResult.from_bytes(self.payload).to_json(separators=(',', ':'))
+
+        return str(self.payload, 'utf-8')
+
+
+    #  The entry of the quotes log.  'text' is the payload text when the caller has it already.
+    def render(self, text=None):
+
+        if text is None:
+            text = self.payload_text()
+
+        return ("\n" +
+                "\n" +
+                "ENTRY[%06d]:  TYPE=QUOTE  TIME=%s  QUERY_TYPE=%s  VERSION=%s\n" % (self.entry_idx, self.log_timestamp(), self.query_type, self.version) +
+                self.batch_str() + "\n" +
+                self.url         + "\n" +
+                text             + "\n")
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""option_store.py:  Implements the class which keeps the history of option
+   chains as keyframes and day-over-day deltas.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import json
+
+import os
+
+import threading
+
+from utils import state_dir_path, read_json_state, write_json_state
+
+
+class Option_Store(object):
+
+    #  The snapshots of the option chain of a symbol are kept, one record per line, in the state directory
+    #  under options/<source>/<symbol>.jsonl.  A record is
+    #
+    #    {"t": snapshot time, "k": 1 (keyframe) or 0 (delta), "c": {contract: {field: value, ...}, ...}, "x": [contract, ...]}
+    #
+    #  where a contract is named 'expiration|strike|C' (or P) and the quote of the underlying is kept as the
+    #  contract '_quote'.  A keyframe holds every field of every contract, a delta only the fields which
+    #  changed since the previous snapshot (all fields for a new contract) and under "x" the contracts which
+    #  expired.  Every 'keyframe_every' snapshots a keyframe is written so a chain is rebuilt from the last
+    #  keyframe before the time asked for, found through an index of the file offsets of the keyframes kept in
+    #  <symbol>.idx.  The index is rewritten with each keyframe, so loading a symbol replays its records from
+    #  the last keyframe only.
+    #
+    #  Snapshots may cover part of a chain (see option_chain_window_LOC()), so contracts missing from a
+    #  snapshot are not taken as removed:  they keep their last known fields until they expire.
+
+    def __init__(self, src_name, keyframe_every):
+
+        self.dir_name = state_dir_path('options', src_name)
+
+        self.keyframe_every = keyframe_every
+
+        self.lock = threading.Lock()
+
+        #  By symbol:  the chain as of the last snapshot, the number of deltas since the last keyframe and
+        #  the (time, file offset) of each keyframe.  Rebuilt from the file when a symbol is first used.
+        self.chains = {}
+
+
+    def file_name(self, symbol):
+
+        return os.path.join(self.dir_name, symbol + '.jsonl')
+
+
+    def index_name(self, symbol):
+
+        return os.path.join(self.dir_name, symbol + '.idx')
+
+
+    #  Called with self.lock held
+    def get_chain(self, symbol):
+
+        if symbol not in self.chains:
+            keyframes = [tuple(keyframe) for keyframe in read_json_state(self.index_name(symbol), {}).get('keyframes', [])]
+
+            #  Replay from the last keyframe indexed, or the whole file if the index does not match it
+            start = keyframes[-1][1] if (0 < len(keyframes)) else 0
+
+            if (0 < start) and not self.is_keyframe_at(symbol, start):
+                print(f"WARNING(Option_Store::get_chain()):  Index of '{symbol}' does not match its records, rebuilding it")
+
+                keyframes, start = [], 0
+
+            state = {'chain': {}, 'deltas': 0, 'keyframes': keyframes[:-1]}
+
+            for (offset, record) in self.records(symbol, start):
+                if record['k']:
+                    state['keyframes'].append((record['t'], offset))
+
+                    state['deltas'] = 0
+                else:
+                    state['deltas'] += 1
+
+                apply_record(state['chain'], record)
+
+            if state['keyframes'] != keyframes:
+                self.save_index(symbol, state)
+
+            self.chains[symbol] = state
+
+        return self.chains[symbol]
+
+
+    def is_keyframe_at(self, symbol, offset):
+
+        try:
+            for (record_offset, record) in self.records(symbol, offset):
+                return (offset == record_offset) and (1 == record['k'])
+        except ValueError:
+            pass
+
+        return False
+
+
+    def save_index(self, symbol, state):
+
+        try:
+            write_json_state(self.index_name(symbol), {'keyframes': state['keyframes']})
+        except OSError as e:
+            print(f"WARNING(Option_Store::save_index()):  Unable to write '{self.index_name(symbol)}':  {str(e)}")
+
+
+    #  (file offset, record) of the records of 'symbol' from 'offset' on
+    def records(self, symbol, offset=0):
+
+        try:
+            with open(self.file_name(symbol), 'rb') as fp:
+                fp.seek(offset)
+
+                while True:
+                    line_offset = fp.tell()
+
+                    line = fp.readline()
+
+                    if not line:
+                        break
+
+                    if line.strip():
+                        yield line_offset, json.loads(line)
+        except FileNotFoundError:
+            return
+
+
+    #  Add the snapshot taken at 'timestamp' of a Yahoo option chain result, returning the record written and its JSON
+    #  text (the chain of a keyframe record is the store's, it changes with the next snapshot)
+    def add_snapshot(self, symbol, timestamp, result):
+
+        contracts = chain_contracts(result)
+
+        with self.lock:
+            state = self.get_chain(symbol)
+
+            chain = state['chain']
+
+            keyframe = (0 == len(state['keyframes'])) or (state['deltas'] + 1 >= self.keyframe_every)
+
+
+            #  Contracts which expired before this snapshot
+            expired = [name for name in chain.keys() if ('_quote' != name) and (int(name.split('|', 1)[0]) + 24 * 60 * 60 < timestamp)]
+
+            for name in expired:
+                del chain[name]
+
+
+            if keyframe:
+                for (name, fields) in contracts.items():
+                    chain.setdefault(name, {}).update(fields)
+
+                record = {'t': timestamp, 'k': 1, 'c': chain, 'x': []}
+            else:
+                changes = {}
+
+                for (name, fields) in contracts.items():
+                    known = chain.get(name, {})
+
+                    changed = {field: value for (field, value) in fields.items() if (field not in known) or (known[field] != value)}
+
+                    if 0 < len(changed):
+                        changes[name] = changed
+
+                record = {'t': timestamp, 'k': 0, 'c': changes, 'x': expired}
+
+                apply_record(chain, record)
+
+            text = json.dumps(record, separators=(',', ':'))
+
+            with open(self.file_name(symbol), 'ab') as fp:
+                offset = fp.tell()
+
+                fp.write((text + '\n').encode('utf-8'))
+
+            if keyframe:
+                state['keyframes'].append((timestamp, offset))
+
+                state['deltas'] = 0
+
+                self.save_index(symbol, state)
+            else:
+                state['deltas'] += 1
+
+            return record, text
+
+
+    #  The chain of 'symbol' as of time 'at':  {contract: {field: value, ...}, ...}.  Empty if no snapshot is that old.
+    def reconstruct(self, symbol, at):
+
+        with self.lock:
+            keyframes = list(self.get_chain(symbol)['keyframes'])
+
+        starts = [offset for (timestamp, offset) in keyframes if timestamp <= at]
+
+        if 0 == len(starts):
+            return {}
+
+        chain = {}
+
+        for (offset, record) in self.records(symbol, starts[-1]):
+            if at < record['t']:
+                break
+
+            apply_record(chain, record)
+
+        return chain
+
+
+#  Apply a record to a chain
+def apply_record(chain, record):
+
+    if record['k']:
+        chain.clear()
+
+    for name in record.get('x', []):
+        chain.pop(name, None)
+
+    for (name, fields) in record['c'].items():
+        chain.setdefault(name, {}).update(fields)
+
+
+#  The contracts of a Yahoo option chain result, {contract: {field: value, ...}, ...}, plus the quote of the underlying as '_quote'
+def chain_contracts(result):
+
+    contracts = {}
+
+    if not isinstance(result, dict):
+        return contracts
+
+    if isinstance(result.get('quote'), dict):
+        contracts['_quote'] = result['quote']
+
+    for option in result.get('options', []):
+        for (option_type, letter) in [('calls', 'C'), ('puts', 'P')]:
+            for contract in option.get(option_type, []):
+                contracts['%d|%s|%s' % (option.get('expirationDate', contract.get('expiration', 0)), contract.get('strike'), letter)] = contract
+
+    return contracts
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+"""pt2_shards.py:  Implements the router which spreads the messages received by
+   Process 2 over several worker processes, keeping the messages of each
+   symbol in order.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import os
+
+import queue
+
+import threading
+
+import time
+
+import traceback
+
+import zlib
+
+from collections import OrderedDict
+
+from multiprocessing import Process, Queue
+
+
+#  Worker handling the messages of a symbol when none of its messages is in flight
+def shard_of(symbol, num_workers):
+
+    return zlib.crc32(symbol.encode('utf-8')) % num_workers
+
+
+#  CPU to pin worker 'idx' to, leaving the first CPU to Process 1 and the router.  None where pinning is not supported.
+def worker_cpu(idx):
+
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+
+    cpus = sorted(os.sched_getaffinity(0))
+
+    return cpus[(idx + 1) % len(cpus)]
+
+
+#  Main of a worker process:  handle the batches of messages the router sends, in order, and report the
+#  sequence numbers of each batch done.  'worker_init(idx, outbox)' runs first, in the worker.
+def shard_worker(idx, inbox, outbox, worker_init, handler, cpu):
+
+    if cpu is not None:
+        os.sched_setaffinity(0, [cpu])
+
+    parent = os.getppid()
+
+    worker_init(idx, outbox)
+
+    while True:
+        try:
+            batch = inbox.get(timeout=1.0)
+        except queue.Empty:
+            #  The router is gone
+            if os.getppid() != parent:
+                return
+            continue
+
+        if batch is None:
+            return
+
+        for (seq, message) in batch:
+            try:
+                handler(message)
+            except Exception as e:
+                print(f"ERROR(shard_worker()):  Worker {idx}:  {type(e).__name__} handling a message:  {str(e)}", flush=True)
+                traceback.print_exc()
+
+        outbox.put(('done', idx, [seq for (seq, message) in batch]))
+
+
+class Shard_Router(object):
+
+    #  A message goes to the worker which has messages of any of its symbols in flight, so the messages of a
+    #  symbol are handled in the order received even when batches of symbols change from one query to the next.
+    #  A message with no symbol in flight goes to the worker its first symbol hashes to.  A message whose
+    #  symbols are in flight on different workers waits until all but one of those workers are done with them.
+    #
+    #  The 'release' given with each message (e.g. acknowledging it in the spool) runs once it and every
+    #  message received before it are done, so releases run in the order messages were received.  The
+    #  merger thread reads what the workers report:  batches done, and ticker messages passed to 'on_ticker'.
+
+    def __init__(self, num_workers, worker_init, handler, pin_cpus=False, max_pending=1024, on_ticker=None):
+
+        self.max_pending = max_pending
+        self.on_ticker   = on_ticker
+
+        self.outbox  = Queue()
+        self.workers = []
+
+        for idx in range(num_workers):
+            inbox = Queue()
+
+            proc = Process(target=shard_worker, args=(idx, inbox, self.outbox, worker_init, handler, worker_cpu(idx) if pin_cpus else None))
+            proc.daemon = True
+            proc.start()
+
+            self.workers.append((proc, inbox))
+
+        self.cond      = threading.Condition()
+        self.seq       = 0
+        self.pending   = OrderedDict()                 #  seq:  [worker, symbols, release, done]
+        self.in_flight = {}                            #  symbol:  [worker, number of messages in flight]
+        self.outgoing  = [[] for _ in self.workers]    #  Messages routed to each worker, not sent yet
+
+        self.merger = threading.Thread(target=self.merge, name='pt2_merger', daemon=True)
+        self.merger.start()
+
+
+    #  Called with self.cond held
+    def check_workers(self):
+
+        for (idx, (proc, inbox)) in enumerate(self.workers):
+            if not proc.is_alive():
+                raise RuntimeError(f"Worker {idx} of Process 2 exited with code {proc.exitcode}")
+
+
+    #  Called with self.cond held
+    def pick_worker(self, symbols):
+
+        busy = set(self.in_flight[symbol][0] for symbol in symbols if symbol in self.in_flight)
+
+        if 1 < len(busy):
+            return None
+
+        if 1 == len(busy):
+            return busy.pop()
+
+        return shard_of(symbols[0], len(self.workers)) if (0 < len(symbols)) else 0
+
+
+    #  Route 'message', whose symbols are 'symbols', to a worker.  Waits while it can not be routed yet or while
+    #  'max_pending' messages are in flight.  Messages are sent by flush().
+    def route(self, message, symbols, release=None):
+
+        with self.cond:
+            while True:
+                worker = self.pick_worker(symbols)
+
+                if (worker is not None) and (len(self.pending) < self.max_pending):
+                    break
+
+                self.flush_locked()
+
+                self.cond.wait(1.0)
+
+                self.check_workers()
+
+            self.seq += 1
+
+            self.pending[self.seq] = [worker, symbols, release, False]
+
+            for symbol in symbols:
+                self.in_flight.setdefault(symbol, [worker, 0])[1] += 1
+
+            self.outgoing[worker].append((self.seq, message))
+
+
+    #  Send the messages routed so far, one batch per worker
+    def flush(self):
+
+        with self.cond:
+            self.flush_locked()
+
+
+    def flush_locked(self):
+
+        for (idx, batch) in enumerate(self.outgoing):
+            if 0 < len(batch):
+                self.workers[idx][1].put(batch)
+
+                self.outgoing[idx] = []
+
+
+    #  Merger thread
+    def merge(self):
+
+        while True:
+            report = self.outbox.get()
+
+            if 'done' == report[0]:
+                self.complete(report[2])
+
+            elif ('ticker' == report[0]) and (self.on_ticker is not None):
+                try:
+                    self.on_ticker(report[1])
+                except Exception as e:
+                    print(f"ERROR(Shard_Router::merge()):  {type(e).__name__} forwarding a ticker message:  {str(e)}", flush=True)
+
+
+    def complete(self, seqs):
+
+        with self.cond:
+            for seq in seqs:
+                entry = self.pending[seq]
+
+                entry[3] = True
+
+                for symbol in entry[1]:
+                    state = self.in_flight[symbol]
+
+                    state[1] -= 1
+
+                    if 0 == state[1]:
+                        del self.in_flight[symbol]
+
+            #  Release, in order, the messages done with everything received before them
+            while 0 < len(self.pending):
+                (seq, entry) = next(iter(self.pending.items()))
+
+                if not entry[3]:
+                    break
+
+                del self.pending[seq]
+
+                if entry[2] is not None:
+                    entry[2]()
+
+            self.cond.notify_all()
+
+
+    #  Wait until every message routed is done
+    def join(self, timeout=None):
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.cond:
+            self.flush_locked()
+
+            while 0 < len(self.pending):
+                if (deadline is not None) and (deadline <= time.monotonic()):
+                    return False
+
+                self.cond.wait(1.0)
+
+                self.check_workers()
+
+        return True
+
+
+    def stop(self):
+
+        for (proc, inbox) in self.workers:
+            inbox.put(None)
+
+        for (proc, inbox) in self.workers:
+            proc.join(5.0)
+
+
+#  Stands in for the ticker log in a worker:  ticker messages go to the merger, which writes the one ticker
+#  log of Process 2 and forwards them to the clients
+class Ticker_Sink(object):
+
+    def __init__(self, outbox):
+
+        self.outbox = outbox
+
+
+    def write(self, message):
+
+        self.outbox.put(('ticker', message))
+
+
+    def flush(self):
+
+        pass
+
+
+    def close(self):
+
+        pass
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""rate_limiter.py:  Implements the token buckets which pace queries to the
+   data sources and the ledger which tracks daily query quotas.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import fcntl
+
+import threading
+
+import time
+
+from datetime import date
+
+from utils import state_file_path, read_json_state, write_json_state, Shared_Slots
+
+
+class Token_Bucket(object):
+
+    #  Tokens accrue at 'rate' per second up to 'burst'.  Each query takes one token.  When the bucket is
+    #  empty the query reserves the next token to accrue, so the caller learns how long to wait rather
+    #  than being refused.
+    #
+    #  With 'shared' (a Shared_Slots table) the tokens and the time they were counted are kept in record
+    #  'index' of the table, so the processes running groups of sources draw from the same bucket.
+
+    def __init__(self, rate, burst, shared=None, index=None):
+
+        self.rate  = float(rate)
+        self.burst = max(1.0, float(burst))
+
+        self.tokens = self.burst
+        self.last   = time.monotonic()
+
+        self.shared = shared
+        self.index  = index
+
+        self.lock = threading.Lock() if shared is None else shared.lock
+
+
+    #  Take a token, returning the number of seconds to wait before the query may be sent
+    def reserve(self):
+
+        with self.lock:
+            if self.shared is not None:
+                self.tokens = self.shared.get(self.index, 0)
+                self.last   = self.shared.get(self.index, 1)
+
+            now = time.monotonic()
+
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last   = now
+
+            self.tokens -= 1.0
+
+            if self.shared is not None:
+                self.shared.set(self.index, 0, self.tokens)
+                self.shared.set(self.index, 1, self.last)
+
+            if 0.0 <= self.tokens:
+                return 0.0
+
+            return -self.tokens / self.rate
+
+
+#  Buckets shared by all sources querying the same host.  With 'source_groups', share_host_buckets() keeps them
+#  in shared memory, so a host's rate holds across all processes of Process 1.
+host_buckets = {}
+host_buckets_lock = threading.Lock()
+
+shared_buckets = None
+
+max_shared_hosts = 64
+
+
+#  Called by Process 1 before it forks the processes of the groups of sources
+def share_host_buckets():
+
+    global shared_buckets
+
+    with host_buckets_lock:
+        shared_buckets = Shared_Slots(max_shared_hosts, 2)
+
+        host_buckets.clear()
+
+
+def get_host_bucket(host, rate, burst):
+
+    with host_buckets_lock:
+        if host not in host_buckets:
+            index = None
+
+            if shared_buckets is not None:
+                def init(index):
+                    shared_buckets.set(index, 0, max(1.0, float(burst)))
+                    shared_buckets.set(index, 1, time.monotonic())
+
+                index = shared_buckets.slot(host, init)
+
+                if index is None:
+                    print(f"WARNING(get_host_bucket()):  No room to share the rate limit of host '{host}', limiting it in this process only")
+
+            if index is None:
+                host_buckets[host] = Token_Bucket(rate, burst)
+            else:
+                host_buckets[host] = Token_Bucket(rate, burst, shared_buckets, index)
+
+        return host_buckets[host]
+
+
+class Quota_Ledger(object):
+
+    #  Counts the queries made today for each source.  The counts are written to disk after every query so
+    #  a restart in the middle of the day picks up where it left off instead of spending the quota again.
+    #  The processes running groups of sources share the file:  consume() takes a lock on it and rereads it,
+    #  so each process writes back the counts of the others as it found them.
+
+    def __init__(self, file_name):
+
+        self.file_name = file_name
+
+        self.lock = threading.Lock()
+
+        state = read_json_state(self.file_name, {})
+
+        self.day    = state.get('day', date.today().isoformat())
+        self.counts = state.get('counts', {})
+
+        self.roll_over()
+
+        if self.counts:
+            print(f"QUOTA LEDGER:  Loaded counts for {self.day} from '{self.file_name}':  {self.counts}")
+
+
+    #  Start new counts when the day changes.  Called with self.lock held (or before the ledger is shared).
+    def roll_over(self):
+
+        today = date.today().isoformat()
+
+        if today != self.day:
+            self.day    = today
+            self.counts = {}
+
+
+    def used(self, key):
+
+        with self.lock:
+            self.roll_over()
+
+            return self.counts.get(key, 0)
+
+
+    def remaining(self, key, limit):
+
+        return max(0, limit - self.used(key))
+
+
+    def consume(self, key, num=1):
+
+        with self.lock:
+            try:
+                with open(self.file_name + '.lock', 'a') as lock_fp:
+                    fcntl.flock(lock_fp, fcntl.LOCK_EX)
+
+                    self.roll_over()
+
+                    state = read_json_state(self.file_name, {})
+
+                    if state.get('day') == self.day:
+                        self.counts = state.get('counts', {})
+
+                    self.counts[key] = self.counts.get(key, 0) + num
+
+                    write_json_state(self.file_name, {'day': self.day, 'counts': self.counts})
+            except OSError as e:
+                print(f"WARNING(Quota_Ledger::consume()):  Unable to write '{self.file_name}':  {str(e)}")
+
+
+quota_ledger = None
+quota_ledger_lock = threading.Lock()
+
+
+def get_quota_ledger():
+
+    global quota_ledger
+
+    with quota_ledger_lock:
+        if quota_ledger is None:
+            quota_ledger = Quota_Ledger(state_file_path('quota_ledger.json'))
+
+        return quota_ledger
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+"""scheduler.py:  Implements the scheduler which issues the queries of all
+   sources in order of their deadlines and checks each source's cycle of
+   queries fits in its 'delta_quote'.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import config
+
+import heapq
+
+import itertools
+
+import math
+
+import time
+
+from collections import deque
+
+from twisted.internet import reactor, defer
+from twisted.python.failure import Failure
+
+
+class Query_Scheduler(object):
+
+    #  Every run_recurring_query() of a source starts a "cycle":  the batches of symbols which must all be
+    #  queried before the next cycle starts 'delta_quote' seconds later.  The batches of a cycle are given
+    #  deadlines spread evenly over the cycle and wait, in order, in a queue of (deadline, cycle, batch_list)
+    #  work items of their source.  The sources ready to issue a query (not paused or held, with a free slot)
+    #  wait in a heap of (deadline of their next work item, seq, source).  Whenever a query slot frees up, the
+    #  source with the earliest deadline is popped from the heap and issues its next work item.  A source
+    #  which is not ready leaves the heap until release() puts it back, so held sources cost nothing.
+    #
+    #  Queries which block a thread of the worker pool are limited to 'max_worker_threads' and those of the
+    #  non-blocking fetch engine, which only wait on the reactor, to 'max_reactor_queries'.  Each has a heap.
+    #
+    #  Each source gets as many slots (concurrent queries) as its cycle needs to fit in 'delta_quote', up to
+    #  'max_threads' (or the concurrency set by its batch controller).  A slot idles 'batch_sleep_time' after
+    #  each query before it is used again.  The time queries take is measured and fed back into the number
+    #  of slots, and batches still waiting when the next cycle of their source starts are reported as an
+    #  overrun and dropped in favor of the new cycle.
+
+    def __init__(self, max_in_flight, max_in_flight_reactor):
+
+        self.max_in_flight = {'pool': max_in_flight, 'reactor': max_in_flight_reactor}
+        self.in_flight     = {'pool': 0, 'reactor': 0}
+
+        self.heaps = {'pool': [], 'reactor': []}
+        self.seq   = itertools.count()
+
+        #  Per source state, keyed by source name
+        self.states = {}
+
+
+    def get_state(self, source):
+
+        if source.src_name not in self.states:
+            self.states[source.src_name] = {
+                'cycle':        0,
+                'cycle_start':  0.0,
+                'horizon':      0.0,
+                'num_batches':  0,
+                'pending':      0,
+                'queued':       0,
+                'results':      [],
+                'slots':        1,
+                'in_flight':    0,
+                'latency':      None,
+                'warned_cycle': 0,
+                'work':         deque(),
+                'in_heap':      False,
+                'engine':       'reactor' if source.use_twisted_fetch() else 'pool',
+            }
+
+        return self.states[source.src_name]
+
+
+    #  Number of concurrent queries a source needs to issue 'num_batches' queries within 'horizon' seconds
+    def required_slots(self, source, state, num_batches, horizon):
+
+        latency = state['latency'] or 0.0
+
+        #  Rate limited sources are paced by their token buckets rather than 'batch_sleep_time'
+        if source.rate_per_sec is None:
+            slot_period = source.batch_sleep_time + latency
+        else:
+            slot_period = max(1.0 / source.rate_per_sec, latency)
+
+        if 0.0 >= slot_period:
+            return max(1, num_batches)
+
+        queries_per_slot = max(1, math.floor(horizon / slot_period))
+
+        return max(1, math.ceil(num_batches / queries_per_slot))
+
+
+    #  Size the number of slots of a source to the batches of its cycle not yet issued and the time left in the cycle.
+    #  Warns (once per cycle) when even the most slots allowed are not enough.
+    def resize_slots(self, source, state):
+
+        time_left = state['horizon'] - (time.monotonic() - state['cycle_start'])
+
+        slots = self.required_slots(source, state, state['queued'], max(time_left, 0.0))
+
+        limit = source.concurrency_limit()
+
+        if (slots > limit) and (state['warned_cycle'] != state['cycle']):
+            print(f"SCHEDULER({source.src_name}):  WARNING:  {state['queued']} batches need {slots} concurrent queries to complete in "
+                  f"{max(time_left, 0.0):.1f} seconds but only {limit} are allowed.  Expect a cycle overrun.", flush=True)
+
+            state['warned_cycle'] = state['cycle']
+
+        state['slots'] = max(1, min(slots, limit))
+
+
+    #  Start a new cycle of queries for 'source'.  Returns a Deferred which fires with the results of the cycle's queries.
+    def submit_cycle(self, source, batches, horizon):
+
+        state = self.get_state(source)
+
+        now = time.monotonic()
+
+
+        #  Overrun:  the previous cycle is not done.  Drop its batches still waiting, the new cycle queries the same symbols.
+        if 0 < state['pending']:
+            num_queued = self.drop_queued(source)
+
+            print(f"SCHEDULER({source.src_name}):  CYCLE OVERRUN.  Previous cycle of {state['num_batches']} batches not done after "
+                  f"{now - state['cycle_start']:.1f} seconds ({num_queued} batches dropped, {state['pending'] - num_queued} in flight).", flush=True)
+
+            self.finish_cycle(source, state)
+
+
+        state['cycle'] += 1
+        state['cycle_start'] = now
+        state['horizon']     = horizon
+        state['num_batches'] = len(batches)
+        state['pending']     = len(batches)
+        state['queued']      = len(batches)
+        state['results']     = []
+        state['d_cycle']     = defer.Deferred()
+
+        d_cycle = state['d_cycle']
+
+
+        self.resize_slots(source, state)
+
+        if config.runtime_params['debug_options']['threads']:
+            print(f"SCHEDULER({source.src_name}):  cycle {state['cycle']}:  {len(batches)} batches in {horizon:.1f} seconds "
+                  f"with {state['slots']} concurrent queries (measured query time {state['latency'] or 0.0:.2f} seconds)")
+
+
+        if 0 == len(batches):
+            self.finish_cycle(source, state)
+
+            return d_cycle
+
+
+        #  Spread the deadlines of the batches evenly over the cycle
+        spacing = horizon / len(batches)
+
+        for (idx, batch_list) in enumerate(batches):
+            state['work'].append((now + (idx + 1) * spacing, state['cycle'], batch_list))
+
+        self.release(source)
+
+        return d_cycle
+
+
+    #  Remove the queued work items of a source, returning how many were removed
+    def drop_queued(self, source):
+
+        state = self.get_state(source)
+
+        num_queued = len(state['work'])
+
+        state['work'].clear()
+        state['queued'] = 0
+
+        if state['in_heap']:
+            heap = self.heaps[state['engine']]
+
+            heap[:] = [item for item in heap if item[2] is not source]
+
+            heapq.heapify(heap)
+
+            state['in_heap'] = False
+
+        return num_queued
+
+
+    def finish_cycle(self, source, state):
+
+        state['pending'] = 0
+
+        d_cycle = state.pop('d_cycle', None)
+
+        if d_cycle is not None:
+            d_cycle.callback(state['results'])
+
+        if source.draining:
+            source.drain_done()
+
+
+    #  Whether the current cycle of a source still has queries queued or in flight
+    def cycle_pending(self, source):
+
+        return 0 < self.get_state(source)['pending']
+
+
+    #  Drop the queued queries of a source's current cycle.  Queries in flight complete but are not waited for.
+    def cancel_cycle(self, source):
+
+        state = self.get_state(source)
+
+        if 0 < state['pending']:
+            num_queued = self.drop_queued(source)
+
+            print(f"SCHEDULER({source.src_name}):  Cycle cancelled ({num_queued} batches dropped, {state['pending'] - num_queued} in flight).", flush=True)
+
+            self.finish_cycle(source, state)
+
+
+    def source_status(self, source):
+
+        state = self.get_state(source)
+
+        latency = 'n/a' if state['latency'] is None else '%.2f s' % (state['latency'])
+
+        return (f"cycle {state['cycle']}:  {state['queued']} queued, {state['in_flight']} in flight, {state['slots']} slots, "
+                f"query time {latency}")
+
+
+    #  Whether a source may issue a query now.  Paused sources, and sources held while Process 2 is behind on
+    #  the spool, are not.
+    def ready(self, source, state):
+
+        return (not source.pause) and (not source.spool_held) and (state['in_flight'] < state['slots'])
+
+
+    #  Put a source with work items back in the heap once it is ready
+    def wake(self, source, state):
+
+        if state['in_heap'] or (0 == len(state['work'])) or not self.ready(source, state):
+            return
+
+        heapq.heappush(self.heaps[state['engine']], (state['work'][0][0], next(self.seq), source))
+
+        state['in_heap'] = True
+
+
+    #  Called when a source may have become ready (resumed, released from a hold, slot freed)
+    def release(self, source):
+
+        self.wake(source, self.get_state(source))
+
+        self.dispatch()
+
+
+    #  Issue work items in order of deadline while there are free slots.  A source popped which is no longer
+    #  ready leaves the heap until release().
+    def dispatch(self):
+
+        for (engine, heap) in self.heaps.items():
+            while (0 < len(heap)) and (self.in_flight[engine] < self.max_in_flight[engine]):
+                (deadline, seq, source) = heapq.heappop(heap)
+
+                state = self.get_state(source)
+
+                state['in_heap'] = False
+
+                if (0 == len(state['work'])) or not self.ready(source, state):
+                    continue
+
+                (deadline, cycle, batch_list) = state['work'].popleft()
+
+                self.launch(source, state, engine, cycle, batch_list)
+
+                self.wake(source, state)
+
+
+    def launch(self, source, state, engine, cycle, batch_list):
+
+        self.in_flight[engine] += 1
+        state['in_flight']     += 1
+        state['queued']        -= 1
+
+        d_query = defer.maybeDeferred(source.launch_query, batch_list)
+
+        d_query.addBoth(self.query_done, source, state, engine, cycle, time.monotonic())
+
+
+    def query_done(self, result, source, state, engine, cycle, start):
+
+        success = not isinstance(result, Failure)
+
+
+        #  Track the time queries take (exponentially weighted average)
+        if state['latency'] is None:
+            state['latency'] = time.monotonic() - start
+        else:
+            state['latency'] = 0.8 * state['latency'] + 0.2 * (time.monotonic() - start)
+
+
+        #  Record result if the query belongs to the current cycle
+        if (cycle == state['cycle']) and (0 < state['pending']):
+            state['results'].append((success, result))
+
+            state['pending'] -= 1
+
+            if 0 == state['pending']:
+                elapsed = time.monotonic() - state['cycle_start']
+
+                if elapsed > state['horizon']:
+                    print(f"SCHEDULER({source.src_name}):  CYCLE OVERRUN.  {state['num_batches']} batches took {elapsed:.1f} seconds, "
+                          f"{state['horizon']:.1f} seconds available.", flush=True)
+
+                self.finish_cycle(source, state)
+
+            #  Correct the number of slots for the measured query time and the time left in the cycle
+            else:
+                self.resize_slots(source, state)
+
+
+        #  Free the global slot now, the source's slot after it has idled 'batch_sleep_time'
+        self.in_flight[engine] -= 1
+
+        if source.rate_per_sec is None:
+            reactor.callLater(source.batch_sleep_time, self.release_slot, source, state)
+        else:
+            self.release_slot(source, state)
+
+        #  More slots may have been given to the source
+        self.wake(source, state)
+
+        self.dispatch()
+
+
+    def release_slot(self, source, state):
+
+        state['in_flight'] -= 1
+
+        self.release(source)
+
+
+scheduler = None
+
+
+def get_scheduler():
+
+    global scheduler
+
+    if scheduler is None:
+        scheduler = Query_Scheduler(config.runtime_params['max_worker_threads'], config.runtime_params['max_reactor_queries'])
+
+    return scheduler
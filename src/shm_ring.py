@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""shm_ring.py:  Implements the shared memory ring through which Process 1
+   passes large query responses to Process 2 without sending them through
+   the queue.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import struct
+
+from multiprocessing import shared_memory
+
+
+#  The ring starts with a header of two positions, counted in bytes written since the ring was created:
+#
+#    write position (advanced by Process 1), read position (advanced by Process 2 when it is done with a record)
+#
+#  The byte at position p is at offset p % capacity of the data which follows the header.  A record is an
+#  envelope packed in place (see Envelope.pack_into()).  A record never wraps:  when it does not fit before
+#  the end of the data it starts at the beginning instead and the bytes skipped count as written.
+ring_header = struct.Struct('<QQ')
+
+ring_data_offset = 64
+
+#  What goes through the queue instead of the record:  magic, index of the ring, position of the record and its length.
+#  Each process of Process 1 which sends responses (see 'source_groups') writes to a ring of its own.
+handle = struct.Struct('<4sHQI')
+
+handle_magic = b'TLS1'
+
+
+def is_shm_handle(message):
+
+    return isinstance(message, (bytes, bytearray)) and (handle.size == len(message)) and (message[:len(handle_magic)] == handle_magic)
+
+
+#  Index of the ring a handle refers to
+def handle_ring(message):
+
+    return handle.unpack(message)[1]
+
+
+class Shm_Ring(object):
+
+    def __init__(self, shm, owner, index):
+
+        self.shm      = shm
+        self.owner    = owner
+        self.index    = index
+        self.buf      = shm.buf
+        self.capacity = shm.size - ring_data_offset
+
+        #  Envelopes put in the ring and those which did not fit (sent through the queue instead)
+        self.put_count      = 0
+        self.fallback_count = 0
+
+
+    #  Process 1:  create the ring before Process 2 is started
+    @classmethod
+    def create(cls, size, index=0):
+
+        shm = shared_memory.SharedMemory(create=True, size=ring_data_offset + size)
+
+        ring_header.pack_into(shm.buf, 0, 0, 0)
+
+        return cls(shm, True, index)
+
+
+    #  Process 2:  attach to the ring Process 1 created
+    @classmethod
+    def attach(cls, name, index=0):
+
+        return cls(shared_memory.SharedMemory(name=name), False, index)
+
+
+    def name(self):
+
+        return self.shm.name
+
+
+    #  Process 1, called with config.log_q_lock held:  pack 'envelope' into the ring and return the handle to send
+    #  through the queue, or None if the ring has no room for it
+    def put(self, envelope):
+
+        length = envelope.size()
+
+        (write_pos, read_pos) = ring_header.unpack_from(self.buf, 0)
+
+        start = write_pos
+
+        offset = start % self.capacity
+
+        if self.capacity < offset + length:
+            start += self.capacity - offset
+            offset = 0
+
+        if self.capacity < start + length - read_pos:
+            self.fallback_count += 1
+            return None
+
+        envelope.pack_into(self.buf, ring_data_offset + offset)
+
+        struct.pack_into('<Q', self.buf, 0, start + length)
+
+        self.put_count += 1
+
+        return handle.pack(handle_magic, self.index, start, length)
+
+
+    #  Process 2:  the record of a handle (a view of the ring, valid until release() is called) and its end
+    def get(self, message):
+
+        (magic, index, start, length) = handle.unpack(message)
+
+        offset = ring_data_offset + start % self.capacity
+
+        return self.buf[offset:offset + length], start + length
+
+
+    #  Process 2:  the position of the end of the record of a handle
+    def end(self, message):
+
+        (magic, index, start, length) = handle.unpack(message)
+
+        return start + length
+
+
+    #  Process 2:  done with the records up to position 'end', Process 1 may write over them
+    def release(self, end):
+
+        struct.pack_into('<Q', self.buf, 8, end)
+
+
+    def stats(self):
+
+        (write_pos, read_pos) = ring_header.unpack_from(self.buf, 0)
+
+        return {'capacity': self.capacity, 'in_use': write_pos - read_pos, 'put': self.put_count, 'fallback': self.fallback_count}
+
+
+    def close(self):
+
+        self.buf = None
+
+        self.shm.close()
+
+        if self.owner:
+            self.shm.unlink()
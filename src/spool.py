@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+"""spool.py:  Implements the durable, disk backed spool through which Process 1
+   passes query responses to Process 2 when 'ipc_transport' is "spool".
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import os
+
+import queue
+
+import struct
+
+import threading
+
+import time
+
+import zlib
+
+from multiprocessing import Event, Lock, RawValue
+
+from utils import read_json_state, write_json_state
+
+
+#  The spool is a sequence of segment files, each named after its offset, the number of bytes written to the
+#  spool before it.  A segment holds records, each a header followed by the message:
+#
+#    length of the message, CRC-32 of the message, kind of message
+#
+#  Process 1 appends to the last segment and starts a new one when it exceeds 'segment_bytes'.  The processes
+#  of Process 1 running groups of sources (see 'source_groups') append to the same segment, taking turns.  Process 2
+#  reads the records in order and acknowledges them once handled.  The offset up to which Process 2 has
+#  acknowledged is kept in '<consumer>.offset' so a restarted Process 2 resumes there:  a message is handled
+#  at least once.  Segments read completely are removed by Process 1.
+record_header = struct.Struct('<IIB')
+
+#  Kinds of message
+kind_bytes = 0   #  Envelope (envelope.py)
+kind_text  = 1   #  Message in text (as replayed by Source_Playback)
+
+#  Process 2 saves its offset after this many messages or seconds, and whenever it has nothing to read
+ack_every    = 64
+ack_interval = 1.0
+
+
+def segment_name(offset):
+
+    return '%020d.seg' % (offset)
+
+
+class Spool(object):
+
+    #  Created by Process 1 before Process 2 is started.  Process 1 calls put() (as it would on a queue),
+    #  Process 2 calls get() and task_done() once done with the message.
+    def __init__(self, dir_name, segment_bytes, consumer='pt2'):
+
+        self.dir_name      = dir_name
+        self.segment_bytes = segment_bytes
+        self.offset_file   = os.path.join(dir_name, consumer + '.offset')
+
+        os.makedirs(dir_name, exist_ok=True)
+
+        #  Shared by both processes:  the offset written up to, the offset acknowledged up to and the doorbell
+        #  Process 1 rings after writing
+        self.written  = RawValue('q', 0)
+        self.acked    = RawValue('q', read_json_state(self.offset_file, {}).get('offset', 0))
+        self.doorbell = Event()
+
+        #  Process 1, the lock and the segment being written up to are shared by the processes which write
+        self.lock     = Lock()
+        self.cur_seg  = RawValue('q', -1)
+        self.fp       = None
+        self.seg_base = None
+
+        #  Process 2
+        self.rfp        = None
+        self.rseg_base  = None
+        self.read_pos   = None
+        self.next_pos   = None
+        self.unsaved    = 0
+        self.saved_time = 0.0
+        self.ack_lock   = threading.Lock()
+
+        self.recover()
+
+
+    def segments(self):
+
+        return sorted(int(name[:-4]) for name in os.listdir(self.dir_name) if name.endswith('.seg') and name[:-4].isdigit())
+
+
+    def segment_path(self, offset):
+
+        return os.path.join(self.dir_name, segment_name(offset))
+
+
+    #  Find where the last run stopped writing, dropping a record it left incomplete
+    def recover(self):
+
+        segments = self.segments()
+
+        if 0 == len(segments):
+            self.written.value = self.acked.value
+            return
+
+        base = segments[-1]
+
+        end = 0
+
+        with open(self.segment_path(base), 'rb') as fp:
+            while True:
+                head = fp.read(record_header.size)
+
+                if record_header.size != len(head):
+                    break
+
+                (length, crc, kind) = record_header.unpack(head)
+
+                data = fp.read(length)
+
+                if (length != len(data)) or (crc != zlib.crc32(data)):
+                    break
+
+                end = fp.tell()
+
+        if end != os.path.getsize(self.segment_path(base)):
+            print(f"WARNING(Spool::recover()):  Dropping incomplete record at offset {base + end} of the spool")
+
+            os.truncate(self.segment_path(base), end)
+
+        self.written.value = base + end
+
+        #  Messages removed from the spool can not be read
+        if self.acked.value < segments[0]:
+            print(f"WARNING(Spool::recover()):  Spool starts at offset {segments[0]}, past the acknowledged offset {self.acked.value}")
+
+            self.acked.value = segments[0]
+
+        self.acked.value = min(self.acked.value, self.written.value)
+
+
+    #  Bytes written to the spool which Process 2 has not acknowledged
+    def lag(self):
+
+        return self.written.value - self.acked.value
+
+
+    #  Process 1:  append a message (an envelope or text)
+    def put(self, message):
+
+        if isinstance(message, str):
+            data, kind = message.encode('utf-8'), kind_text
+        else:
+            data, kind = bytes(message), kind_bytes
+
+        with self.lock:
+            if (self.fp is None) or (self.seg_base != self.cur_seg.value) or (self.segment_bytes <= self.written.value - self.seg_base):
+                self.roll()
+
+            self.fp.write(record_header.pack(len(data), zlib.crc32(data), kind))
+            self.fp.write(data)
+            self.fp.flush()
+
+            self.written.value += record_header.size + len(data)
+
+        self.doorbell.set()
+
+
+    #  Process 1, called with self.lock held:  continue the segment being written (the last one on the first call),
+    #  which another process may have started, or start a new one
+    def roll(self):
+
+        segments = self.segments()
+
+        if self.fp is not None:
+            if self.segment_bytes <= self.written.value - self.seg_base:
+                os.fsync(self.fp.fileno())
+
+            self.fp.close()
+            self.fp = None
+
+        if 0 <= self.cur_seg.value:
+            base = self.cur_seg.value
+        elif 0 < len(segments):
+            base = segments[-1]
+        else:
+            base = self.written.value
+
+        if self.segment_bytes <= self.written.value - base:
+            base = self.written.value
+
+        self.seg_base      = base
+        self.cur_seg.value = base
+
+        self.fp = open(self.segment_path(self.seg_base), 'ab')
+
+        self.remove_read_segments()
+
+
+    #  Remove the segments Process 2 read completely
+    def remove_read_segments(self):
+
+        segments = self.segments()
+
+        for (base, next_base) in zip(segments, segments[1:]):
+            if self.acked.value < next_base:
+                break
+
+            try:
+                os.remove(self.segment_path(base))
+            except OSError as e:
+                print(f"WARNING(Spool::remove_read_segments()):  Unable to remove spool segment {base}:  {str(e)}")
+
+
+    #  Process 2:  open the segment holding 'offset'
+    def open_reader(self, offset):
+
+        if self.rfp is not None:
+            self.rfp.close()
+            self.rfp = None
+
+        segments = [base for base in self.segments() if base <= offset]
+
+        if 0 == len(segments):
+            return False
+
+        self.rseg_base = segments[-1]
+        self.rfp       = open(self.segment_path(self.rseg_base), 'rb')
+
+        self.rfp.seek(offset - self.rseg_base)
+
+        self.read_pos = offset
+
+        return True
+
+
+    #  Process 2:  the next message, or None if Process 1 has not written it (completely) yet
+    def read_next(self):
+
+        if self.read_pos is None:
+            self.read_pos = self.acked.value
+            self.next_pos = self.read_pos
+
+        while True:
+            if (self.rfp is None) and (not self.open_reader(self.read_pos)):
+                return None
+
+            head = self.rfp.read(record_header.size)
+
+            #  End of the segment:  move on if Process 1 started the next one here
+            if 0 == len(head):
+                if (self.rseg_base != self.read_pos) and os.path.exists(self.segment_path(self.read_pos)):
+                    self.open_reader(self.read_pos)
+                    continue
+
+                return None
+
+            data = None
+
+            if record_header.size == len(head):
+                (length, crc, kind) = record_header.unpack(head)
+
+                data = self.rfp.read(length)
+
+            #  Process 1 is still writing the record
+            if (data is None) or (length != len(data)):
+                self.rfp.seek(self.read_pos - self.rseg_base)
+                return None
+
+            self.read_pos += record_header.size + length
+
+            self.next_pos = self.read_pos
+
+            if crc != zlib.crc32(data):
+                print(f"ERROR(Spool::read_next()):  Bad record at offset {self.read_pos - record_header.size - length} of the spool, skipping it")
+                continue
+
+            return data.decode('utf-8') if kind_text == kind else data
+
+
+    #  Process 2:  wait for and return the next message
+    def get(self):
+
+        while True:
+            message = self.read_next()
+
+            if message is not None:
+                return message
+
+            self.save_offset()
+
+            self.doorbell.wait(ack_interval)
+            self.doorbell.clear()
+
+
+    #  Process 2:  the next message, raising queue.Empty if there is none yet
+    def get_nowait(self):
+
+        message = self.read_next()
+
+        if message is None:
+            raise queue.Empty
+
+        return message
+
+
+    #  Process 2:  done with the message returned by the last get()
+    def task_done(self):
+
+        self.ack(self.next_pos)
+
+
+    #  Process 2:  done with the messages before 'offset' (the 'next_pos' after getting the last of them)
+    def ack(self, offset):
+
+        with self.ack_lock:
+            self.acked.value = offset
+
+            self.unsaved += 1
+
+            if (ack_every <= self.unsaved) or (ack_interval <= time.monotonic() - self.saved_time):
+                self.save_offset_locked()
+
+
+    def save_offset(self):
+
+        with self.ack_lock:
+            self.save_offset_locked()
+
+
+    def save_offset_locked(self):
+
+        if 0 == self.unsaved:
+            return
+
+        write_json_state(self.offset_file, {'offset': self.acked.value})
+
+        self.unsaved    = 0
+        self.saved_time = time.monotonic()
+
+
+    def close(self):
+
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
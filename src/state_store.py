@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""state_store.py:  Implements the class which keeps the time each symbol
+   was last successfully queried so the rotation through symbols survives
+   restarts.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+
+import time
+
+from utils import state_file_path, read_json_state, write_json_state
+
+
+#  The file is rewritten after this many updates or seconds, whichever comes first, and whenever flush() is called
+save_every    = 64
+save_interval = 1.0
+
+
+class Query_Time_Store(object):
+
+    #  Times are kept as {symbol: {query_type: POSIX timestamp}} in one small JSON file per source.  The
+    #  file is read once at startup and rewritten atomically every 'save_every' updates or 'save_interval'
+    #  seconds, so a crash loses at most the last few times (those symbols are queried again early).
+    #  Sources which do not distinguish query types record their times under the query type '*'.
+
+    def __init__(self, src_name):
+
+        self.file_name = state_file_path('query_times_' + src_name + '.json')
+
+        self.lock = threading.Lock()
+
+        self.times = read_json_state(self.file_name, {})
+
+        self.unsaved    = 0
+        self.saved_time = time.monotonic()
+
+
+    def get(self, symbol, query_type=None):
+
+        return self.times.get(symbol, {}).get(query_type or '*')
+
+
+    def update(self, symbol, query_type, timestamp):
+
+        with self.lock:
+            self.times.setdefault(symbol, {})[query_type or '*'] = timestamp
+
+            self.unsaved += 1
+
+            if (save_every <= self.unsaved) or (save_interval <= time.monotonic() - self.saved_time):
+                self.save_locked()
+
+
+    #  Write the times not written yet.  Blocks on the disk, so the reactor runs it on a worker thread.
+    def flush(self):
+
+        with self.lock:
+            self.save_locked()
+
+
+    def save_locked(self):
+
+        if 0 == self.unsaved:
+            return
+
+        try:
+            write_json_state(self.file_name, self.times)
+        except OSError as e:
+            print(f"WARNING(Query_Time_Store::save_locked()):  Unable to write '{self.file_name}':  {str(e)}")
+
+        self.unsaved    = 0
+        self.saved_time = time.monotonic()
@@ -24,7 +24,17 @@ import re
 
 
 # BEG tlaloc.py SPECIFIC
-from utils  import days_to_next_session
+from utils  import days_to_next_session, state_dir_path
+
+from control import start_control
+
+from envelope import Envelope, is_envelope
+from shm_ring import Shm_Ring, is_shm_handle, handle_ring
+from spool    import Spool
+from pt2_shards import Shard_Router, Ticker_Sink
+
+import rate_limiter
+import circuit_breaker
 
 from datetime import datetime
 from datetime import timedelta
@@ -42,6 +52,9 @@ import os
 import sys
 import time
 import signal
+import atexit
+import traceback
+import queue
 
 
 try:
@@ -59,6 +72,11 @@ try:
 except ImportError as error:
     print("IMPORT ERROR:  (twisted.internet) reactor")
 
+try:
+    from twisted.internet import task
+except ImportError as error:
+    print("IMPORT ERROR:  (twisted.internet) task")
+
 try:
     from twisted.internet import ssl
 except ImportError as error:
@@ -93,6 +111,11 @@ try:
 except ImportError as error:
     print("IMPORT ERROR:  (twisted.python.modules) getModule")
 
+try:
+    from twisted.python.threadpool import ThreadPool
+except ImportError as error:
+    print("IMPORT ERROR:  (twisted.python.threadpool) ThreadPool")
+
 
 from Source_AlphaVantage_DailySummary   import Source_AlphaVantage_DailySummary
 from Source_CNBC_IntradayQuote          import Source_CNBC_IntradayQuote
@@ -168,12 +191,12 @@ def log_rotate_pt1():
 
 
     if not config.runtime_params['skip_log_quotes']:
-        quotes_file = 'quotes_' + now.strftime('%Y-%m-%d_%H-%M-%S.%f')[:-3] + '.txt'
+        quotes_file = 'quotes_' + now.strftime('%Y-%m-%d_%H-%M-%S.%f')[:-3] + config.log_suffix + '.txt'
     else:
         quotes_file = '<<QUOTE LOGGING OFF>>'
 
     if not config.runtime_params['skip_log_ticker']:
-        ticker_file = 'ticker_' + now.strftime('%Y-%m-%d_%H-%M-%S.%f')[:-3] + '.txt'
+        ticker_file = 'ticker_' + now.strftime('%Y-%m-%d_%H-%M-%S.%f')[:-3] + config.log_suffix + '.txt'
     else:
         ticker_file = '<<TICKERLOGGING OFF>>'
 
@@ -311,10 +334,12 @@ def log_rotate_pt2():
 
 def reset_all_backoff():
 
-    # Loop over sources, backing each off
+    # Loop over sources, backing each off and rebuilding its connection pools
     for source in config.runtime_params['sources']:
         source.reset_backoff(source.backoff.keys())
 
+        source.reset_session()
+
 
     #  Schedule next backoff
     next_rotate = datetime.now().replace(hour=0, minute=0, second=9) + timedelta(days = 1)
@@ -327,8 +352,43 @@ def reset_all_backoff():
         next_rotate.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3], round (delta.total_seconds())))
 
 
+#  Hold the queries of a source while the backlog of the spool is at or above the source's 'spool_high_water'
+#  (and of all sources at or above 'spool_max_bytes') until Process 2 brings it below half that mark
+def check_spool_backlog():
+
+    lag = config.sp_queue.lag()
+
+    for source in config.runtime_params['sources']:
+        high_water = config.runtime_params['spool_max_bytes']
+
+        if 0 < source.spool_high_water:
+            high_water = min(high_water, source.spool_high_water)
+
+        if high_water <= lag:
+            source.set_spool_held(True, lag)
+
+        elif lag < high_water // 2:
+            source.set_spool_held(False, lag)
+
+
 def tlaloc_pt1_run():
 
+    #  Create the worker pool shared by all sources, capping the total number of query threads
+    config.worker_pool = ThreadPool(minthreads=0, maxthreads=config.runtime_params['max_worker_threads'], name='tlaloc_workers')
+    config.worker_pool.start()
+
+    reactor.addSystemEventTrigger('during', 'shutdown', config.worker_pool.stop)
+
+
+    #  Watch the pause file and listen for commands on the control socket
+    reactor.callWhenRunning(start_control)
+
+
+    #  Hold queries while Process 2 is behind on the spool
+    if isinstance(config.sp_queue, Spool):
+        task.LoopingCall(check_spool_backlog).start(1.0, now=False)
+
+
     # Loop over sources, kicking each off
     for source in config.runtime_params['sources']:
         reactor.callWhenRunning(source.run_recurring_query)
@@ -338,6 +398,103 @@ def tlaloc_pt1_run():
     print('Stop!')
 
 
+#  Runs a group of sources (see 'source_groups') in a process of its own, as Process 1 runs the others.  Forked
+#  from the group supervisor, so in the state Process 1 was in before it created its sources.
+def tlaloc_pt1_group(idx, names):
+
+    config.log_suffix = '_g%d' % (idx)
+
+    #  Entry numbers idx + 1, idx + 1 + qu_entry_step, ...  (Process 1 numbers from 0)
+    config.qu_entry_idx = idx + 1
+
+    if config.runtime_params['control_socket']:
+        (root, ext) = os.path.splitext(config.runtime_params['control_socket'])
+
+        config.runtime_params['control_socket'] = root + config.log_suffix + ext
+
+    #  Ring 0 is Process 1's
+    config.shm_ring = config.shm_rings[idx + 1] if (idx + 1 < len(config.shm_rings)) else None
+
+
+    print_hi('pt1 group %d:  %s' % (idx, ','.join(names)))
+
+
+    #  Create logs
+    log_rotate_pt1 ()
+
+
+    #  Create objects for the sources of the group
+    config.runtime_params['sources'] = get_sources({name: (name in names) for name in config.runtime_params['source_list']})
+
+
+    #  Reset backoff background job
+    reset_all_backoff()
+
+
+    #  Kickoff
+    tlaloc_pt1_run()
+
+
+    #  If log files are open, close them
+    with config.log_q_lock:
+        if config.log_quotes is not None:
+            config.log_quotes.close()
+
+    print("TLALOC PT1 GROUP %d DONE" % (idx))
+
+
+#  Runs in its own process, started by Process 1 before the reactor.  Starts a process for each group of sources
+#  and restarts it 'source_restart_delay' seconds after it dies.
+def tlaloc_group_supervisor(groups):
+
+    parent = os.getppid()
+
+    children = {}
+
+
+    #  Process 1 terminates the supervisor when it stops
+    def stop(signum, frame):
+        for child in children.values():
+            child.terminate()
+
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+
+    restart_time = [0.0 for group in groups]
+
+    while True:
+        for (idx, names) in enumerate(groups):
+            child = children.get(idx)
+
+            if child is not None:
+                if child.is_alive():
+                    continue
+
+                print(f"ERROR(tlaloc_group_supervisor()):  Group {idx} ({','.join(names)}, pid {child.pid}) exited with code {child.exitcode}.  "
+                      f"Restarting it in {config.runtime_params['source_restart_delay']} seconds.", flush=True)
+
+                del children[idx]
+
+                restart_time[idx] = time.monotonic() + config.runtime_params['source_restart_delay']
+
+            if restart_time[idx] <= time.monotonic():
+                child = Process(target=tlaloc_pt1_group, args=(idx, names))
+                child.daemon = True
+                child.start()
+
+                children[idx] = child
+
+                print(f"SUPERVISOR:  Started group {idx} ({','.join(names)}, pid {child.pid})", flush=True)
+
+        #  Process 1 is gone
+        if os.getppid() != parent:
+            stop(None, None)
+
+        time.sleep(1.0)
+
+
 def print_runtime_params ():
 
     print(f"")
@@ -345,6 +502,7 @@ def print_runtime_params ():
     print(f"Runtime Parameters")
     print(f"               cur_dir = {config.runtime_params['cur_dir']}")
     print(f"               log_dir = {config.runtime_params['log_dir']}")
+    print(f"             state_dir = {config.runtime_params['state_dir']}")
     print(f"           config_file = {config.runtime_params['config_file']}")
     print(f"            creds_file = {config.runtime_params['creds_file']}")
     print(f"            skip_query = {config.runtime_params['skip_query']}")
@@ -359,6 +517,21 @@ def print_runtime_params ():
     print(f"       skip_log_ticker = {config.runtime_params['skip_log_ticker']}")
     print(f"               proxies = {config.runtime_params['proxies']}")
     print(f"               ca_cert = {config.runtime_params['ca_cert']}")
+    print(f"    max_worker_threads = {config.runtime_params['max_worker_threads']}")
+    print(f"   max_reactor_queries = {config.runtime_params['max_reactor_queries']}")
+    print(f"        control_socket = {config.runtime_params['control_socket']}")
+    print(f"     ipc_shm_threshold = {config.runtime_params['ipc_shm_threshold']}")
+    print(f"          ipc_shm_size = {config.runtime_params['ipc_shm_size']}")
+    print(f"         ipc_transport = {config.runtime_params['ipc_transport']}")
+    print(f"   spool_segment_bytes = {config.runtime_params['spool_segment_bytes']}")
+    print(f"       spool_max_bytes = {config.runtime_params['spool_max_bytes']}")
+    print(f"     pt2_restart_delay = {config.runtime_params['pt2_restart_delay']}")
+    print(f"     pt2_stall_timeout = {config.runtime_params['pt2_stall_timeout']}")
+    print(f"           pt2_workers = {config.runtime_params['pt2_workers']}")
+    print(f"             pt2_batch = {config.runtime_params['pt2_batch']}")
+    print(f"          pt2_pin_cpus = {config.runtime_params['pt2_pin_cpus']}")
+    print(f"         source_groups = {config.runtime_params['source_groups']}")
+    print(f"  source_restart_delay = {config.runtime_params['source_restart_delay']}")
 # FUTURE:   print(f"               use_SSL = {config.runtime_params['use_SSL']}")
 # FUTURE:   print(f"      server_cred_file = <<REDACTED>>")
 # FUTURE:   print(f"      client_cred_file = <<REDACTED>>")
@@ -535,6 +708,7 @@ def init_argparse() -> argparse.ArgumentParser:
 
     parser.add_argument('--cur_dir',         dest='cur_dir',         metavar='<file name>',  type=str)
     parser.add_argument('--log_dir',         dest='log_dir',         metavar='<file name>',  type=str)
+    parser.add_argument('--state_dir',       dest='state_dir',       metavar='<file name>',  type=str)
     parser.add_argument('--config_file',     dest='config_file',     metavar='<file name>',  type=str)
     parser.add_argument('--cred_file',       dest='cred_file',       metavar='<file name>',  type=str)
     parser.add_argument('--skip_query',      dest='skip_query',      metavar='<True|False>', type=lambda x:bool(loc_strtobool(x)))
@@ -549,6 +723,13 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument('--skip_log_ticker', dest='skip_log_ticker', metavar='<True|False>', type=lambda x:bool(loc_strtobool(x)))
     parser.add_argument('--proxies',         dest='proxies',         metavar='<proxy url>',  type=str)
     parser.add_argument('--ca_cert',         dest='ca_cert',         metavar='<file name>',  type=str)
+    parser.add_argument('--max_worker_threads', dest='max_worker_threads', metavar='<number>', type=int)
+    parser.add_argument('--max_reactor_queries', dest='max_reactor_queries', metavar='<number>', type=int)
+    parser.add_argument('--control_socket',  dest='control_socket',  metavar='<file name>',  type=str)
+    parser.add_argument('--ipc_shm_threshold', dest='ipc_shm_threshold', metavar='<bytes>', type=int)
+    parser.add_argument('--ipc_shm_size',    dest='ipc_shm_size',    metavar='<bytes>',      type=int)
+    parser.add_argument('--ipc_transport',   dest='ipc_transport',   metavar='<queue|spool>', type=str)
+    parser.add_argument('--source_groups',   dest='source_groups',   metavar='<source_1,...;source_N,...>', type=str)
 
     parser.add_argument('--debug',   dest='debug',   metavar='<debug_1,...,debug_N>',   type=str)
     parser.add_argument('--sources', dest='sources', metavar='<source_1,...,source_N>', type=str)
@@ -598,6 +779,9 @@ def tlaloc_pt1():
     if ('log_dir' in args) and (args.log_dir is not None):
         config.runtime_params['log_dir'] = Path(args.log_dir)
 
+    if ('state_dir' in args) and (args.state_dir is not None):
+        config.runtime_params['state_dir'] = Path(args.state_dir)
+
     if ('skip_query' in args) and (args.skip_query is not None):
         config.runtime_params['skip_query'] = args.skip_query
 
@@ -634,6 +818,31 @@ def tlaloc_pt1():
     if ('ca_cert' in args) and (args.ca_cert is not None):
         config.runtime_params['ca_cert'] = args.ca_cert
 
+    if ('max_worker_threads' in args) and (args.max_worker_threads is not None):
+        config.runtime_params['max_worker_threads'] = args.max_worker_threads
+
+    if ('max_reactor_queries' in args) and (args.max_reactor_queries is not None):
+        config.runtime_params['max_reactor_queries'] = args.max_reactor_queries
+
+    if ('control_socket' in args) and (args.control_socket is not None):
+        config.runtime_params['control_socket'] = args.control_socket
+
+    if ('ipc_shm_threshold' in args) and (args.ipc_shm_threshold is not None):
+        config.runtime_params['ipc_shm_threshold'] = args.ipc_shm_threshold
+
+    if ('ipc_shm_size' in args) and (args.ipc_shm_size is not None):
+        config.runtime_params['ipc_shm_size'] = args.ipc_shm_size
+
+    if ('ipc_transport' in args) and (args.ipc_transport is not None):
+        config.runtime_params['ipc_transport'] = args.ipc_transport
+
+    if ('source_groups' in args) and (args.source_groups is not None):
+        config.runtime_params['source_groups'] = [group.split(",") for group in args.source_groups.split(";") if group]
+
+    if config.runtime_params['ipc_transport'] not in ['queue', 'spool']:
+        print(f"ERROR(tlaloc_pt1()):  unknown ipc_transport ('{config.runtime_params['ipc_transport']}'), using 'queue'")
+        config.runtime_params['ipc_transport'] = 'queue'
+
 
     #  Handle debug arguments
     if ('debug' in args) and (args.debug is not None):
@@ -694,24 +903,63 @@ def tlaloc_pt1():
     print_hi('pt1')
 
 
+    #  Sources to run in groups of their own (none in playback)
+    groups = get_source_groups() if not config.runtime_params['playback'] else []
+
+
     #  Spin off quote aggregator task
 
     # tlaloc_pt2() reads from queue as a different process...
     if not config.runtime_params['skip_query']:
-        tlaloc_pt2_proc = Process(target=tlaloc_pt2, args=(config.sp_queue, config.runtime_params))
-        tlaloc_pt2_proc.daemon = True
-        tlaloc_pt2_proc.start()
+
+        #  Responses go through the durable spool, or through the queue with large responses in a shared memory ring
+        #  (one for this process and one for each group of sources)
+        if 'spool' == config.runtime_params['ipc_transport']:
+            config.sp_queue = Spool(state_dir_path('spool'), config.runtime_params['spool_segment_bytes'])
+
+        elif (0 < config.runtime_params['ipc_shm_threshold']) and (0 < config.runtime_params['ipc_shm_size']):
+            try:
+                for idx in range(1 + len(groups)):
+                    config.shm_rings.append(Shm_Ring.create(config.runtime_params['ipc_shm_size'], idx))
+
+                config.shm_ring = config.shm_rings[0]
+            except OSError as e:
+                print(f"WARNING:  Cannot create shared memory ring ({e}), sending all responses through the queue")
+
+                close_shm_rings()
+
+        shm_names = [ring.name() for ring in config.shm_rings]
+
+        #  Process 2 is started by a supervisor which restarts it when it dies
+        config.pt2_super = Process(target=tlaloc_pt2_supervisor, args=(config.sp_queue, config.runtime_params, shm_names))
+        config.pt2_super.start()
     else:
         print('ALERT:  Skipping invocation of Process 2 because "skip_query" option given on command line')
 
 
+    #  Groups of sources run in processes of their own, under a supervisor which restarts them when they die.  The
+    #  processes share the rate limits and circuit breakers of each host and interleave their entry numbers.
+    if 0 < len(groups):
+        rate_limiter.share_host_buckets()
+        circuit_breaker.share_breakers()
+
+        config.qu_entry_step = 1 + len(groups)
+
+        config.group_super = Process(target=tlaloc_group_supervisor, args=(groups,))
+        config.group_super.start()
+
+    atexit.register(stop_supervisors)
+
+
     #  Create logs
     log_rotate_pt1 ()
 
 
     #  Create objects for the requested sources
     if not config.runtime_params['playback']:
-        config.runtime_params['sources'] = get_sources(config.runtime_params['source_list'])
+        grouped = [name for group in groups for name in group]
+
+        config.runtime_params['sources'] = get_sources({name: enabled and (name not in grouped) for (name, enabled) in config.runtime_params['source_list'].items()})
     else:
         config.runtime_params['sources'] = [Source_Playback()]
 
@@ -733,6 +981,10 @@ def tlaloc_pt1():
         if config.log_ticker is not None:
             config.log_ticker.close()
 
+    stop_supervisors()
+
+    close_shm_rings()
+
     print("TLALOC PT1 DONE")
 
 
@@ -925,7 +1177,7 @@ def tlaloc_pt2_run():
 
 
     #  Start up thread that interacts with Pt1
-    thrd = threading.Thread(target=tlaloc_pt2_rcv_loop)
+    thrd = threading.Thread(target=tlaloc_pt2_rcv_loop if config.pt2_router is None else tlaloc_pt2_route_loop)
     thrd.start()
 
 
@@ -981,6 +1233,106 @@ def tlaloc_pt2_run():
     reactor.run()
 
 
+#  Runs in its own process, started by Process 1 before the reactor, so Process 2 is (re)started from a process
+#  in the state Process 1 was in then.  Restarts Process 2 when it dies or, with the spool, when it stops
+#  acknowledging messages for 'pt2_stall_timeout' seconds.
+def tlaloc_pt2_supervisor(arg_sp_queue, arg_runtime_params, arg_shm_names):
+
+    parent = os.getppid()
+
+    children = []
+
+
+    #  Process 1 terminates the supervisor when it stops
+    def stop(signum, frame):
+        for child in children:
+            child.terminate()
+
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+
+    spool = arg_sp_queue if isinstance(arg_sp_queue, Spool) else None
+
+    stall_timeout = arg_runtime_params['pt2_stall_timeout']
+
+
+    while True:
+        #  Not a daemon, so Process 2 may start workers of its own
+        child = Process(target=tlaloc_pt2, args=(arg_sp_queue, arg_runtime_params, arg_shm_names))
+        child.start()
+
+        children[:] = [child]
+
+        print(f"SUPERVISOR:  Started Process 2 (pid {child.pid})", flush=True)
+
+
+        acked      = None
+        acked_time = time.monotonic()
+
+        while child.is_alive():
+            child.join(1.0)
+
+            #  Process 1 is gone
+            if os.getppid() != parent:
+                stop(None, None)
+
+            if (spool is None) or (0 >= stall_timeout):
+                continue
+
+            if (acked != spool.acked.value) or (0 == spool.lag()):
+                acked      = spool.acked.value
+                acked_time = time.monotonic()
+
+            elif stall_timeout <= time.monotonic() - acked_time:
+                print(f"ERROR(tlaloc_pt2_supervisor()):  Process 2 acknowledged nothing for {stall_timeout} seconds ({spool.lag()} bytes behind).  Terminating it.", flush=True)
+
+                child.terminate()
+                child.join()
+
+
+        print(f"ERROR(tlaloc_pt2_supervisor()):  Process 2 (pid {child.pid}) exited with code {child.exitcode}.  "
+              f"Restarting it in {arg_runtime_params['pt2_restart_delay']} seconds.", flush=True)
+
+        time.sleep(arg_runtime_params['pt2_restart_delay'])
+
+
+def stop_supervisors():
+
+    for supervisor in [config.group_super, config.pt2_super]:
+        if (supervisor is not None) and supervisor.is_alive():
+            supervisor.terminate()
+            supervisor.join(5.0)
+
+
+def close_shm_rings():
+
+    for ring in config.shm_rings:
+        ring.close()
+
+    config.shm_rings = []
+    config.shm_ring  = None
+
+
+#  Hand the response in an envelope to the source which sent it
+def dispatch_envelope(envelope, sources_by_id):
+
+    text = envelope.payload_text()
+
+    with config.log_q_lock:
+        if config.log_quotes is not None:
+            config.log_quotes.write(envelope.render(text))
+
+    source = sources_by_id.get(envelope.src_id)
+
+    if source is None:
+        print(f"ERROR(dispatch_envelope()):  No source with id {envelope.src_id} for entry {envelope.entry_idx} ({envelope.url})")
+        return
+
+    source.process_query(envelope.batch_str(), text, envelope.url, envelope.log_timestamp(), envelope.query_type, envelope.version)
+
+
 def tlaloc_pt2_rcv_loop():
 
     #  ENTRY[000000]:  TYPE=QUOTE  TIME=2022-09-11 19:45:56.179889 MDT  QUERY_TYPE=YD_MISC0  VERSION=2022-09-10a
@@ -991,27 +1343,197 @@ def tlaloc_pt2_rcv_loop():
     time.sleep (1.0)
 
 
-    #  Loop forever, reading from the queue shared with Pt1
+    #  Sources by the id they put in their envelopes
+    sources_by_id = {source.src_id: source for source in config.runtime_params['sources']}
+
+
+    #  Loop forever, reading from the queue (or spool) shared with Pt1
     while True:
-        quote_str = config.sp_queue.get()         #  Read from the queue and do nothing
+        quote_str = config.sp_queue.get()
+
+        try:
+            handle_pt2_message(quote_str, sources_by_id, ts_regex)
+        except Exception as e:
+            print(f"ERROR(tlaloc_pt2_rcv_loop()):  {type(e).__name__} handling a message:  {str(e)}", flush=True)
+            traceback.print_exc()
+
+        #  With the spool this acknowledges the message, so a restarted Process 2 does not handle it again
         config.sp_queue.task_done()
-        
-        with config.log_q_lock:
-            if config.log_quotes is not None:
-                config.log_quotes.write(quote_str)
 
-        source, quote = parse_pipe_msg(quote_str, ts_regex, config.runtime_params['sources'])
 
-        if source is not None:
-            source.process_query(quote['stocks'], quote['response'], quote['url'], quote['timestamp'], quote['query_type'], quote['version'])
+#  'release_ring' is False in the workers of a sharded Process 2, where the router releases the ring in order
+def handle_pt2_message(quote_str, sources_by_id, ts_regex, release_ring=True):
+
+    #  Large responses are read in place from the shared memory ring
+    if is_shm_handle(quote_str):
+        ring = config.shm_rings[handle_ring(quote_str)]
+
+        record, end = ring.get(quote_str)
+
+        try:
+            dispatch_envelope(Envelope.from_bytes(record), sources_by_id)
+        finally:
+            record.release()
+
+            if release_ring:
+                ring.release(end)
+        return
+
+    if is_envelope(quote_str):
+        dispatch_envelope(Envelope.from_bytes(quote_str), sources_by_id)
+        return
+
+    #  Messages in text (as written to the quotes log) come from playback
+    with config.log_q_lock:
+        if config.log_quotes is not None:
+            config.log_quotes.write(quote_str)
+
+    source, quote = parse_pipe_msg(quote_str, ts_regex, config.runtime_params['sources'])
+
+    if source is not None:
+        source.process_query(quote['stocks'], quote['response'], quote['url'], quote['timestamp'], quote['query_type'], quote['version'])
+
+
+#  Sharded Process 2:  read the queue (or spool) in batches and route each message to the worker handling its symbols
+def tlaloc_pt2_route_loop():
+
+    try:
+        while True:
+            message = config.sp_queue.get()
+
+            batch = [(message, pt2_release(message))]
+
+            while len(batch) < config.runtime_params['pt2_batch']:
+                try:
+                    message = config.sp_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                batch.append((message, pt2_release(message)))
+
+            for (message, release) in batch:
+                config.pt2_router.route(message, pt2_message_symbols(message), release)
+
+            config.pt2_router.flush()
+
+    except Exception as e:
+        #  The supervisor restarts Process 2 and its workers
+        print(f"ERROR(tlaloc_pt2_route_loop()):  {type(e).__name__}:  {str(e)}.  Exiting Process 2.", flush=True)
+
+        for (proc, inbox) in config.pt2_router.workers:
+            proc.terminate()
+
+        os._exit(1)
+
+
+#  Symbols of a message, which decide the worker it is routed to.  Messages in text (playback) have none.
+def pt2_message_symbols(message):
+
+    if is_shm_handle(message):
+        record, end = config.shm_rings[handle_ring(message)].get(message)
+
+        try:
+            return Envelope.from_bytes(record).symbols
+        finally:
+            record.release()
+
+    if is_envelope(message):
+        return Envelope.from_bytes(message).symbols
+
+    return []
+
+
+#  What to do, in order, once the message just read from the queue (or spool) is done
+def pt2_release(message):
+
+    if isinstance(config.sp_queue, Spool):
+        offset = config.sp_queue.next_pos
+
+        return lambda: config.sp_queue.ack(offset)
+
+    if is_shm_handle(message):
+        ring = config.shm_rings[handle_ring(message)]
+
+        end = ring.end(message)
+
+        return lambda: (ring.release(end), config.sp_queue.task_done())
+
+    return config.sp_queue.task_done
+
+
+#  Runs first in each worker of a sharded Process 2 (forked from Process 2 once its sources exist)
+def tlaloc_pt2_worker_init(idx, outbox):
+
+    #  Each worker writes a quotes log of its own, ticker messages go to the merger
+    config.log_quotes = None
+    config.log_ticker = Ticker_Sink(outbox)
+
+    pt2_worker['idx']           = idx
+    pt2_worker['sources_by_id'] = {source.src_id: source for source in config.runtime_params['sources']}
+    pt2_worker['next_rotate']   = log_rotate_pt2_worker()
+
+
+#  Quotes log of a worker of a sharded Process 2, returning when to rotate it next
+def log_rotate_pt2_worker():
+
+    with config.log_q_lock:
+        if config.log_quotes is not None:
+            config.log_quotes.close()
+
+        config.log_quotes = None
+
+        now = datetime.now()
+
+        if not config.runtime_params['skip_log_quotes']:
+            log_dir = os.path.join(str(config.runtime_params['log_dir']), 'tl_pt2')
+
+            os.makedirs(log_dir, exist_ok=True)
+
+            quotes_file = 'quotes_' + now.strftime('%Y-%m-%d_%H-%M-%S.%f')[:-3] + '_w%d.txt' % (pt2_worker['idx'])
+
+            config.log_quotes = open(os.path.join(log_dir, quotes_file), 'a')
+
+    return now.replace(hour=0, minute=0, second=9) + timedelta(days = 1)
 
 
-def tlaloc_pt2(arg_sp_queue, arg_runtime_params):
+def tlaloc_pt2_worker_handler(message):
+
+    if pt2_worker['next_rotate'] <= datetime.now():
+        pt2_worker['next_rotate'] = log_rotate_pt2_worker()
+
+    handle_pt2_message(message, pt2_worker['sources_by_id'], pt2_ts_regex, release_ring=False)
+
+
+#  Merger of a sharded Process 2:  write the ticker messages of the workers to the ticker log and forward them to the clients
+def tlaloc_pt2_merge_ticker(message):
+
+    with config.log_t_lock:
+        if config.log_ticker is not None:
+            config.log_ticker.write(message)
+            config.log_ticker.flush()
+
+    match = pt2_ticker_regex.search(message)
+
+    if match is not None:
+        quoteToTwistedEvent_step1(match.group(1), message)
+
+
+#  State of a worker of a sharded Process 2
+pt2_worker = {}
+
+pt2_ts_regex     = re.compile(r'ENTRY.*\s+TIME=(.*\S)\s+QUERY_TYPE=(\S+)\s+VERSION=(\S+).*$')
+pt2_ticker_regex = re.compile(r'ENTRY\[\d+\]:\s+ID=([^:]*):')
+
+
+def tlaloc_pt2(arg_sp_queue, arg_runtime_params, arg_shm_names=[]):
 
     config.runtime_params = arg_runtime_params
 
     config.sp_queue = arg_sp_queue
 
+    config.shm_ring  = None
+    config.shm_rings = [Shm_Ring.attach(name, idx) for (idx, name) in enumerate(arg_shm_names)]
+
 
     #  Open log files
 
@@ -1033,6 +1555,14 @@ def tlaloc_pt2(arg_sp_queue, arg_runtime_params):
     stock_data = make_null_stock_entries(config.runtime_params['symbols'], config.runtime_params['sources'])
 
 
+    #  Spread the messages over worker processes (forked now, before Process 2 starts any thread)
+    if 1 < config.runtime_params['pt2_workers']:
+        config.pt2_router = Shard_Router(config.runtime_params['pt2_workers'], tlaloc_pt2_worker_init, tlaloc_pt2_worker_handler,
+                                         pin_cpus=config.runtime_params['pt2_pin_cpus'],
+                                         max_pending=4 * config.runtime_params['pt2_batch'] * config.runtime_params['pt2_workers'],
+                                         on_ticker=tlaloc_pt2_merge_ticker)
+
+
     tlaloc_pt2_run()
 
 
@@ -1048,6 +1578,36 @@ def tlaloc_pt2(arg_sp_queue, arg_runtime_params):
     print("TLALOC PT2 DONE")
 
 
+#  The groups of 'source_groups' to run, each the enabled sources named in it.  A source is in one group at most.
+def get_source_groups():
+
+    groups  = []
+    grouped = set()
+
+    for group in config.runtime_params['source_groups']:
+        names = []
+
+        for name in group:
+            if name not in config.runtime_params['source_list']:
+                print(f"WARNING(get_source_groups()):  Skipping unknown source '{name}' in source_groups")
+
+            elif not config.runtime_params['source_list'][name]:
+                print(f"WARNING(get_source_groups()):  Skipping source '{name}' in source_groups because it is not enabled")
+
+            elif name in grouped:
+                print(f"WARNING(get_source_groups()):  Skipping source '{name}' in source_groups because it is in an earlier group")
+
+            else:
+                names.append(name)
+
+                grouped.add(name)
+
+        if 0 < len(names):
+            groups.append(names)
+
+    return groups
+
+
 def get_sources(source_list):
     sources = []
 
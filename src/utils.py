@@ -14,6 +14,12 @@ import config
 from datetime import timedelta
 from datetime import date
 
+import json
+import os
+import zlib
+
+from multiprocessing import Lock, RawArray
+
 
 def mkt_open_on_date(day):
 
@@ -53,3 +59,98 @@ def days_to_next_session (time_zone):
 
 
     return days_to_mkt
+
+
+#  Return the directory where state is kept across restarts (or a subdirectory of it), creating it if needed
+def state_dir_path(*sub_dirs):
+
+    state_dir = str(config.runtime_params['state_dir'])
+
+    if 0 == len(state_dir):
+        state_dir = os.path.join(str(config.runtime_params['cur_dir']), 'state')
+
+    state_dir = os.path.join(state_dir, *sub_dirs)
+
+    os.makedirs(state_dir, exist_ok=True)
+
+    return state_dir
+
+
+#  Return the name of a file in the directory where state is kept across restarts, creating the directory if needed
+def state_file_path(file_name):
+
+    return os.path.join(state_dir_path(), file_name)
+
+
+#  Read a JSON state file, returning 'default' if it is missing or unreadable
+def read_json_state(file_name, default):
+
+    try:
+        with open(file_name, 'r') as fp:
+            return json.load(fp)
+
+    except FileNotFoundError:
+        return default
+
+    except (OSError, ValueError) as e:
+        print(f"WARNING(read_json_state()):  Unable to read state file '{file_name}':  {str(e)}")
+
+        return default
+
+
+#  Write a JSON state file atomically so a crash never leaves a partially written file behind
+def write_json_state(file_name, obj):
+
+    tmp_name = file_name + '.tmp'
+
+    with open(tmp_name, 'w') as fp:
+        json.dump(obj, fp, separators=(',', ':'))
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    os.replace(tmp_name, file_name)
+
+
+#  Table of 'num_slots' records of 'num_fields' numbers in shared memory, each record claimed by a key (e.g. a
+#  host).  Created before forking so the processes of Process 1 running groups of sources share the records.
+class Shared_Slots(object):
+
+    def __init__(self, num_slots, num_fields):
+
+        self.num_fields = num_fields
+
+        self.keys   = RawArray('Q', num_slots)    #  CRC-32 of the key plus one, 0 for a free slot
+        self.fields = RawArray('d', num_slots * num_fields)
+        self.lock   = Lock()
+
+
+    #  Index of the record of 'key', claiming a free one (set by 'init(index)') if the key has none.  None if the table is full.
+    def slot(self, key, init):
+
+        code = zlib.crc32(key.encode('utf-8')) + 1
+
+        with self.lock:
+            for (index, slot_code) in enumerate(self.keys):
+                if code == slot_code:
+                    return index
+
+                if 0 == slot_code:
+                    self.keys[index] = code
+
+                    init(index)
+
+                    return index
+
+        return None
+
+
+    #  Called with self.lock held
+    def get(self, index, field):
+
+        return self.fields[index * self.num_fields + field]
+
+
+    #  Called with self.lock held
+    def set(self, index, field, value):
+
+        self.fields[index * self.num_fields + field] = value
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+"""yahoo_session.py:  Implements the class which manages the cookies and
+   crumb the Yahoo sources need to make queries.
+
+Copyright 2024 Tlaloc Labs LLC
+
+Distributed under the terms of the GNU Affero General Public License.
+See the file LICENSE.txt in this distribution or <https://www.gnu.org/licenses/>.
+"""
+
+import config
+
+import json
+
+import re
+
+import threading
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import Token_Bucket
+
+from utils import state_dir_path, state_file_path, read_json_state, write_json_state
+
+from curl_cffi import Session
+
+
+# BEG yahoo_session.py SPECIFIC
+from yahooquery import Ticker
+from yahooquery.cache import ResponseCache
+from yahooquery.utils import setup_session, get_crumb
+# END yahoo_session.py SPECIFIC
+
+
+#  Exception messages and responses indicating the cookies or crumb are no longer accepted
+auth_error_re  = re.compile(r'Invalid Crumb|Invalid Cookie|Unauthorized|\b401\b')
+auth_error_rsp = re.compile('"(Invalid Crumb|Invalid Cookie|Unauthorized)"')
+
+
+#  The cache of Yahoo responses, shared by the sessions of all sources.  Created by the first configure_cache().
+response_cache = None
+
+
+#  Compact JSON of the result of a Ticker method, as a dict or a ColumnarResult (checked for by its to_json() so
+#  NumPy is only imported when columnar results are used)
+def response_json(response):
+
+    if hasattr(response, 'to_json'):
+        return response.to_json(separators=(',', ':'))
+
+    return json.dumps(response, separators=(',', ':'))
+
+
+class Yahoo_Session(object):
+
+    #  Obtaining a crumb costs a consent page round trip plus a crumb request.  This class obtains the
+    #  cookies and crumb once per source, saves them to disk so a restart can reuse them, and refreshes
+    #  them only when Yahoo rejects them.  Each worker thread gets its own impersonated session (curl
+    #  handles must not be shared between threads) loaded with the shared cookies.
+
+    def __init__(self, src_name):
+
+        self.src_name = src_name
+
+        self.state_file = state_file_path('yahoo_session_' + src_name + '.json')
+
+        self.lock = threading.Lock()
+
+        self.local = threading.local()
+
+        #  Bumped every time the cookies and crumb are replaced so stale per-thread sessions are rebuilt
+        self.generation = 0
+
+        self.cookies = []
+        self.crumb   = None
+
+        #  Set by configure_concurrency()
+        self.executor       = None
+        self.request_bucket = None
+
+        #  Whether the Ticker objects return ColumnarResult objects rather than dicts
+        self.columnar = False
+
+        #  Set by configure_cache()
+        self.cache = None
+
+        self.load()
+
+
+    #  Make the requests of each query concurrently on a pool of 'max_workers' threads, starting no more than
+    #  'rate_per_sec' requests per second (bursts of up to 'burst').  Each pool thread gets its own session.
+    def configure_concurrency(self, max_workers, rate_per_sec, burst):
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='yahoo_' + self.src_name)
+
+        if rate_per_sec:
+            self.request_bucket = Token_Bucket(rate_per_sec, burst)
+
+
+    #  Answer requests from the shared response cache, which keeps up to 'max_entries' responses in memory
+    #  and, with 'disk', all of them in the state directory until they expire
+    def configure_cache(self, max_entries, disk):
+
+        global response_cache
+
+        if response_cache is None:
+            response_cache = ResponseCache(max_entries, state_dir_path('yahoo_cache') if disk else None)
+
+        self.cache = response_cache
+
+
+    #  Called by the pool threads before each request.  Waits out the rate limit in the pool thread, not a worker thread of the source.
+    def request_gate(self):
+
+        if self.request_bucket is not None:
+            delay = self.request_bucket.reserve()
+
+            if 0.0 < delay:
+                time.sleep(delay)
+
+
+    def thread_session(self):
+
+        return self.get_session()[0]
+
+
+    def load(self):
+
+        state = read_json_state(self.state_file, {})
+
+        if state.get('crumb'):
+            self.cookies = state.get('cookies', [])
+            self.crumb   = state['crumb']
+
+            print(f"YAHOO SESSION({self.src_name}):  Loaded crumb and {len(self.cookies)} cookies from '{self.state_file}'")
+
+
+    def save(self):
+
+        try:
+            write_json_state(self.state_file, {'crumb': self.crumb, 'cookies': self.cookies})
+        except OSError as e:
+            print(f"WARNING(Yahoo_Session::save()):  Unable to write '{self.state_file}':  {str(e)}")
+
+
+    def new_session(self):
+
+        if 0 == len(config.runtime_params['ca_cert']):
+            return Session(impersonate="chrome")
+        else:
+            return Session(impersonate="chrome", proxies=config.runtime_params['proxies'], verify=config.runtime_params['ca_cert'])
+
+
+    #  Obtain fresh cookies and crumb from Yahoo.  Called with self.lock held.
+    def refresh(self):
+
+        print(f"YAHOO SESSION({self.src_name}):  Obtaining new cookies and crumb")
+
+        session = self.new_session()
+
+        session = setup_session(session)
+        crumb   = get_crumb(session)
+
+        self.cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'secure': c.secure}
+                        for c in session.cookies.jar]
+        self.crumb = crumb
+
+        self.generation += 1
+
+        if crumb is not None:
+            self.save()
+
+        #  The session used to obtain the crumb serves the calling thread
+        self.local.session    = session
+        self.local.generation = self.generation
+
+
+    #  Return this thread's session and the crumb, obtaining cookies and crumb first if none are held
+    def get_session(self):
+
+        with self.lock:
+            if self.crumb is None:
+                self.refresh()
+
+            crumb      = self.crumb
+            generation = self.generation
+
+        if getattr(self.local, 'generation', None) != generation:
+            session = self.new_session()
+
+            for c in self.cookies:
+                session.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'], secure=c['secure'])
+
+            self.local.session    = session
+            self.local.generation = generation
+
+        return self.local.session, crumb
+
+
+    def get_ticker(self, symbols):
+
+        session, crumb = self.get_session()
+
+        if self.executor is None:
+            return Ticker(symbols, session=session, crumb=crumb, columnar=self.columnar, cache=self.cache)
+
+        return Ticker(symbols, session=session, crumb=crumb, columnar=self.columnar, cache=self.cache,
+                      executor=self.executor, session_factory=self.thread_session, request_gate=self.request_gate)
+
+
+    #  Discard cookies and crumb after Yahoo rejected them.  'generation' is the one the rejected query
+    #  used so that threads failing together only trigger one refresh.
+    def invalidate(self, generation):
+
+        with self.lock:
+            if generation == self.generation:
+                self.refresh()
+
+
+    #  Make a query with 'fetch(yq_tickers)', refreshing the cookies and crumb and retrying once if Yahoo rejects them
+    def fetch(self, symbols, fetch):
+
+        for attempt in [1, 2]:
+            yq_tickers = self.get_ticker(symbols)
+            generation = self.local.generation
+
+            try:
+                response = fetch(yq_tickers)
+            except Exception as e:
+                if (1 == attempt) and auth_error_re.search(str(e)):
+                    print(f"YAHOO SESSION({self.src_name}):  Query rejected ({str(e)[:80]}).  Refreshing cookies and crumb.")
+                    self.invalidate(generation)
+                    continue
+
+                raise
+
+            if (1 == attempt) and auth_error_rsp.search(response):
+                print(f"YAHOO SESSION({self.src_name}):  Query rejected (authorization error in response).  Refreshing cookies and crumb.")
+                self.invalidate(generation)
+                continue
+
+            return response
@@ -2,19 +2,17 @@
 import logging
 import os
 import time
-from concurrent.futures import as_completed
+from concurrent.futures import Future, as_completed
 from datetime import datetime
 
-# third party
-from requests_futures.sessions import FuturesSession
-from tqdm import tqdm
-
 # first party
 from yahooquery.headless import YahooFinanceHeadless, _has_selenium
 from yahooquery.utils import (
     convert_to_list,
     get_crumb,
     initialize_session,
+    is_futures_session,
+    progress_bar,
     setup_session,
 )
 from yahooquery.utils.countries import COUNTRIES
@@ -598,6 +596,7 @@ class _YahooFinance(object):
         "quoteSummary": {
             "path": "https://query2.finance.yahoo.com/v10/finance/quoteSummary/{symbol}",
             "response_field": "quoteSummary",
+            "cache_ttl": 15 * 60,
             "query": {
                 "formatted": {"required": False, "default": False},
                 "modules": {
@@ -610,6 +609,9 @@ class _YahooFinance(object):
         "fundamentals": {
             "path": "https://query2.finance.yahoo.com/ws/fundamentals-timeseries/v1/finance/timeseries/{symbol}",
             "response_field": "timeseries",
+            "cache_ttl": 6 * 60 * 60,
+            # The default period2 is the time the module was loaded
+            "cache_ignore": ["period2"],
             "query": {
                 "period1": {"required": True, "default": 493590046},
                 "period2": {"required": True, "default": int(time.time())},
@@ -625,6 +627,9 @@ class _YahooFinance(object):
         "fundamentals_premium": {
             "path": "https://query2.finance.yahoo.com/ws/fundamentals-timeseries/v1/finance/premium/timeseries/{symbol}",
             "response_field": "timeseries",
+            "cache_ttl": 6 * 60 * 60,
+            # The default period2 is the time the module was loaded
+            "cache_ignore": ["period2"],
             "query": {
                 "period1": {"required": True, "default": 493590046},
                 "period2": {"required": True, "default": int(time.time())},
@@ -640,6 +645,7 @@ class _YahooFinance(object):
         "chart": {
             "path": "https://query2.finance.yahoo.com/v8/finance/chart/{symbol}",
             "response_field": "chart",
+            "cache_ttl": 60,
             "query": {
                 "period1": {"required": False, "default": None},
                 "period2": {"required": False, "default": None},
@@ -689,6 +695,7 @@ class _YahooFinance(object):
         "options": {
             "path": "https://query2.finance.yahoo.com/v7/finance/options/{symbol}",
             "response_field": "optionChain",
+            "cache_ttl": 60,
             "query": {
                 "formatted": {"required": False, "default": False},
                 "date": {"required": False, "default": None},
@@ -718,11 +725,13 @@ class _YahooFinance(object):
         "recommendations": {
             "path": "https://query2.finance.yahoo.com/v6/finance/recommendationsbysymbol/{symbol}",
             "response_field": "finance",
+            "cache_ttl": 60 * 60,
             "query": {},
         },
         "insights": {
             "path": "https://query2.finance.yahoo.com/ws/insights/v2/finance/insights",
             "response_field": "finance",
+            "cache_ttl": 60 * 60,
             "query": {
                 "symbol": {"required": True, "default": None},
                 "reportsCount": {"required": False, "default": None},
@@ -943,7 +952,24 @@ class _YahooFinance(object):
         self.username = kwargs.pop("username", os.getenv("YF_USERNAME", None))
         self.password = kwargs.pop("password", os.getenv("YF_PASSWORD", None))
         self._setup_url = kwargs.pop("setup_url", os.getenv("YF_SETUP_URL", None))
+        crumb = kwargs.pop("crumb", None)
+        # Concurrent mode:  requests are submitted to ``executor``, each made
+        # with the session ``session_factory`` returns for the worker thread
+        # after ``request_gate`` (e.g. a rate limiter) lets it through
+        self._executor = kwargs.pop("executor", None)
+        self._session_factory = kwargs.pop("session_factory", None)
+        self._request_gate = kwargs.pop("request_gate", None)
+        # Responses of the endpoints with a cache_ttl are looked up in and
+        # added to ``cache`` (a ResponseCache, possibly shared by Tickers)
+        self._cache = kwargs.pop("cache", None)
+        # The _LOC methods return a ColumnarResult rather than a dict
+        self.columnar = kwargs.pop("columnar", False)
         self.session = initialize_session(kwargs.pop("session", None), **kwargs)
+        # A crumb obtained earlier means the session already carries the
+        # matching cookies, so the consent and crumb round trips are skipped
+        if crumb is not None:
+            self.crumb = crumb
+            return
         if self.username and self.password:
             self.login()
         else:
@@ -1018,11 +1044,25 @@ class _YahooFinance(object):
             )
         self.session = setup_session(self.session, self._setup_url)
 
+    def _columnar_result(self, data, method):
+        if not self.columnar or not isinstance(data, (dict, list)):
+            return data
+        # first party
+        from yahooquery.columnar import ColumnarResult
+
+        return ColumnarResult.from_data(data, {"method": method})
+
+    @property
+    def _is_async(self):
+        return is_futures_session(self.session) or self._executor is not None
+
     def _chunk_symbols(self, key, params={}, chunk=None, **kwargs):
         current_symbols = self.symbols
         all_data = [] if kwargs.get("list_result") else {}
         chunk = chunk or self.CHUNK
-        for i in tqdm(range(0, len(current_symbols), chunk), disable=not self.progress):
+        if self._is_async:
+            return self._chunk_symbols_async(key, params, chunk, all_data, **kwargs)
+        for i in progress_bar(range(0, len(current_symbols), chunk), disable=not self.progress):
             self._symbols = current_symbols[i : i + chunk]
             data = self._get_data(key, params, disable=True, **kwargs)
             if isinstance(data, str):
@@ -1034,6 +1074,23 @@ class _YahooFinance(object):
         self.symbols = current_symbols
         return all_data
 
+    def _chunk_symbols_async(self, key, params, chunk, all_data, **kwargs):
+        """Issue the requests of all chunks before waiting on any of them"""
+        current_symbols = self.symbols
+        started = []
+        for i in range(0, len(current_symbols), chunk):
+            self._symbols = current_symbols[i : i + chunk]
+            started.append(self._start_data(key, dict(params), disable=True, **kwargs))
+        self.symbols = current_symbols
+        for request in started:
+            data = self._finish_data(*request, disable=True, **kwargs)
+            if isinstance(data, str):
+                return data
+            all_data.extend(data) if isinstance(all_data, list) else all_data.update(
+                data
+            )
+        return all_data
+
     @property
     def validation(self):
         """Symbol Validation
@@ -1091,12 +1148,19 @@ class _YahooFinance(object):
         return obj
 
     def _get_data(self, key, params={}, **kwargs):
+        return self._finish_data(*self._start_data(key, params, **kwargs), **kwargs)
+
+    def _start_data(self, key, params, **kwargs):
+        """Construct and issue the requests (asynchronous requests are not waited on)"""
         config = self._CONFIG[key]
         params = self._construct_params(config, params)
-        urls = self._construct_urls(config, params, **kwargs)
-        response_field = config["response_field"]
+        urls = self._construct_urls(config, params, endpoint=key, **kwargs)
+        return config["response_field"], urls, params
+
+    def _finish_data(self, response_field, urls, params, **kwargs):
+        """Collect the responses to the requests issued by _start_data"""
         try:
-            if isinstance(self.session, FuturesSession):
+            if self._is_async:
                 data = self._async_requests(response_field, urls, params, **kwargs)
             else:
                 data = self._sync_requests(response_field, urls, params, **kwargs)
@@ -1146,37 +1210,94 @@ class _YahooFinance(object):
         """Construct URL requests"""
         if kwargs.get("method") == "post":
             urls = [
-                self.session.post(
-                    url=config["path"], params=params, json=kwargs.get("payload")
+                self._request(
+                    "post", url=config["path"], params=params, json=kwargs.get("payload")
                 )
             ]
         elif "symbol" in config["query"]:
             ls = (
                 params
-                if isinstance(self.session, FuturesSession)
-                else tqdm(params, disable=not self.progress)
+                if self._is_async
+                else progress_bar(params, disable=not self.progress)
             )
-            urls = [self.session.get(url=config["path"], params=p) for p in ls]
+            urls = [
+                self._cached_request(
+                    config, kwargs.get("endpoint"), p["symbol"], url=config["path"], params=p
+                )
+                for p in ls
+            ]
         elif "symbols" in config["query"]:
             params.update({"symbols": ",".join(self._symbols)})
-            urls = [self.session.get(url=config["path"], params=params)]
+            urls = [self._request("get", url=config["path"], params=params)]
         else:
             ls = (
                 self._symbols
-                if isinstance(self.session, FuturesSession)
-                else tqdm(self._symbols, disable=not self.progress)
+                if self._is_async
+                else progress_bar(self._symbols, disable=not self.progress)
             )
             urls = [
-                self.session.get(
-                    url=config["path"].format(**{"symbol": symbol}), params=params
+                self._cached_request(
+                    config,
+                    kwargs.get("endpoint"),
+                    symbol,
+                    url=config["path"].format(**{"symbol": symbol}),
+                    params=params,
                 )
                 for symbol in ls
             ]
         return urls
 
+    def _request(self, method, **kwargs):
+        """Make a request, or submit it to the executor in concurrent mode"""
+        if self._executor is None:
+            return getattr(self.session, method)(**kwargs)
+        return self._executor.submit(self._gated_request, method, **kwargs)
+
+    def _cached_request(self, config, endpoint, symbol, **kwargs):
+        """
+        Make a GET request, answered from the cache when the endpoint has a
+        cache_ttl and a response to the same request has not expired
+        """
+        ttl = config.get("cache_ttl")
+        if self._cache is None or not ttl or is_futures_session(self.session):
+            return self._request("get", **kwargs)
+        key = self._cache.make_key(config, symbol, kwargs["params"])
+        response = self._cache.get(key, endpoint)
+        if response is not None:
+            if self._executor is None:
+                return response
+            future = Future()
+            future.set_result(response)
+            return future
+        if self._executor is None:
+            return self._store_response(
+                key, endpoint, ttl, self.session.get(**kwargs)
+            )
+        return self._executor.submit(
+            self._store_gated_request, key, endpoint, ttl, **kwargs
+        )
+
+    def _store_gated_request(self, key, endpoint, ttl, **kwargs):
+        return self._store_response(
+            key, endpoint, ttl, self._gated_request("get", **kwargs)
+        )
+
+    def _store_response(self, key, endpoint, ttl, response):
+        if response.status_code == 200:
+            self._cache.put(key, endpoint, response.url, response.content, ttl)
+        return response
+
+    def _gated_request(self, method, **kwargs):
+        if self._request_gate is not None:
+            self._request_gate()
+        session = self.session
+        if self._session_factory is not None:
+            session = self._session_factory()
+        return getattr(session, method)(**kwargs)
+
     def _async_requests(self, response_field, urls, params, **kwargs):
         data = {}
-        for future in tqdm(
+        for future in progress_bar(
             as_completed(urls),
             total=len(urls),
             disable=kwargs.get("disable", not self.progress),
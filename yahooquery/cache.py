@@ -0,0 +1,177 @@
+# stdlib
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class CachedResponse(object):
+    """
+    Stands in for the HTTP response a cached body came from, with what the
+    _YahooFinance request handling reads from a response
+    """
+
+    status_code = 200
+
+    def __init__(self, url, content):
+        self.url = url
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache(object):
+    """
+    Cache of the responses to the requests of the endpoints whose _CONFIG
+    entry has a ``cache_ttl`` (seconds), keyed by endpoint, symbol and
+    query parameters
+
+    Responses are kept as received (bytes) so that every hit is parsed
+    into new objects which the caller is free to modify.  The most
+    recently used ``max_entries`` are kept in memory.  With ``disk_dir``
+    every response is also written to a file there, which outlives the
+    process until the response expires.
+
+    Parameters
+    ----------
+    max_entries: int, default 1024, optional
+        Number of responses kept in memory
+    disk_dir: str, default None, optional
+        Directory of the on-disk tier.  None for memory only
+    """
+
+    def __init__(self, max_entries=1024, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @staticmethod
+    def make_key(config, symbol, params):
+        """
+        Key of a request:  the endpoint, the symbol and the query parameters
+        other than the crumb and those in the endpoint's ``cache_ignore``
+        """
+        ignore = set(config.get("cache_ignore", [])) | {"crumb", "symbol"}
+        items = sorted(
+            (k, str(v)) for k, v in params.items() if k not in ignore and v is not None
+        )
+        return json.dumps([config["path"], symbol, items], separators=(",", ":"))
+
+    def _count(self, endpoint, event):
+        counts = self._stats.setdefault(
+            endpoint, {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        )
+        counts[event] += 1
+
+    def _file_name(self, key):
+        return os.path.join(
+            self.disk_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".cache"
+        )
+
+    def get(self, key, endpoint):
+        """
+        The cached response for ``key`` as a CachedResponse, or None when
+        there is none or it expired
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._count(endpoint, "hits")
+                    return CachedResponse(entry[1], entry[2])
+                del self._entries[key]
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._count(endpoint, "misses")
+                return None
+            self._count(endpoint, "disk_hits")
+            self._remember(key, entry)
+        return CachedResponse(entry[1], entry[2])
+
+    def put(self, key, endpoint, url, content, ttl):
+        """Keep the response ``content`` to the request ``url`` for ``ttl`` seconds"""
+        entry = (time.time() + ttl, url, content)
+        with self._lock:
+            self._count(endpoint, "stores")
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, "rb") as fp:
+                header = json.loads(fp.readline())
+                content = fp.read()
+        except (OSError, ValueError):
+            return None
+        if header.get("key") != key:
+            return None
+        if header["expires"] <= now:
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+            return None
+        return header["expires"], header["url"], content
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        file_name = self._file_name(key)
+        header = json.dumps({"key": key, "expires": entry[0], "url": entry[1]})
+        tmp_name = "{}.{}.tmp".format(file_name, threading.get_ident())
+        try:
+            # Written aside and renamed so readers never see part of a file
+            with open(tmp_name, "wb") as fp:
+                fp.write(header.encode("utf-8") + b"\n" + entry[2])
+            os.replace(tmp_name, file_name)
+        except OSError:
+            pass
+
+    def clear(self):
+        """Drop every response, in memory and on disk"""
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".cache"):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, name))
+                    except OSError:
+                        pass
+
+    def stats(self):
+        """
+        Hits, disk hits, misses and stores by endpoint plus the number of
+        responses in memory
+
+        Returns
+        -------
+        dict
+        """
+        with self._lock:
+            stats = {endpoint: dict(counts) for endpoint, counts in self._stats.items()}
+            stats["entries"] = len(self._entries)
+        return stats
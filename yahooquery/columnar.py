@@ -0,0 +1,355 @@
+# stdlib
+import json
+import struct
+
+# third party
+import numpy as np
+
+MAGIC = b"YQC1"
+HEADER = struct.Struct("<4sI")
+ALIGN = 8
+
+# Lists shorter than this stay in the metadata as they are
+MIN_COLUMN = 4
+MIN_RECORDS = 2
+
+# Floats represent every integer up to this exactly
+MAX_EXACT_INT = 2**53
+
+# Keys of the placeholder dictionaries in the metadata tree
+COL = "$col"
+REC = "$rec"
+ESC = "$esc"
+
+
+class ColumnarResult(object):
+    """
+    Columnar form of the dict returned by a ``_LOC`` method
+
+    Every list of numbers (timestamps, OHLCV, strikes, implied volatility,
+    ...) becomes a NumPy array and every list of dictionaries with the same
+    keys (e.g. the contracts of an option chain) is stored field by field,
+    so each field is one array as well.  Everything else stays in a small
+    metadata tree, which refers to the arrays by index.
+
+    The conversion is lossless:  ``to_data`` rebuilds the original dict,
+    with the same key order, ints and floats, and nulls, so ``to_json``
+    produces the same JSON as dumping the original dict.
+
+    Parameters
+    ----------
+    tree: dict
+        Metadata tree, as built by ``from_data``
+    arrays: list
+        NumPy arrays referred to by the tree
+    meta: dict, default None, optional
+        Small dict describing the result (e.g. the method which produced it)
+    """
+
+    def __init__(self, tree, arrays, meta=None):
+        self.tree = tree
+        self.arrays = arrays
+        self.meta = meta or {}
+
+    @classmethod
+    def from_data(cls, data, meta=None):
+        """
+        Build the columnar form of ``data``
+
+        Parameters
+        ----------
+        data: dict or list
+            Result of a ``_LOC`` method
+        meta: dict, default None, optional
+            Small dict describing the result
+
+        Returns
+        -------
+        ColumnarResult
+        """
+        arrays = []
+        tree = _encode(data, arrays)
+        return cls(tree, arrays, meta)
+
+    def to_data(self):
+        """
+        Rebuild the dict the result was built from
+
+        Returns
+        -------
+        dict or list
+        """
+        return _decode(self.tree, self.arrays)
+
+    def to_json(self, **kwargs):
+        """
+        JSON of the dict the result was built from, as ``json.dumps`` of
+        that dict gives it
+
+        Parameters
+        ----------
+        kwargs:
+            Passed to ``json.dumps``
+
+        Returns
+        -------
+        str
+        """
+        return json.dumps(self.to_data(), **kwargs)
+
+    def column(self, *path):
+        """
+        NumPy array of one column, e.g. ``column("AAPL", "timestamp")`` or
+        ``column("AAPL", "options", 0, "calls", "strike")``
+
+        Parameters
+        ----------
+        path: str or int
+            Keys and list indices leading to the column.  A field of a list
+            of dictionaries is named after the list
+
+        Returns
+        -------
+        numpy.ndarray
+            The values, as floats with NaN for nulls when there are nulls
+
+        Raises
+        ------
+        KeyError
+            If there is no column at ``path``
+        """
+        node = self.tree
+        for key in path:
+            if isinstance(node, dict) and REC in node:
+                rec = node[REC]
+                if isinstance(key, int):
+                    # One dictionary of the list:  its fields which are not
+                    # in a column of their own
+                    node = {
+                        k: col[key]
+                        for k, col in zip(rec["keys"], rec["cols"])
+                        if isinstance(col, list)
+                    }
+                else:
+                    node = rec["cols"][rec["keys"].index(key)]
+            elif isinstance(node, dict) and ESC in node:
+                node = node[ESC][key]
+            else:
+                node = node[key]
+        if not (isinstance(node, dict) and COL in node):
+            raise KeyError("No column at {}".format(path))
+        values = self.arrays[node[COL]]
+        if node.get("null") is None:
+            return values
+        values = values.astype(np.float64)
+        values[_unpack_mask(self.arrays[node["null"]], len(values))] = np.nan
+        return values
+
+    def to_bytes(self):
+        """
+        Serialize to a compact binary frame:  a header, the metadata tree as
+        JSON and the raw little-endian data of each array, aligned to 8
+        bytes
+
+        Returns
+        -------
+        bytes
+        """
+        layout = []
+        offset = 0
+        for array in self.arrays:
+            layout.append([array.dtype.str, len(array), offset])
+            offset += _padded(array.nbytes)
+        head = json.dumps(
+            {"tree": self.tree, "arrays": layout, "meta": self.meta},
+            separators=(",", ":"),
+        ).encode("utf-8")
+        parts = [HEADER.pack(MAGIC, len(head)), head]
+        parts.append(b"\0" * (_padded(HEADER.size + len(head)) - HEADER.size - len(head)))
+        for array in self.arrays:
+            raw = array.tobytes()
+            parts.append(raw)
+            parts.append(b"\0" * (_padded(len(raw)) - len(raw)))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, frame):
+        """
+        Deserialize a frame made by ``to_bytes``.  The arrays are read-only
+        views of ``frame``
+
+        Parameters
+        ----------
+        frame: bytes or memoryview
+
+        Returns
+        -------
+        ColumnarResult
+
+        Raises
+        ------
+        ValueError
+            If ``frame`` is not a columnar frame
+        """
+        magic, head_len = HEADER.unpack_from(frame, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a columnar frame")
+        head = json.loads(bytes(frame[HEADER.size : HEADER.size + head_len]))
+        base = _padded(HEADER.size + head_len)
+        arrays = [
+            np.frombuffer(frame, dtype=np.dtype(dtype), count=count, offset=base + offset)
+            for dtype, count, offset in head["arrays"]
+        ]
+        return cls(head["tree"], arrays, head["meta"])
+
+    @staticmethod
+    def is_frame(frame):
+        """Whether ``frame`` starts like a frame made by ``to_bytes``"""
+        return bytes(frame[: len(MAGIC)]) == MAGIC
+
+
+def _padded(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _pack_mask(mask):
+    return np.packbits(np.array(mask, dtype=bool))
+
+
+def _unpack_mask(packed, count):
+    return np.unpackbits(packed, count=count).astype(bool)
+
+
+def _add_array(arrays, array):
+    arrays.append(array)
+    return len(arrays) - 1
+
+
+def _column_kind(values):
+    """
+    'i' for a list of ints, 'f' for floats, 'n' for ints and floats mixed
+    (JSON writes whole floats as ints) and None for anything else.  Nulls
+    may appear in any
+    """
+    types = set(map(type, values))
+    types.discard(type(None))
+    if not types or not types <= {int, float}:
+        return None
+    if int in types:
+        ints = values if types == {int} and None not in values else [
+            value for value in values if type(value) is int
+        ]
+        if not -MAX_EXACT_INT <= min(ints) <= max(ints) <= MAX_EXACT_INT:
+            return None
+    if len(types) == 2:
+        return "n"
+    return "i" if int in types else "f"
+
+
+def _encode_column(values, kind, arrays):
+    has_nulls = None in values
+    if has_nulls:
+        nulls = [value is None for value in values]
+        values = [0 if value is None else value for value in values]
+    array = np.array(values, dtype="<i8" if kind == "i" else "<f8")
+    if kind != "i" and not np.isfinite(array).all():
+        return None
+    node = {COL: _add_array(arrays, array)}
+    node["null"] = _add_array(arrays, _pack_mask(nulls)) if has_nulls else None
+    if kind == "n":
+        node["int"] = _add_array(arrays, _pack_mask([t is int for t in map(type, values)]))
+    return node
+
+
+def _decode_column(node, arrays):
+    values = arrays[node[COL]].tolist()
+    if node.get("int") is not None:
+        ints = _unpack_mask(arrays[node["int"]], len(values))
+        values = [int(v) if i else v for v, i in zip(values, ints.tolist())]
+    if node.get("null") is not None:
+        nulls = _unpack_mask(arrays[node["null"]], len(values))
+        values = [None if n else v for v, n in zip(values, nulls.tolist())]
+    return values
+
+
+def _record_keys(records):
+    """
+    Keys of a list of dictionaries in the order they appear, or None if
+    the dictionaries do not list their common keys in the same order
+    """
+    keys = []
+    position = {}
+    for record in records:
+        last = -1
+        for key in record:
+            if key not in position:
+                # A new key goes right after the previous key of the record
+                keys.insert(last + 1, key)
+                position = {k: i for i, k in enumerate(keys)}
+            if position[key] <= last:
+                return None
+            last = position[key]
+    return keys
+
+
+def _encode_records(records, keys, arrays):
+    cols = []
+    has = []
+    for key in keys:
+        present = [key in record for record in records]
+        values = [record.get(key) for record in records]
+        kind = _column_kind(values) if len(values) >= MIN_COLUMN else None
+        col = _encode_column(values, kind, arrays) if kind else None
+        cols.append(col or [_encode(value, arrays) for value in values])
+        has.append(None if all(present) else _add_array(arrays, _pack_mask(present)))
+    return {REC: {"keys": keys, "cols": cols, "has": has, "len": len(records)}}
+
+
+def _decode_records(rec, arrays):
+    count = rec["len"]
+    records = [{} for _ in range(count)]
+    for key, col, has in zip(rec["keys"], rec["cols"], rec["has"]):
+        if isinstance(col, dict):
+            values = _decode_column(col, arrays)
+        else:
+            values = [_decode(value, arrays) for value in col]
+        present = [True] * count if has is None else _unpack_mask(arrays[has], count).tolist()
+        for record, value, here in zip(records, values, present):
+            if here:
+                record[key] = value
+    return records
+
+
+def _encode(data, arrays):
+    if isinstance(data, dict):
+        node = {key: _encode(value, arrays) for key, value in data.items()}
+        # Keep dicts of the data from being taken for placeholders
+        if any(key in (COL, REC, ESC) for key in data):
+            return {ESC: node}
+        return node
+    if isinstance(data, list):
+        if len(data) >= MIN_COLUMN:
+            kind = _column_kind(data)
+            col = _encode_column(data, kind, arrays) if kind else None
+            if col:
+                return col
+        if len(data) >= MIN_RECORDS and all(isinstance(item, dict) for item in data):
+            keys = _record_keys(data)
+            if keys:
+                return _encode_records(data, keys, arrays)
+        return [_encode(item, arrays) for item in data]
+    return data
+
+
+def _decode(node, arrays):
+    if isinstance(node, dict):
+        if COL in node:
+            return _decode_column(node, arrays)
+        if REC in node:
+            return _decode_records(node[REC], arrays)
+        if ESC in node:
+            node = node[ESC]
+        return {key: _decode(value, arrays) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_decode(item, arrays) for item in node]
+    return node
@@ -1,10 +1,7 @@
 # stdlib
 import os
 
-# third party
-import pandas as pd
-
-from .utils import get_crumb, initialize_session, setup_session
+from .utils import get_crumb, initialize_session, pd, setup_session
 from .utils.countries import COUNTRIES
 
 BASE_URL = "https://query2.finance.yahoo.com"
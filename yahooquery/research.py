@@ -2,11 +2,8 @@
 import json
 from datetime import datetime, timedelta
 
-# third party
-import pandas as pd
-
 from .base import _YahooFinance
-from .utils import convert_to_list
+from .utils import convert_to_list, pd
 
 
 class Research(_YahooFinance):
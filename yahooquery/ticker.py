@@ -1,13 +1,17 @@
 # stdlib
+import bisect
 import re
 from datetime import datetime, timedelta
 
-# third party
-import pandas as pd
-
 # first party
 from yahooquery.base import _YahooFinance
-from yahooquery.utils import _history_dataframe, convert_to_timestamp, flatten_list
+from yahooquery.utils import (
+    _history_dataframe,
+    convert_to_timestamp,
+    flatten_list,
+    option_window_dates,
+    pd,
+)
 import json
 
 
@@ -28,9 +32,24 @@ class Ticker(_YahooFinance):
         A factor, in seconds, to apply between attempts after a second try.
         Done only when there is a failed request and error code is in the
         status_forcelist
+    cache: yahooquery.cache.ResponseCache, default None, optional
+        Answer the requests to endpoints with a ``cache_ttl`` in _CONFIG
+        (quoteSummary, fundamentals, chart, options, ...) from this cache
+        while the responses have not expired.  May be shared by Tickers
+    columnar: bool, default False, optional
+        The _LOC methods return a ColumnarResult (NumPy arrays for the
+        series of numbers plus a metadata tree) rather than a dict.  Its
+        to_json gives the JSON of the dict
     country: str, default 'united states', optional
         This allows you to alter the following query parameters that are
         sent with each request:  lang, region, and corsDomain.
+    crumb: str, default None, optional
+        Crumb obtained earlier for the cookies already held by ``session``.
+        When given, the consent page and crumb requests are not made.
+    executor: concurrent.futures.Executor, default None, optional
+        Submit the requests to this executor and wait for all of them rather
+        than making them one after the other.  Used with ``session_factory``
+        and ``request_gate``
     formatted: bool, default False, optional
         Quantitative values are given as dictionaries with at least two
         keys:  'raw' and 'fmt'.  The 'raw' key expresses value numerically
@@ -41,8 +60,14 @@ class Ticker(_YahooFinance):
         This only matters when asynchronous=True
     proxies: dict, default None, optional
         Allows for the session to use a proxy when making requests
+    request_gate: callable, default None, optional
+        Called by the executor thread before each request, e.g. to wait on
+        a rate limiter
     retry: int, default 5, optional
         Number of times to retry on a failed request
+    session_factory: callable, default None, optional
+        Returns the session the calling executor thread makes its requests
+        with, for sessions which must not be shared between threads
     status_forcelist: list, default [404, 429, 500, 502, 503, 504], optional
         A set of integer HTTP status codes taht we should force a retry on
     timeout: int, default 5, optional
@@ -168,6 +193,38 @@ class Ticker(_YahooFinance):
             self._CONFIG["quoteSummary"]["query"]["modules"]["options"]
         )
 
+    def get_modules_LOC(self, groups):
+        """
+        Obtain several groups of quoteSummary modules with one request per
+        symbol
+
+        Parameters
+        ----------
+        groups: dict
+            Lists of modules keyed by a name for the group
+
+        Returns
+        -------
+        dict
+            For each group name, the modules of the group for each symbol
+        """
+        modules = list(dict.fromkeys(flatten_list(list(groups.values()))))
+        data = self._get_modules(modules)
+        if len(modules) == 1:
+            # A single module comes back without the module layer
+            return self._columnar_result(
+                {name: data for name in groups}, "get_modules_LOC"
+            )
+        split = {}
+        for name, name_modules in groups.items():
+            split[name] = {
+                symbol: {m: v for m, v in value.items() if m in name_modules}
+                if isinstance(value, dict)
+                else value
+                for symbol, value in data.items()
+            }
+        return self._columnar_result(split, "get_modules_LOC")
+
     def get_modules(self, modules):
         """
         Obtain specific quoteSummary modules for given symbol(s)
@@ -186,6 +243,9 @@ class Ticker(_YahooFinance):
         ValueError
             If invalid module is specified
         """
+        return self._columnar_result(self._get_modules(modules), "get_modules")
+
+    def _get_modules(self, modules):
         all_modules = self._CONFIG["quoteSummary"]["query"]["modules"]["options"]
         if not isinstance(modules, list):
             modules = re.findall(r"[a-zA-Z]+", modules)
@@ -580,6 +640,19 @@ class Ticker(_YahooFinance):
 
     def _financials_LOC(
         self, financials_type, frequency=None, premium=False, types=None, trailing=True
+    ):
+        key = "fundamentals_premium" if premium else "fundamentals"
+        prefixed_types = self._financials_types(
+            financials_type, frequency, premium, types, trailing
+        )
+        data = self._get_data(
+            key, {"type": ",".join(prefixed_types)}, **{"list_result": True}
+        )
+
+        return self._columnar_result(data, financials_type)
+
+    def _financials_types(
+        self, financials_type, frequency=None, premium=False, types=None, trailing=True
     ):
         try:
             time_dict = self.FUNDAMENTALS_TIME_ARGS[frequency[:1].lower()]
@@ -598,11 +671,50 @@ class Ticker(_YahooFinance):
             ]
         else:
             prefixed_types = ["{}{}".format(prefix, t) for t in types]
+        return prefixed_types
+
+    def financials_LOC(self, requests, premium=False):
+        """
+        Retrieve several kinds of financial data (e.g. balance sheet and
+        cash flow) with one request per symbol
+
+        Parameters
+        ----------
+        requests: dict
+            (financials_type, frequency, trailing) arguments as taken by
+            balance_sheet_LOC and the like, keyed by a name for the request
+        premium: bool, default False, optional
+            Use the premium endpoint
+
+        Returns
+        -------
+        dict
+            For each request name, the data of each symbol as returned by
+            the request made alone
+        """
+        key = "fundamentals_premium" if premium else "fundamentals"
+        types = {
+            name: self._financials_types(financials_type, frequency, premium, None, trailing)
+            for name, (financials_type, frequency, trailing) in requests.items()
+        }
+        all_types = list(dict.fromkeys(flatten_list(list(types.values()))))
         data = self._get_data(
-            key, {"type": ",".join(prefixed_types)}, **{"list_result": True}
+            key, {"type": ",".join(all_types)}, **{"list_result": True}
         )
-
-        return data
+        split = {}
+        for name, name_types in types.items():
+            name_types = set(name_types)
+            split[name] = {
+                symbol: [
+                    item
+                    for item in items
+                    if item.get("meta", {}).get("type", [None])[0] in name_types
+                ]
+                if isinstance(items, list)
+                else items
+                for symbol, items in data.items()
+            }
+        return self._columnar_result(split, "financials_LOC")
 
     def _financials_dataframes(self, data, period_type):
         data_type = data["meta"]["type"][0]
@@ -1530,7 +1642,7 @@ class Ticker(_YahooFinance):
             data = self._get_data("chart", params)
 #           df = self._historical_data_to_dataframe(data, params, adj_timezone)
 
-        return data
+        return self._columnar_result(data, "history_LOC")
 
     def _history_1m(self, adj_timezone=True, adj_ohlc=False):
         params = {"interval": "1m"}
@@ -1552,35 +1664,70 @@ class Ticker(_YahooFinance):
         return df
 
     def _history_1m_LOC(self, adj_timezone=True, adj_ohlc=False):
-        params = {"interval": "1m"}
         today = datetime.today()
         dates = [
             convert_to_timestamp((today - timedelta(7 * x)).date()) for x in range(5)
         ]
-        dataframes = []
-        merged_data = None
-        for i in range(len(dates) - 1):
-            params["period1"] = dates[i + 1]
-            params["period2"] = dates[i]
-            data = self._get_data("chart", params)
-
-            if merged_data is None:
-                merged_data = data
-            else:
-                for symbol in data:
-                    merged_data[symbol]['timestamp'] = data[symbol]['timestamp'] + merged_data[symbol]['timestamp']
-
-                    merged_data[symbol]['indicators']['quote'][0]['open']   = data[symbol]['indicators']['quote'][0]['open']   + merged_data[symbol]['indicators']['quote'][0]['open']
-                    merged_data[symbol]['indicators']['quote'][0]['high']   = data[symbol]['indicators']['quote'][0]['high']   + merged_data[symbol]['indicators']['quote'][0]['high']
-                    merged_data[symbol]['indicators']['quote'][0]['low']    = data[symbol]['indicators']['quote'][0]['low']    + merged_data[symbol]['indicators']['quote'][0]['low']
-                    merged_data[symbol]['indicators']['quote'][0]['close']  = data[symbol]['indicators']['quote'][0]['close']  + merged_data[symbol]['indicators']['quote'][0]['close']
-                    merged_data[symbol]['indicators']['quote'][0]['volume'] = data[symbol]['indicators']['quote'][0]['volume'] + merged_data[symbol]['indicators']['quote'][0]['volume']
-
-                    if 'adjclose' in data[symbol]['indicators']:
-                        merged_data[symbol]['indicators']['adjclose'][0]['adjclose'] = merged_data[symbol]['indicators']['adjclose'][0]['adjclose'] + data[symbol]['indicators']['adjclose'][0]['adjclose']
+        # Week windows, oldest first
+        windows = [
+            {"interval": "1m", "period1": dates[i + 1], "period2": dates[i]}
+            for i in reversed(range(len(dates) - 1))
+        ]
+        if self._is_async:
+            # Request every window before waiting on any
+            started = [self._start_data("chart", params) for params in windows]
+            data = [self._finish_data(*request) for request in started]
+        else:
+            data = [self._get_data("chart", params) for params in windows]
 
+        merged_data = {}
+        for symbol in self._symbols:
+            results = [d.get(symbol) for d in data if isinstance(d, dict)]
+            bars = [r for r in results if isinstance(r, dict) and r.get("timestamp")]
+            if bars:
+                merged_data[symbol] = self._merge_bars(bars)
+            elif results:
+                merged_data[symbol] = results[-1]
         return merged_data
 
+    @staticmethod
+    def _merge_bars(results):
+        """
+        Merge the chart results of consecutive windows (oldest first) into
+        one, copying each series once into preallocated lists.  Bars of a
+        window not after the last bar already merged (the overlap at window
+        boundaries) are dropped.
+        """
+        fields = ["open", "high", "low", "close", "volume"]
+        has_adjclose = all("adjclose" in r["indicators"] for r in results)
+        size = sum(len(r["timestamp"]) for r in results)
+        timestamp = [None] * size
+        quote = {field: [None] * size for field in fields}
+        adjclose = [None] * size if has_adjclose else None
+        n = 0
+        for r in results:
+            ts = r["timestamp"]
+            begin = bisect.bisect_right(ts, timestamp[n - 1]) if n else 0
+            end = n + len(ts) - begin
+            timestamp[n:end] = ts[begin:]
+            q = r["indicators"]["quote"][0]
+            for field in fields:
+                quote[field][n:end] = q.get(field, [None] * len(ts))[begin:]
+            if has_adjclose:
+                adjclose[n:end] = r["indicators"]["adjclose"][0]["adjclose"][begin:]
+            n = end
+        del timestamp[n:]
+        for field in fields:
+            del quote[field][n:]
+        indicators = {"quote": [quote]}
+        if has_adjclose:
+            del adjclose[n:]
+            indicators["adjclose"] = [{"adjclose": adjclose}]
+        merged = dict(results[-1])
+        merged["timestamp"] = timestamp
+        merged["indicators"] = indicators
+        return merged
+
     def _historical_data_to_dataframe(self, data, params, adj_timezone):
         d = {}
         for symbol in self._symbols:
@@ -1630,11 +1777,84 @@ class Ticker(_YahooFinance):
             return df
         return "No option chain data found"
 
+    def option_chain_window_LOC(
+        self, near=4, monthly_months=6, quarterly=True, moneyness=0.2
+    ):
+        """
+        Option chain restricted to a window of expirations and strikes
+
+        One request per symbol finds the expirations and the price of the
+        underlying, then one request per selected expiration (concurrent
+        when the Ticker is) fetches the strikes within the moneyness band.
+
+        Parameters
+        ----------
+        near: int, default 4, optional
+            Number of nearest expirations
+        monthly_months: int, default 6, optional
+            Include the monthly expirations within this many months
+        quarterly: bool, default True, optional
+            Include every quarterly expiration
+        moneyness: float, default 0.2, optional
+            Only strikes within this fraction of the price of the
+            underlying.  None for all strikes
+
+        Returns
+        -------
+        dict
+            Same layout as option_chain_LOC, with the ``options`` of the
+            selected expirations only
+        """
+        config = self._CONFIG["options"]
+        data = self._get_data("options")
+        requests = []
+        for symbol in self._symbols:
+            chain = data.get(symbol) if isinstance(data, dict) else None
+            if not isinstance(chain, dict) or not chain.get("expirationDates"):
+                continue
+            params = {}
+            price = chain.get("quote", {}).get("regularMarketPrice")
+            if price and moneyness is not None:
+                params["strikeMin"] = price * (1.0 - moneyness)
+                params["strikeMax"] = price * (1.0 + moneyness)
+            dates = option_window_dates(
+                chain["expirationDates"], near, monthly_months, quarterly
+            )
+            chain["options"] = []
+            for date in dates:
+                request = self._cached_request(
+                    config,
+                    "options",
+                    symbol,
+                    url=config["path"].format(symbol=symbol),
+                    params=self._construct_params(config, dict(params, date=date)),
+                )
+                requests.append((symbol, params, request))
+        for symbol, params, request in requests:
+            response = request.result() if self._is_async else request
+            json = self._validate_response(response.json(), config["response_field"])
+            result = self._construct_data(json, config["response_field"])
+            if not isinstance(result, dict):
+                continue
+            for option in result.get("options", []):
+                if params:
+                    # In case the strike range is not applied by the server
+                    for option_type in ["calls", "puts"]:
+                        option[option_type] = [
+                            contract
+                            for contract in option.get(option_type, [])
+                            if params["strikeMin"]
+                            <= contract.get("strike", 0)
+                            <= params["strikeMax"]
+                        ]
+                data[symbol]["options"].append(option)
+        return self._columnar_result(data, "option_chain_window_LOC")
+
 #   @property
     def option_chain_LOC(self):
         data = self._get_data("options", {"getAllData": True})
 
-        return data
+        return self._columnar_result(data, "option_chain_LOC")
 
         '''
         merged_data = {}
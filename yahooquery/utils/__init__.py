@@ -1,22 +1,57 @@
 # stdlib
 import datetime
+import importlib
 import logging
 import random
 import re
+import sys
+from html.parser import HTMLParser
 
 # third party
-import pandas as pd
 import requests
-from bs4 import BeautifulSoup
 from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, RetryError, SSLError
 from requests.packages.urllib3.util.retry import Retry
-from requests_futures.sessions import FuturesSession
 from urllib3.exceptions import MaxRetryError
 
 logger = logging.getLogger(__name__)
 
 
+class LazyModule(object):
+    """
+    Stand-in for a module which is imported on first attribute access, so
+    that heavy dependencies (pandas) are only loaded by the methods
+    which need them
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+pd = LazyModule("pandas")
+
+
+def is_futures_session(session):
+    # requests_futures is only loaded once an asynchronous session is made
+    sessions = sys.modules.get("requests_futures.sessions")
+    return sessions is not None and isinstance(session, sessions.FuturesSession)
+
+
+def progress_bar(iterable, disable=False, **kwargs):
+    if disable:
+        return iterable
+    # third party
+    from tqdm import tqdm
+
+    return tqdm(iterable, **kwargs)
+
+
 DEFAULT_TIMEOUT = 5
 DEFAULT_SESSION_URL = "https://finance.yahoo.com"
 CRUMB_FAILURE = (
@@ -1345,6 +1380,9 @@ class TimeoutHTTPAdapter(HTTPAdapter):
 def initialize_session(session=None, **kwargs):
     if session is None:
         if kwargs.get("asynchronous"):
+            # third party
+            from requests_futures.sessions import FuturesSession
+
             session = FuturesSession(max_workers=kwargs.get("max_workers", 8))
         else:
             session = requests.Session()
@@ -1367,6 +1405,20 @@ def initialize_session(session=None, **kwargs):
     return session
 
 
+class _InputValues(HTMLParser):
+    """Values of the first input element of each name in an HTML page"""
+
+    def __init__(self):
+        super(_InputValues, self).__init__()
+        self.values = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "input":
+            attrs = dict(attrs)
+            if "name" in attrs and "value" in attrs:
+                self.values.setdefault(attrs["name"], attrs["value"])
+
+
 def setup_session(session: requests.Session, url: str = None):
     url = url or DEFAULT_SESSION_URL
     try:
@@ -1381,19 +1433,20 @@ def setup_session(session: requests.Session, url: str = None):
             except SSLError:
                 counter += 1
 
-    if isinstance(session, FuturesSession):
+    if is_futures_session(session):
         response = response.result()
 
     # check for and handle consent page:w
     if response.url.find("consent") >= 0:
         logger.debug(f'Redirected to consent page: "{response.url}"')
 
-        soup = BeautifulSoup(response.content, "html.parser")
+        inputs = _InputValues()
+        inputs.feed(response.content.decode("utf-8", "replace"))
 
         params = {}
         for param in ["csrfToken", "sessionId"]:
             try:
-                params[param] = soup.find("input", attrs={"name": param})["value"]
+                params[param] = inputs.values[param]
             except Exception as exc:
                 logger.critical(
                     f'Failed to find or extract "{param}" from response. Exception={exc}'
@@ -1426,7 +1479,7 @@ def get_crumb(session):
         # Cookies most likely not set in previous request
         return None
 
-    if isinstance(session, FuturesSession):
+    if is_futures_session(session):
         crumb = response.result().text
     else:
         crumb = response.text
@@ -1442,6 +1495,31 @@ def flatten_list(ls):
     return [item for sublist in ls for item in sublist]
 
 
+def option_window_dates(expirations, near=4, monthly_months=6, quarterly=True):
+    """
+    Select the expirations (timestamps) of an option chain window:  the
+    ``near`` nearest, the monthly ones (third Friday) within
+    ``monthly_months`` months and, if ``quarterly``, every quarterly one
+    (monthly expirations in March, June, September and December)
+    """
+    expirations = sorted(expirations)
+    if not expirations:
+        return []
+    horizon = expirations[0] + monthly_months * 31 * 24 * 60 * 60
+    selected = set(expirations[:near])
+    for expiration in expirations:
+        day = datetime.datetime.fromtimestamp(expiration, datetime.timezone.utc).date()
+        # Third Friday, or the Thursday before when the Friday is a holiday
+        monthly = (day.weekday() == 4 and 15 <= day.day <= 21) or (
+            day.weekday() == 3 and 14 <= day.day <= 20
+        )
+        if monthly and expiration <= horizon:
+            selected.add(expiration)
+        elif monthly and quarterly and day.month in (3, 6, 9, 12):
+            selected.add(expiration)
+    return sorted(selected)
+
+
 def convert_to_list(symbols, comma_split=False):
     if isinstance(symbols, str):
         if comma_split:
@@ -1452,11 +1530,21 @@ def convert_to_list(symbols, comma_split=False):
 
 
 def convert_to_timestamp(date=None, start=True):
-    if date is not None:
+    # As pd.Timestamp(date).timestamp():  naive dates and times are taken as UTC
+    if date is None:
+        date = datetime.datetime(1942, 1, 1) if start else datetime.datetime.now()
+    elif isinstance(date, str):
+        try:
+            date = datetime.datetime.fromisoformat(date)
+        except ValueError:
+            return int(pd.Timestamp(date).timestamp())
+    elif not isinstance(date, datetime.date):
         return int(pd.Timestamp(date).timestamp())
-    if start:
-        return int(pd.Timestamp("1942-01-01").timestamp())
-    return int(pd.Timestamp.now().timestamp())
+    elif not isinstance(date, datetime.datetime):
+        date = datetime.datetime.combine(date, datetime.time())
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return int(date.timestamp())
 
 
 def _get_daily_index(data, index_utc, adj_timezone):